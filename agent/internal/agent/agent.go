@@ -3,10 +3,13 @@ package agent
 import (
 	"context"
 	"fmt"
+	"io"
 	"log"
 	"os/exec"
 	"runtime"
+	"sync"
 	"time"
+	"unicode/utf8"
 
 	"github.com/chatops/agent/internal/api"
 	"github.com/chatops/agent/internal/config"
@@ -20,6 +23,10 @@ type Agent struct {
 	ws      *api.WSClient
 	metrics *metrics.Collector
 	docker  *metrics.DockerClient
+
+	// request_id -> cancel func of a request being handled
+	inFlightMu sync.Mutex
+	inFlight   map[string]context.CancelFunc
 }
 
 // New creates a new agent instance
@@ -51,11 +58,12 @@ func New(cfg *config.Config) (*Agent, error) {
 	}
 
 	return &Agent{
-		config:  cfg,
-		api:     apiClient,
-		ws:      wsClient,
-		metrics: metricsCollector,
-		docker:  dockerClient,
+		config:   cfg,
+		api:      apiClient,
+		ws:       wsClient,
+		metrics:  metricsCollector,
+		docker:   dockerClient,
+		inFlight: make(map[string]context.CancelFunc),
 	}, nil
 }
 
@@ -127,15 +135,19 @@ func (a *Agent) handleMessages(ctx context.Context) {
 			msgType := message["type"]
 			switch msgType {
 			case "get_container_logs":
-				a.handleGetContainerLogs(ctx, message)
+				a.handleRequest(ctx, message, a.handleGetContainerLogs)
 			case "start_container":
-				a.handleStartContainer(ctx, message)
+				a.handleRequest(ctx, message, a.handleStartContainer)
 			case "stop_container":
-				a.handleStopContainer(ctx, message)
+				a.handleRequest(ctx, message, a.handleStopContainer)
 			case "restart_container":
-				a.handleRestartContainer(ctx, message)
+				a.handleRequest(ctx, message, a.handleRestartContainer)
 			case "execute_command":
-				a.handleExecuteCommand(ctx, message)
+				a.handleRequest(ctx, message, a.handleExecuteCommand)
+			case "execute_command_stream":
+				a.handleRequest(ctx, message, a.handleExecuteCommandStream)
+			case "cancel":
+				a.cancelRequest(message)
 			case "pong":
 				// Heartbeat response - ignore
 			case "metrics_received":
@@ -147,6 +159,42 @@ func (a *Agent) handleMessages(ctx context.Context) {
 	}
 }
 
+// handleRequest runs a request handler in its own goroutine with a context
+// that a "cancel" message for the same request_id cancels
+func (a *Agent) handleRequest(ctx context.Context, message map[string]interface{}, handler func(context.Context, map[string]interface{})) {
+	reqCtx, cancel := context.WithCancel(ctx)
+	requestID, _ := message["request_id"].(string)
+	if requestID != "" {
+		a.inFlightMu.Lock()
+		a.inFlight[requestID] = cancel
+		a.inFlightMu.Unlock()
+	}
+
+	go func() {
+		defer func() {
+			if requestID != "" {
+				a.inFlightMu.Lock()
+				delete(a.inFlight, requestID)
+				a.inFlightMu.Unlock()
+			}
+			cancel()
+		}()
+		handler(reqCtx, message)
+	}()
+}
+
+// cancelRequest stops a request the API no longer waits for
+func (a *Agent) cancelRequest(message map[string]interface{}) {
+	requestID, _ := message["request_id"].(string)
+	a.inFlightMu.Lock()
+	cancel, ok := a.inFlight[requestID]
+	a.inFlightMu.Unlock()
+	if ok {
+		log.Printf("Cancelling request %s", requestID)
+		cancel()
+	}
+}
+
 // handleStartContainer handles container start requests
 func (a *Agent) handleStartContainer(ctx context.Context, message map[string]interface{}) {
 	if a.docker == nil {
@@ -353,6 +401,120 @@ func (a *Agent) handleExecuteCommand(ctx context.Context, message map[string]int
 	})
 }
 
+// handleExecuteCommandStream runs a command and streams its stdout/stderr as
+// numbered command_output frames, followed by a command_exit frame
+func (a *Agent) handleExecuteCommandStream(ctx context.Context, message map[string]interface{}) {
+	cmdStr, ok := message["command"].(string)
+	commandID, _ := message["command_id"].(string)
+	if !ok || commandID == "" {
+		a.ws.SendResponse(message, map[string]interface{}{
+			"type":    "error",
+			"message": "Invalid command",
+		})
+		return
+	}
+
+	var cmd *exec.Cmd
+	if runtime.GOOS == "windows" {
+		cmd = exec.CommandContext(ctx, "cmd.exe", "/C", cmdStr)
+	} else {
+		cmd = exec.CommandContext(ctx, "sh", "-c", cmdStr)
+	}
+	stdout, err := cmd.StdoutPipe()
+	if err == nil {
+		var stderr io.ReadCloser
+		stderr, err = cmd.StderrPipe()
+		if err == nil {
+			err = cmd.Start()
+		}
+		if err == nil {
+			a.ws.SendResponse(message, map[string]interface{}{
+				"type": "command_started",
+				"data": map[string]interface{}{"command_id": commandID},
+			})
+			a.streamCommandOutput(cmd, commandID, stdout, stderr)
+			return
+		}
+	}
+	a.ws.SendResponse(message, map[string]interface{}{
+		"type":    "error",
+		"message": fmt.Sprintf("Failed to start command: %v", err),
+	})
+}
+
+// streamCommandOutput forwards output chunks until the command exits
+func (a *Agent) streamCommandOutput(cmd *exec.Cmd, commandID string, stdout, stderr io.Reader) {
+	// Sequence numbers are assigned and sent under one lock so frames arrive in order
+	var sendMu sync.Mutex
+	seq := 0
+	send := func(frame map[string]interface{}) {
+		sendMu.Lock()
+		defer sendMu.Unlock()
+		seq++
+		frame["command_id"] = commandID
+		frame["seq"] = seq
+		if err := a.ws.SendMessage(frame); err != nil {
+			log.Printf("Error sending output of command %s: %v", commandID, err)
+		}
+	}
+
+	var wg sync.WaitGroup
+	pump := func(r io.Reader, stream string) {
+		defer wg.Done()
+		buf := make([]byte, 16*1024)
+		// Bytes of a multibyte character cut off by the previous read
+		pending := 0
+		for {
+			n, err := r.Read(buf[pending:])
+			n += pending
+			complete := n
+			if err == nil {
+				complete = utf8Prefix(buf[:n])
+			}
+			if complete > 0 {
+				send(map[string]interface{}{
+					"type":   "command_output",
+					"stream": stream,
+					"data":   string(buf[:complete]),
+				})
+			}
+			pending = copy(buf, buf[complete:n])
+			if err != nil {
+				return
+			}
+		}
+	}
+	wg.Add(2)
+	go pump(stdout, "stdout")
+	go pump(stderr, "stderr")
+	wg.Wait()
+
+	exit := map[string]interface{}{"type": "command_exit", "exit_code": 0}
+	if err := cmd.Wait(); err != nil {
+		if exitError, ok := err.(*exec.ExitError); ok {
+			exit["exit_code"] = exitError.ExitCode()
+		} else {
+			exit["exit_code"] = 1
+			exit["error"] = err.Error()
+		}
+	}
+	send(exit)
+}
+
+// utf8Prefix returns the length of b without a trailing, incomplete UTF-8
+// sequence, so a chunk boundary never splits a character
+func utf8Prefix(b []byte) int {
+	for i := len(b) - 1; i >= 0 && i >= len(b)-utf8.UTFMax; i-- {
+		if utf8.RuneStart(b[i]) {
+			if utf8.FullRune(b[i:]) {
+				return len(b)
+			}
+			return i
+		}
+	}
+	return len(b)
+}
+
 // collectAndSendMetrics collects system metrics and sends them to the API
 func (a *Agent) collectAndSendMetrics(ctx context.Context) error {
 	if !a.config.MetricsEnabled {
@@ -6,6 +6,7 @@ import (
 	"log"
 	"net/http"
 	"net/url"
+	"sync"
 	"time"
 
 	"github.com/gorilla/websocket"
@@ -20,6 +21,8 @@ type WSClient struct {
 	done         chan struct{}
 	messageChan  chan map[string]interface{}
 	metricsAck   chan map[string]interface{}
+	// gorilla/websocket allows one concurrent writer
+	writeMu      sync.Mutex
 }
 
 // NewWSClient creates a new WebSocket client
@@ -157,7 +160,7 @@ func (c *WSClient) pingLoop() {
 			if c.conn == nil {
 				return
 			}
-			if err := c.conn.WriteJSON(map[string]string{"type": "ping"}); err != nil {
+			if err := c.writeJSON(map[string]string{"type": "ping"}); err != nil {
 				log.Printf("Error sending ping: %v", err)
 				return
 			}
@@ -188,7 +191,7 @@ func (c *WSClient) SendMetrics(ctx context.Context, metrics *Metrics) error {
 	}
 
 	// Send message
-	if err := c.conn.WriteJSON(message); err != nil {
+	if err := c.writeJSON(message); err != nil {
 		return fmt.Errorf("failed to send metrics: %w", err)
 	}
 
@@ -241,6 +244,21 @@ func (c *WSClient) SendResponse(originalMessage map[string]interface{}, response
 		response["request_id"] = reqID
 	}
 
-	return c.conn.WriteJSON(response)
+	return c.writeJSON(response)
+}
+
+// SendMessage sends an unsolicited message (not a reply to a request)
+func (c *WSClient) SendMessage(message map[string]interface{}) error {
+	if c.conn == nil {
+		return fmt.Errorf("WebSocket not connected")
+	}
+	return c.writeJSON(message)
+}
+
+// writeJSON serialises writes from the metrics loop, pings and request handlers
+func (c *WSClient) writeJSON(v interface{}) error {
+	c.writeMu.Lock()
+	defer c.writeMu.Unlock()
+	return c.conn.WriteJSON(v)
 }
 
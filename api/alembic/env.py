@@ -44,7 +44,9 @@ from app.models import (
     alert,
     api_key,
     metric,
+    metric_rollup,
     log_entry,
+    inventory_snapshot,
     command_history,
     connection_event,
     audit_log,
@@ -0,0 +1,32 @@
+"""add_api_key_prefix
+
+Revision ID: 5b9e2c71d4a3
+Revises: 28f16dd16437
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b9e2c71d4a3'
+down_revision: Union[str, Sequence[str], None] = '28f16dd16437'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing keys keep a NULL prefix and their bcrypt hash until they are next
+    # used, at which point the hash is rewritten as an HMAC digest.
+    op.add_column('api_keys', sa.Column('key_prefix', sa.String(), nullable=True))
+    op.create_index(op.f('ix_api_keys_key_prefix'), 'api_keys', ['key_prefix'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_api_keys_key_prefix'), table_name='api_keys')
+    op.drop_column('api_keys', 'key_prefix')
@@ -0,0 +1,89 @@
+"""add_metric_rollups
+
+Revision ID: 8c41f0a9e2b7
+Revises: 5b9e2c71d4a3
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41f0a9e2b7'
+down_revision: Union[str, Sequence[str], None] = '5b9e2c71d4a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLLUP_TABLES = ('metric_rollups_1m', 'metric_rollups_5m', 'metric_rollups_1h')
+
+
+def _series_columns():
+    return [
+        sa.Column('cpu_usage_percent_sum', sa.Float(), nullable=True),
+        sa.Column('cpu_usage_percent_count', sa.Integer(), nullable=False),
+        sa.Column('cpu_usage_percent_min', sa.Float(), nullable=True),
+        sa.Column('cpu_usage_percent_max', sa.Float(), nullable=True),
+        sa.Column('cpu_usage_percent_last', sa.Float(), nullable=True),
+        sa.Column('memory_usage_percent_sum', sa.Float(), nullable=True),
+        sa.Column('memory_usage_percent_count', sa.Integer(), nullable=False),
+        sa.Column('memory_usage_percent_min', sa.Float(), nullable=True),
+        sa.Column('memory_usage_percent_max', sa.Float(), nullable=True),
+        sa.Column('memory_usage_percent_last', sa.Float(), nullable=True),
+        sa.Column('memory_used_gb_sum', sa.Float(), nullable=True),
+        sa.Column('memory_used_gb_count', sa.Integer(), nullable=False),
+        sa.Column('memory_used_gb_min', sa.Float(), nullable=True),
+        sa.Column('memory_used_gb_max', sa.Float(), nullable=True),
+        sa.Column('memory_used_gb_last', sa.Float(), nullable=True),
+        sa.Column('disk_usage_percent_sum', sa.Float(), nullable=True),
+        sa.Column('disk_usage_percent_count', sa.Integer(), nullable=False),
+        sa.Column('disk_usage_percent_min', sa.Float(), nullable=True),
+        sa.Column('disk_usage_percent_max', sa.Float(), nullable=True),
+        sa.Column('disk_usage_percent_last', sa.Float(), nullable=True),
+        sa.Column('disk_used_gb_sum', sa.Float(), nullable=True),
+        sa.Column('disk_used_gb_count', sa.Integer(), nullable=False),
+        sa.Column('disk_used_gb_min', sa.Float(), nullable=True),
+        sa.Column('disk_used_gb_max', sa.Float(), nullable=True),
+        sa.Column('disk_used_gb_last', sa.Float(), nullable=True),
+        sa.Column('network_bytes_sent_sum', sa.Float(), nullable=True),
+        sa.Column('network_bytes_sent_count', sa.Integer(), nullable=False),
+        sa.Column('network_bytes_sent_min', sa.Float(), nullable=True),
+        sa.Column('network_bytes_sent_max', sa.Float(), nullable=True),
+        sa.Column('network_bytes_sent_last', sa.Float(), nullable=True),
+        sa.Column('network_bytes_recv_sum', sa.Float(), nullable=True),
+        sa.Column('network_bytes_recv_count', sa.Integer(), nullable=False),
+        sa.Column('network_bytes_recv_min', sa.Float(), nullable=True),
+        sa.Column('network_bytes_recv_max', sa.Float(), nullable=True),
+        sa.Column('network_bytes_recv_last', sa.Float(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ROLLUP_TABLES:
+        op.create_table(table,
+        sa.Column('server_id', sa.UUID(), nullable=False),
+        sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('sample_count', sa.Integer(), nullable=False),
+        sa.Column('last_timestamp', sa.DateTime(timezone=True), nullable=True),
+        *_series_columns(),
+        sa.ForeignKeyConstraint(['server_id'], ['servers.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('server_id', 'bucket')
+        )
+    op.create_table('metric_rollup_watermarks',
+    sa.Column('resolution', sa.String(), nullable=False),
+    sa.Column('watermark', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('resolution')
+    )
+    # The rollup job reads raw rows by insertion time
+    op.create_index('ix_metrics_created_at', 'metrics', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_metrics_created_at', table_name='metrics')
+    op.drop_table('metric_rollup_watermarks')
+    for table in ROLLUP_TABLES:
+        op.drop_table(table)
@@ -0,0 +1,28 @@
+"""add_command_output_seq
+
+Revision ID: a9d3f6b2c871
+Revises: e4a92b6c1d58
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d3f6b2c871'
+down_revision: Union[str, Sequence[str], None] = 'e4a92b6c1d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('command_history', sa.Column('output_seq', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('command_history', 'output_seq')
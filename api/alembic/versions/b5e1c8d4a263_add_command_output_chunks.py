@@ -0,0 +1,41 @@
+"""add_command_output_chunks
+
+Revision ID: b5e1c8d4a263
+Revises: a9d3f6b2c871
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e1c8d4a263'
+down_revision: Union[str, Sequence[str], None] = 'a9d3f6b2c871'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('command_history', sa.Column('stdout_size', sa.Integer(), nullable=True))
+    op.add_column('command_history', sa.Column('stderr_size', sa.Integer(), nullable=True))
+    op.create_table('command_output_chunks',
+    sa.Column('command_id', sa.UUID(), nullable=False),
+    sa.Column('stream', sa.String(), nullable=False),
+    sa.Column('start', sa.Integer(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['command_id'], ['command_history.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('command_id', 'stream', 'start')
+    )
+    # Existing outputs stay inline; they are read as before
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('command_output_chunks')
+    op.drop_column('command_history', 'stderr_size')
+    op.drop_column('command_history', 'stdout_size')
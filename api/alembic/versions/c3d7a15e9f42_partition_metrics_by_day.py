@@ -0,0 +1,115 @@
+"""partition_metrics_by_day
+
+Revision ID: c3d7a15e9f42
+Revises: 8c41f0a9e2b7
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d7a15e9f42'
+down_revision: Union[str, Sequence[str], None] = '8c41f0a9e2b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions created ahead of today; the API keeps this topped up afterwards
+PREMAKE_DAYS = 7
+
+# Days kept by default (METRICS_RETENTION_DAYS); older rows go to the default partition
+RETENTION_DAYS = 30
+
+# Copied by name: the old table may have columns in a different order
+COLUMNS = (
+    'id, server_id, timestamp, cpu_usage_percent, cpu_cores, cpu_frequency_mhz, '
+    'memory_total_gb, memory_used_gb, memory_available_gb, memory_usage_percent, '
+    'disk_total_gb, disk_used_gb, disk_available_gb, disk_usage_percent, '
+    'network_bytes_sent, network_bytes_recv, network_packets_sent, network_packets_recv, '
+    'extra_data, created_at'
+)
+
+
+def _create_metrics_table(name: str, partitioned: bool) -> None:
+    table_kwargs = {'postgresql_partition_by': 'RANGE (timestamp)'} if partitioned else {}
+    op.create_table(name,
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('server_id', sa.UUID(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('cpu_usage_percent', sa.Float(), nullable=False),
+    sa.Column('cpu_cores', sa.Float(), nullable=True),
+    sa.Column('cpu_frequency_mhz', sa.Float(), nullable=True),
+    sa.Column('memory_total_gb', sa.Float(), nullable=False),
+    sa.Column('memory_used_gb', sa.Float(), nullable=False),
+    sa.Column('memory_available_gb', sa.Float(), nullable=False),
+    sa.Column('memory_usage_percent', sa.Float(), nullable=False),
+    sa.Column('disk_total_gb', sa.Float(), nullable=False),
+    sa.Column('disk_used_gb', sa.Float(), nullable=False),
+    sa.Column('disk_available_gb', sa.Float(), nullable=False),
+    sa.Column('disk_usage_percent', sa.Float(), nullable=False),
+    sa.Column('network_bytes_sent', sa.Float(), nullable=True),
+    sa.Column('network_bytes_recv', sa.Float(), nullable=True),
+    sa.Column('network_packets_sent', sa.Float(), nullable=True),
+    sa.Column('network_packets_recv', sa.Float(), nullable=True),
+    sa.Column('extra_data', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['server_id'], ['servers.id'], ondelete='CASCADE'),
+    # The partition key has to be part of the primary key
+    sa.PrimaryKeyConstraint('id', 'timestamp') if partitioned else sa.PrimaryKeyConstraint('id'),
+    **table_kwargs
+    )
+    op.create_index('idx_metrics_server_timestamp', name, ['server_id', 'timestamp'], unique=False)
+    op.create_index('ix_metrics_server_id', name, ['server_id'], unique=False)
+    op.create_index('ix_metrics_timestamp', name, ['timestamp'], unique=False)
+    op.create_index('ix_metrics_created_at', name, ['created_at'], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Daily partition bounds are UTC midnights
+    op.execute("SET LOCAL TIME ZONE 'UTC'")
+    op.rename_table('metrics', 'metrics_unpartitioned')
+    op.execute('ALTER TABLE metrics_unpartitioned RENAME CONSTRAINT metrics_pkey TO metrics_unpartitioned_pkey')
+    for index in ('idx_metrics_server_timestamp', 'ix_metrics_server_id', 'ix_metrics_timestamp', 'ix_metrics_created_at'):
+        op.execute(f'ALTER INDEX {index} RENAME TO {index}_unpartitioned')
+
+    _create_metrics_table('metrics', partitioned=True)
+    # Catches rows outside every daily partition (e.g. agents with a wrong clock)
+    op.execute('CREATE TABLE metrics_default PARTITION OF metrics DEFAULT')
+
+    # One partition per day of the retention window up to PREMAKE_DAYS ahead. Not from the
+    # oldest row: one sample with a bogus timestamp would mean thousands of partitions, and
+    # retention removes whatever older rows end up in metrics_default.
+    op.execute(f"""
+        DO $$
+        DECLARE
+            day date := current_date - {RETENTION_DAYS};
+        BEGIN
+            WHILE day <= current_date + {PREMAKE_DAYS} LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF metrics FOR VALUES FROM (%L) TO (%L)',
+                    'metrics_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+                );
+                day := day + 1;
+            END LOOP;
+        END $$;
+    """)
+
+    op.execute(f'INSERT INTO metrics ({COLUMNS}) SELECT {COLUMNS} FROM metrics_unpartitioned')
+    op.drop_table('metrics_unpartitioned')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.rename_table('metrics', 'metrics_partitioned')
+    op.execute('ALTER TABLE metrics_partitioned RENAME CONSTRAINT metrics_pkey TO metrics_partitioned_pkey')
+    for index in ('idx_metrics_server_timestamp', 'ix_metrics_server_id', 'ix_metrics_timestamp', 'ix_metrics_created_at'):
+        op.execute(f'ALTER INDEX {index} RENAME TO {index}_partitioned')
+
+    _create_metrics_table('metrics', partitioned=False)
+    op.execute(f'INSERT INTO metrics ({COLUMNS}) SELECT {COLUMNS} FROM metrics_partitioned')
+    # Dropping the parent drops every partition
+    op.drop_table('metrics_partitioned')
@@ -0,0 +1,29 @@
+"""add_rollup_complete_before
+
+Revision ID: d7f2b6e4a915
+Revises: b5e1c8d4a263
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7f2b6e4a915'
+down_revision: Union[str, Sequence[str], None] = 'b5e1c8d4a263'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Filled in by the next rollup run; until then history queries use raw rows
+    op.add_column('metric_rollup_watermarks', sa.Column('complete_before', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('metric_rollup_watermarks', 'complete_before')
@@ -0,0 +1,41 @@
+"""add_inventory_snapshots
+
+Revision ID: e4a92b6c1d58
+Revises: c3d7a15e9f42
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a92b6c1d58'
+down_revision: Union[str, Sequence[str], None] = 'c3d7a15e9f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('inventory_snapshots',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('server_id', sa.UUID(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('is_keyframe', sa.Boolean(), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['server_id'], ['servers.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_inventory_snapshots_lookup', 'inventory_snapshots', ['server_id', 'kind', 'timestamp'], unique=False)
+    # Existing metrics rows keep their extra_data; readers fall back to it
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_inventory_snapshots_lookup', table_name='inventory_snapshots')
+    op.drop_table('inventory_snapshots')
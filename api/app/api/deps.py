@@ -2,8 +2,7 @@ from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.base import get_db
-from app.crud.user import get_user
-from app.crud.api_key import verify_and_get_api_key
+from app.services.auth_service import get_authenticated_user, verify_and_get_api_key
 from app.core.security import decode_access_token
 from app.models.user import User
 from app.models.api_key import APIKey
@@ -36,8 +35,8 @@ async def get_current_user(
     if user_id is None:
         raise credentials_exception
     
-    user = await get_user(db, uuid.UUID(user_id))
-    if user is None:
+    user = await get_authenticated_user(db, uuid.UUID(user_id))
+    if user is None or not user.is_active:
         raise credentials_exception
     
     return user
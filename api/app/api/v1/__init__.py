@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1 import auth, servers, metrics, logs, docker, commands, alerts, api_keys, agents, ws
+from app.api.v1 import auth, servers, metrics, logs, docker, commands, alerts, api_keys, agents, ws, system
 
 api_router = APIRouter()
 
@@ -13,4 +13,5 @@ api_router.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
 api_router.include_router(api_keys.router, prefix="/api-keys", tags=["api-keys"])
 api_router.include_router(agents.router, prefix="/agents", tags=["agents"])
 api_router.include_router(ws.router, prefix="", tags=["websocket"])
+api_router.include_router(system.router, prefix="/system", tags=["system"])
 
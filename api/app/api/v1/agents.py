@@ -1,12 +1,19 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.db.base import AsyncSessionLocal
-from app.crud.api_key import verify_and_get_api_key
+from app.services.auth_service import verify_and_get_api_key
+from app.core.hash_pool import HashPoolBusy
 from app.crud import server as server_crud
-from app.crud import metric as crud_metric
 from app.crud import connection_event as crud_connection_event
 from app.services.ws_manager import ws_manager
 from app.services.agent_manager import agent_manager
+from app.services.metric_writer import metric_writer
+from app.services.log_writer import log_writer
+from app.services.command_streams import command_streams
+from app.services.heartbeat import heartbeat_tracker
 from app.services.alert_service import check_metrics_against_thresholds
+from app.services.agent_mailbox import agent_mailboxes
+from app.services.recent_metrics import recent_metrics
+from app.services.snapshot_store import snapshot_store
 from app.api.v1.metrics import metrics_cache
 from app.models.server import ServerStatus
 from app.models.connection_event import ConnectionEventType
@@ -17,6 +24,52 @@ import uuid
 router = APIRouter()
 
 
+def _build_metrics_dict(server_id: str, metrics_data: dict) -> dict:
+    """Normalise a metrics frame from an agent"""
+    # Parse timestamp
+    timestamp_str = metrics_data.get("timestamp")
+    if isinstance(timestamp_str, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+        except:
+            timestamp = datetime.utcnow()
+    else:
+        timestamp = datetime.utcnow()
+    
+    return {
+        "server_id": server_id,
+        "timestamp": timestamp.isoformat(),
+        "cpu": metrics_data.get("cpu", {}),
+        "memory": metrics_data.get("memory", {}),
+        "disk": metrics_data.get("disk", {}),
+        "network": metrics_data.get("network", {}),
+        "containers": metrics_data.get("containers", []),
+        "processes": metrics_data.get("processes", []),
+    }
+
+
+async def _process_metrics_sample(server_id: str, metrics_dict: dict) -> None:
+    """Evaluate alert thresholds for a sample and broadcast it to frontend clients"""
+    # Check metrics against alert thresholds and create alerts if needed
+    try:
+        async with AsyncSessionLocal() as alert_db:
+            await check_metrics_against_thresholds(
+                alert_db,
+                uuid.UUID(server_id),
+                metrics_dict,
+            )
+            # Note: create_alert already commits, but we ensure any other changes are committed
+            await alert_db.commit()
+    except Exception as e:
+        # Log error but don't fail the metrics processing
+        print(f"Error checking alert thresholds: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    # Broadcast to frontend clients
+    await ws_manager.send_metrics(server_id, metrics_dict)
+
+
 @router.websocket("/ws")
 async def agent_websocket(websocket: WebSocket):
     """
@@ -41,7 +94,11 @@ async def agent_websocket(websocket: WebSocket):
     server_id = None
     async with AsyncSessionLocal() as db:
         try:
-            api_key_obj = await verify_and_get_api_key(db, api_key)
+            try:
+                api_key_obj = await verify_and_get_api_key(db, api_key)
+            except HashPoolBusy:
+                await websocket.close(code=1013, reason="Server busy, retry later")
+                return
             if not api_key_obj or not api_key_obj.is_active:
                 await websocket.close(code=1008, reason="Invalid or inactive API key")
                 return
@@ -50,6 +107,9 @@ async def agent_websocket(websocket: WebSocket):
             
             # Register agent connection
             agent_manager.register_agent(server_id, websocket)
+            # The agent may have been connected to another worker since this one
+            # last saw it, so its first snapshot here must be a keyframe
+            snapshot_store.forget(server_id)
             
             # Update server status to ONLINE and log connection event
             try:
@@ -77,8 +137,9 @@ async def agent_websocket(websocket: WebSocket):
             })
             
             # Process messages from agent
-            # We need to handle both metrics and command responses
-            # For now, we'll process metrics synchronously and handle command responses separately
+            # The receive loop only decodes and dispatches: command responses are
+            # resolved immediately, metric samples go to the agent's mailbox
+            mailbox = await agent_mailboxes.open(server_id, _process_metrics_sample)
             try:
                 while True:
                     # Receive message from agent
@@ -87,75 +148,37 @@ async def agent_websocket(websocket: WebSocket):
                     
                     # Check if this is a command response (has request_id)
                     if message.get("request_id"):
-                        # This is a command response - put it in the response queue
+                        # A streamed command was started: its output frames follow
+                        if message.get("type") == "command_started":
+                            command_streams.open(
+                                server_id,
+                                str((message.get("data") or {}).get("command_id")),
+                                message["request_id"],
+                                websocket,
+                            )
+                        # This is a command response - resolve the waiting caller
                         agent_manager.put_response(message.get("request_id"), message)
                         continue
                     
+                    if message.get("type") == "command_output":
+                        await command_streams.on_output(server_id, message)
+                        continue
+                    
+                    if message.get("type") == "command_exit":
+                        await command_streams.on_exit(server_id, message)
+                        continue
+                    
                     if message.get("type") == "metrics":
-                        # Process metrics
-                        metrics_data = message.get("data", {})
-                        
-                        # Parse timestamp
-                        timestamp_str = metrics_data.get("timestamp")
-                        if isinstance(timestamp_str, str):
-                            try:
-                                timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                            except:
-                                timestamp = datetime.utcnow()
-                        else:
-                            timestamp = datetime.utcnow()
-                        
-                        # Store in cache
-                        metrics_dict = {
-                            "server_id": server_id,
-                            "timestamp": timestamp.isoformat(),
-                            "cpu": metrics_data.get("cpu", {}),
-                            "memory": metrics_data.get("memory", {}),
-                            "disk": metrics_data.get("disk", {}),
-                            "network": metrics_data.get("network", {}),
-                            "containers": metrics_data.get("containers", []),
-                            "processes": metrics_data.get("processes", []),
-                        }
+                        metrics_dict = _build_metrics_dict(server_id, message.get("data", {}))
                         
+                        # Latest sample, persistence and liveness are in-memory and never block
                         metrics_cache[server_id] = metrics_dict
+                        recent_metrics.append(server_id, metrics_dict)
+                        metric_writer.enqueue(server_id, metrics_dict)
+                        heartbeat_tracker.touch(server_id)
                         
-                        # Persist metrics to database and update server last_seen
-                        try:
-                            async with AsyncSessionLocal() as metrics_db:
-                                # Persist metrics
-                                await crud_metric.create_metric(
-                                    metrics_db,
-                                    server_id=uuid.UUID(server_id),
-                                    metrics_data=metrics_dict,
-                                )
-                                # Update server last_seen timestamp
-                                await server_crud.update_server_status(
-                                    metrics_db,
-                                    uuid.UUID(server_id),
-                                    ServerStatus.ONLINE,
-                                    update_last_seen=True
-                                )
-                        except Exception as e:
-                            print(f"Error persisting metrics or updating server last_seen: {e}")
-                        
-                        # Check metrics against alert thresholds and create alerts if needed
-                        try:
-                            async with AsyncSessionLocal() as alert_db:
-                                await check_metrics_against_thresholds(
-                                    alert_db,
-                                    uuid.UUID(server_id),
-                                    metrics_dict,
-                                )
-                                # Note: create_alert already commits, but we ensure any other changes are committed
-                                await alert_db.commit()
-                        except Exception as e:
-                            # Log error but don't fail the metrics processing
-                            print(f"Error checking alert thresholds: {e}")
-                            import traceback
-                            traceback.print_exc()
-                        
-                        # Broadcast to frontend clients
-                        await ws_manager.send_metrics(server_id, metrics_dict)
+                        # Alert evaluation and broadcast run on this agent's mailbox worker
+                        mailbox.put(metrics_dict)
                         
                         # Send acknowledgment
                         await websocket.send_json({
@@ -163,22 +186,47 @@ async def agent_websocket(websocket: WebSocket):
                             "status": "ok"
                         })
                     
+                    elif message.get("type") in ("log", "log_batch"):
+                        if message["type"] == "log":
+                            entries = [message.get("data")]
+                        else:
+                            entries = message.get("data") or []
+                            if not isinstance(entries, list):
+                                entries = []
+                        
+                        # Rate cap and buffer for persistence; the writer pushes what was kept to log subscribers
+                        accepted, dropped = log_writer.ingest(server_id, entries)
+                        
+                        # Dropped lines tell the agent to slow down
+                        await websocket.send_json({
+                            "type": "logs_received",
+                            "accepted": len(accepted),
+                            "dropped": dropped,
+                            "throttled": dropped > 0,
+                        })
+                    
                     elif message.get("type") == "ping":
                         # Heartbeat
                         await websocket.send_json({"type": "pong"})
                     
             except WebSocketDisconnect:
                 if server_id:
-                    agent_manager.unregister_agent(server_id)
+                    # After a quick reconnect this socket is stale: leave the new connection's state alone
+                    current = agent_manager.unregister_agent(server_id, websocket)
+                    await agent_mailboxes.close(server_id, mailbox)
+                    if current:
+                        recent_metrics.forget(server_id)
+                    await command_streams.agent_disconnected(server_id, websocket)
                     # Update server status to OFFLINE and log disconnection event
                     try:
                         async with AsyncSessionLocal() as disconnect_db:
-                            await server_crud.update_server_status(
-                                disconnect_db,
-                                uuid.UUID(server_id),
-                                ServerStatus.OFFLINE,
-                                update_last_seen=False
-                            )
+                            if current:
+                                await server_crud.update_server_status(
+                                    disconnect_db,
+                                    uuid.UUID(server_id),
+                                    ServerStatus.OFFLINE,
+                                    update_last_seen=False
+                                )
                             # Log disconnection event
                             await crud_connection_event.create_connection_event(
                                 disconnect_db,
@@ -190,16 +238,22 @@ async def agent_websocket(websocket: WebSocket):
                 pass
             except Exception as e:
                 if server_id:
-                    agent_manager.unregister_agent(server_id)
+                    # After a quick reconnect this socket is stale: leave the new connection's state alone
+                    current = agent_manager.unregister_agent(server_id, websocket)
+                    await agent_mailboxes.close(server_id, mailbox)
+                    if current:
+                        recent_metrics.forget(server_id)
+                    await command_streams.agent_disconnected(server_id, websocket)
                     # Update server status to OFFLINE and log error event
                     try:
                         async with AsyncSessionLocal() as error_db:
-                            await server_crud.update_server_status(
-                                error_db,
-                                uuid.UUID(server_id),
-                                ServerStatus.OFFLINE,
-                                update_last_seen=False
-                            )
+                            if current:
+                                await server_crud.update_server_status(
+                                    error_db,
+                                    uuid.UUID(server_id),
+                                    ServerStatus.OFFLINE,
+                                    update_last_seen=False
+                                )
                             # Log error event
                             await crud_connection_event.create_connection_event(
                                 error_db,
@@ -6,6 +6,7 @@ from app.db.base import get_db
 from app.api.deps import get_current_user
 from app.models.user import User
 from app.crud import alert as crud_alert
+from app.services.bus import bus
 from app.schemas.alert import (
     Alert,
     AlertCreate,
@@ -75,6 +76,7 @@ async def resolve_alert(
     alert = await crud_alert.resolve_alert(db, alert_id)
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
+    await bus.invalidate("alert_registry", str(alert.server_id))
     return AlertResponse.model_validate(alert)
 
 
@@ -86,12 +88,12 @@ async def create_alert_threshold(
 ):
     """Create a new alert threshold (only for user's servers)"""
     # Verify server ownership
-    from app.crud import server as crud_server
-    server = await crud_server.get_server(db, threshold_in.server_id, user_id=current_user.id)
-    if not server:
+    from app.services.server_service import user_owns_server
+    if not await user_owns_server(db, threshold_in.server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     threshold = await crud_alert.create_alert_threshold(db, threshold_in)
+    await bus.invalidate("alert_registry", str(threshold.server_id))
     return AlertThreshold.model_validate(threshold)
 
 
@@ -111,6 +113,7 @@ async def update_alert_threshold(
     threshold = await crud_alert.update_alert_threshold(db, threshold_id, threshold_in)
     if not threshold:
         raise HTTPException(status_code=404, detail="Alert threshold not found")
+    await bus.invalidate("alert_registry", str(threshold.server_id))
     return AlertThreshold.model_validate(threshold)
 
 
@@ -126,8 +129,10 @@ async def delete_alert_threshold(
     if not threshold:
         raise HTTPException(status_code=404, detail="Alert threshold not found")
     
+    server_id = threshold.server_id
     success = await crud_alert.delete_alert_threshold(db, threshold_id)
     if not success:
         raise HTTPException(status_code=404, detail="Alert threshold not found")
+    await bus.invalidate("alert_registry", str(server_id))
     return None
 
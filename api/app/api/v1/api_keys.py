@@ -7,8 +7,9 @@ from app.api.deps import get_current_user, get_api_key_auth
 from app.models.user import User
 from app.models.api_key import APIKey
 from app.crud import api_key as crud_api_key
-from app.crud import server as crud_server
+from app.services.server_service import user_owns_server
 from app.schemas.api_key import APIKeyCreate, APIKeyResponse, APIKeyInfo
+from app.services.bus import bus
 
 router = APIRouter()
 
@@ -38,8 +39,7 @@ async def create_api_key(
 ):
     """Create a new API key for a server"""
     # Verify server exists and user owns it
-    server = await crud_server.get_server(db, key_in.server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, key_in.server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # Create the API key
@@ -51,6 +51,7 @@ async def create_api_key(
     return APIKeyResponse(
         id=db_key.id,
         server_id=db_key.server_id,
+        key_prefix=db_key.key_prefix,
         key=plain_key,  # Only returned on creation
         name=db_key.name,
         is_active=db_key.is_active,
@@ -69,8 +70,7 @@ async def get_server_api_keys(
 ):
     """Get all API keys for a server"""
     # Verify server exists and user owns it
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     keys = await crud_api_key.get_api_keys_by_server(db, server_id, active_only=active_only)
@@ -90,13 +90,14 @@ async def deactivate_api_key(
         raise HTTPException(status_code=404, detail="API key not found")
     
     # Verify the API key belongs to a server owned by the user
-    server = await crud_server.get_server(db, key.server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, key.server_id, current_user.id):
         raise HTTPException(status_code=404, detail="API key not found")
     
+    key_hash = key.key_hash
     success = await crud_api_key.deactivate_api_key(db, key_id)
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
+    await bus.invalidate("api_key", key_hash)
     
     key = await crud_api_key.get_api_key(db, key_id)
     return APIKeyInfo.model_validate(key)
@@ -115,11 +116,12 @@ async def delete_api_key(
         raise HTTPException(status_code=404, detail="API key not found")
     
     # Verify the API key belongs to a server owned by the user
-    server = await crud_server.get_server(db, key.server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, key.server_id, current_user.id):
         raise HTTPException(status_code=404, detail="API key not found")
     
+    key_hash = key.key_hash
     success = await crud_api_key.delete_api_key(db, key_id)
     if not success:
         raise HTTPException(status_code=404, detail="API key not found")
+    await bus.invalidate("api_key", key_hash)
     return None
@@ -7,6 +7,7 @@ from app.schemas.user import UserCreate, UserResponse, UserUpdate, PasswordChang
 from app.api.deps import get_current_user
 from app.models.user import User
 from app.crud import user as crud_user
+from app.services.bus import bus
 
 router = APIRouter()
 
@@ -88,6 +89,7 @@ async def update_profile(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
+    await bus.invalidate("user", str(current_user.id))
     return UserResponse.model_validate(updated_user)
 
 
@@ -109,5 +111,6 @@ async def change_password(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect",
         )
+    await bus.invalidate("user", str(current_user.id))
     return {"message": "Password changed successfully"}
 
@@ -1,20 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Literal, Optional
+from datetime import datetime
+import asyncio
+import json
 import uuid
 from app.db.base import get_db
 from app.api.deps import get_current_user
 from app.models.user import User
-from app.models.command_history import CommandStatus
+from app.models.command_history import CommandHistory, CommandStatus
 from app.crud import server as crud_server
+from app.services.server_service import get_owned_server_ids, user_owns_server
 from app.crud import command_history as crud_command_history
-from pydantic import BaseModel
+from app.core.config import settings
+from app.services.agent_manager import agent_manager
+from app.services.command_fanout import command_fanout
+from app.services.command_jobs import command_jobs, command_outcome
+from app.services.command_streams import FINISHED_STATUSES
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 router = APIRouter()
 
 
 class CommandRequest(BaseModel):
     command: str
+    # Seconds to wait for the agent (defaults to AGENT_RPC_TIMEOUTS["execute_command"])
+    timeout: Optional[float] = Field(None, gt=0, le=3600)
+
+
+class FanoutRequest(BaseModel):
+    command: str
+    # Target servers by id and/or by metadata (servers must match both when both are given)
+    server_ids: Optional[List[uuid.UUID]] = Field(None, min_length=1, max_length=settings.COMMAND_FANOUT_MAX_SERVERS)
+    selector: Optional[Dict[str, str]] = Field(None, min_length=1)
+    # Commands in flight at once (defaults to COMMAND_FANOUT_PARALLELISM)
+    parallelism: Optional[int] = Field(None, ge=1, le=settings.COMMAND_FANOUT_MAX_PARALLELISM)
+    # Rolling batches: the next batch starts when the previous one has finished
+    batch_size: Optional[int] = Field(None, ge=1)
+    # Skip the remaining batches after a failure
+    stop_on_failure: bool = False
+    timeout: Optional[float] = Field(None, gt=0, le=3600)
+    
+    @model_validator(mode='after')
+    def has_targets(self):
+        if self.server_ids is None and self.selector is None:
+            raise ValueError('Either server_ids or selector is required')
+        return self
 
 
 class CommandResponse(BaseModel):
@@ -24,18 +56,144 @@ class CommandResponse(BaseModel):
     exit_code: Optional[int] = None
 
 
-@router.post("/{server_id}", response_model=CommandResponse)
+class CommandJob(BaseModel):
+    command_id: uuid.UUID
+    status: CommandStatus
+    # Poll here for the status and result
+    result_url: str
+
+
+class CommandJobResult(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    command_id: uuid.UUID = Field(validation_alias="id")
+    server_id: uuid.UUID
+    command: str
+    status: CommandStatus
+    exit_code: Optional[int] = None
+    # Outputs larger than COMMAND_OUTPUT_INLINE_BYTES are cut to a preview;
+    # *_size is then the full size, readable from the output endpoint
+    stdout: Optional[str] = None
+    stderr: Optional[str] = None
+    stdout_size: Optional[int] = None
+    stderr_size: Optional[int] = None
+    error_message: Optional[str] = None
+    started_at: datetime
+    completed_at: Optional[datetime] = None
+    duration_ms: Optional[int] = None
+
+
+class CommandStreamStarted(BaseModel):
+    command_id: uuid.UUID
+    status: CommandStatus
+    # WebSocket that relays the output (authenticate like the dashboard sockets)
+    stream_url: str
+
+
+@router.post("/fanout")
+async def execute_command_fanout(
+    fanout_req: FanoutRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Run a command on many servers at once. The response is streamed as
+    newline-delimited JSON: a `started` line, one `result` line per server
+    as it finishes, and a final `summary` line.
+    """
+    denied: List[uuid.UUID] = []
+    if fanout_req.selector is not None:
+        matched = await crud_server.get_server_ids_by_metadata(
+            db, current_user.id, fanout_req.selector, limit=settings.COMMAND_FANOUT_MAX_SERVERS + 1,
+        )
+    if fanout_req.server_ids is not None:
+        requested = list(dict.fromkeys(fanout_req.server_ids))
+        owned = set(await get_owned_server_ids(db, current_user.id, requested))
+        denied = [server_id for server_id in requested if server_id not in owned]
+        server_ids = [server_id for server_id in requested if server_id in owned]
+        if fanout_req.selector is not None:
+            matched_ids = set(matched)
+            server_ids = [server_id for server_id in server_ids if server_id in matched_ids]
+    else:
+        server_ids = matched
+    # Don't hold a database connection while the commands run
+    await db.close()
+    
+    if not server_ids:
+        raise HTTPException(status_code=404, detail="No matching servers")
+    if len(server_ids) > settings.COMMAND_FANOUT_MAX_SERVERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Selector matches more than {settings.COMMAND_FANOUT_MAX_SERVERS} servers",
+        )
+    
+    async def lines() -> AsyncIterator[str]:
+        yield json.dumps({
+            "type": "started",
+            "servers": [str(server_id) for server_id in server_ids],
+            "denied": [str(server_id) for server_id in denied],
+        }) + "\n"
+        async for frame in command_fanout.run(
+            current_user.id,
+            server_ids,
+            fanout_req.command,
+            parallelism=fanout_req.parallelism,
+            batch_size=fanout_req.batch_size,
+            stop_on_failure=fanout_req.stop_on_failure,
+            timeout=fanout_req.timeout,
+        ):
+            yield json.dumps(frame) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/{server_id}",
+    response_model=CommandResponse,
+    responses={202: {"model": CommandJob, "description": "Job accepted (`?async=true`)"}},
+)
 async def execute_command(
     server_id: uuid.UUID,
     command_req: CommandRequest,
+    async_job: bool = Query(False, alias="async", description="Run in the background and return a job id"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Execute a command on a server"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    """
+    Execute a command on a server. With `?async=true` the command runs in
+    the background: the response is `202` with a job id to poll at
+    `result_url`.
+    """
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
+    if async_job:
+        cmd_history = await crud_command_history.create_command_history(
+            db,
+            server_id=server_id,
+            command=command_req.command,
+            user_id=current_user.id,
+            status=CommandStatus.PENDING,
+        )
+        if not command_jobs.submit(cmd_history.id, server_id, command_req.command, timeout=command_req.timeout):
+            await crud_command_history.update_command_history(
+                db,
+                command_id=cmd_history.id,
+                status=CommandStatus.FAILED,
+                error_message="Too many queued commands",
+            )
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Too many queued commands, please retry shortly"},
+                headers={"Retry-After": "5"},
+            )
+        job = CommandJob(
+            command_id=cmd_history.id,
+            status=CommandStatus.PENDING,
+            result_url=f"{settings.API_V1_STR}/commands/jobs/{cmd_history.id}",
+        )
+        return JSONResponse(status_code=202, content=job.model_dump(mode="json"))
+    
     # Create command history entry
     cmd_history = await crud_command_history.create_command_history(
         db,
@@ -46,86 +204,141 @@ async def execute_command(
     )
     
     # Send command to agent via WebSocket
-    from app.services.agent_manager import agent_manager
-    
-    server_id_str = str(server_id)
-    command = {
-        "type": "execute_command",
-        "command": command_req.command,
-    }
-    
-    response = await agent_manager.send_command(server_id_str, command)
+    response = await agent_manager.send_command(
+        str(server_id),
+        {"type": "execute_command", "command": command_req.command},
+        timeout=command_req.timeout,
+    )
+    outcome = command_outcome(response)
+    await crud_command_history.update_command_history(db, command_id=cmd_history.id, **outcome)
     
     if response is None:
-        # Update command history as failed
-        await crud_command_history.update_command_history(
-            db,
-            command_id=cmd_history.id,
-            status=CommandStatus.FAILED,
-            error_message="Agent not connected",
-        )
         raise HTTPException(
             status_code=503,
             detail="Agent not connected. Please ensure the agent is running and connected.",
         )
-    
-    if "error" in response:
-        # Update command history as failed
-        await crud_command_history.update_command_history(
-            db,
-            command_id=cmd_history.id,
-            status=CommandStatus.FAILED,
-            error_message=response["error"],
-        )
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to execute command: {response['error']}",
-        )
-    
-    if response.get("type") == "command_result":
-        result_data = response.get("data", {})
-        output = result_data.get("output", "")
-        exit_code = result_data.get("exit_code", 0)
-        success = exit_code == 0
-        
-        # Update command history with result
-        await crud_command_history.update_command_history(
-            db,
-            command_id=cmd_history.id,
-            status=CommandStatus.COMPLETED if success else CommandStatus.FAILED,
-            exit_code=exit_code,
-            stdout=output if success else None,
-            stderr=output if not success else None,
-        )
-        
+    if "exit_code" in outcome:
+        success = outcome["status"] == CommandStatus.COMPLETED
+        output = outcome["stdout"] if success else outcome["stderr"]
         return CommandResponse(
             success=success,
             output=output,
-            exit_code=exit_code,
+            exit_code=outcome["exit_code"],
             error=None if success else output,
         )
-    elif response.get("type") == "error":
-        # Update command history as failed
-        await crud_command_history.update_command_history(
-            db,
-            command_id=cmd_history.id,
-            status=CommandStatus.FAILED,
-            error_message=response.get("message", "Unknown error"),
-        )
-        raise HTTPException(
-            status_code=500,
-            detail=response.get("message", "Unknown error"),
-        )
-    else:
-        # Update command history as failed
+    if outcome["status"] == CommandStatus.TIMEOUT:
+        raise HTTPException(status_code=504, detail=f"Failed to execute command: {outcome['error_message']}")
+    if "error" in response:
+        raise HTTPException(status_code=500, detail=f"Failed to execute command: {outcome['error_message']}")
+    raise HTTPException(status_code=500, detail=outcome["error_message"])
+
+
+@router.get("/jobs/{command_id}", response_model=CommandJobResult)
+async def get_command_job(
+    command_id: uuid.UUID,
+    wait: float = Query(0, ge=0, le=60, description="Seconds to wait for the command to finish"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Status and result of a command. With `wait`, the request is held until
+    the command finishes or `wait` seconds pass, whichever comes first.
+    """
+    cmd_history = await db.get(CommandHistory, command_id)
+    if cmd_history is None or not await user_owns_server(db, cmd_history.server_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Command not found")
+    
+    if wait and cmd_history.status not in FINISHED_STATUSES:
+        # Don't hold a database connection while waiting
+        await db.close()
+        async with command_jobs.watch(command_id) as finished:
+            cmd_history = await db.get(CommandHistory, command_id)
+            if cmd_history is not None and cmd_history.status not in FINISHED_STATUSES:
+                await db.close()
+                try:
+                    await asyncio.wait_for(finished.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                cmd_history = await db.get(CommandHistory, command_id)
+        if cmd_history is None:
+            raise HTTPException(status_code=404, detail="Command not found")
+    
+    return CommandJobResult.model_validate(cmd_history)
+
+
+@router.get("/jobs/{command_id}/output")
+async def get_command_output(
+    command_id: uuid.UUID,
+    stream: Literal["stdout", "stderr"] = "stdout",
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=1, le=settings.COMMAND_OUTPUT_READ_MAX_BYTES),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Raw bytes of a command's stdout or stderr, starting at `offset`. Only
+    the stored chunks covering the range are read. Partial reads return 206
+    with a Content-Range header carrying the full size.
+    """
+    cmd_history = await db.get(CommandHistory, command_id)
+    if cmd_history is None or not await user_owns_server(db, cmd_history.server_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Command not found")
+    
+    length = length or settings.COMMAND_OUTPUT_READ_MAX_BYTES
+    data, size = await crud_command_history.read_command_output(db, cmd_history, stream, offset, length)
+    headers = {"Accept-Ranges": "bytes"}
+    if offset and offset >= size:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if len(data) < size:
+        headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/{size}"
+        return Response(content=data, status_code=206, media_type="text/plain; charset=utf-8", headers=headers)
+    return Response(content=data, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@router.post("/{server_id}/stream", response_model=CommandStreamStarted, status_code=202)
+async def execute_command_stream(
+    server_id: uuid.UUID,
+    command_req: CommandRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Start a command whose output is streamed. Returns once the agent has
+    started it; follow stdout/stderr and the exit status on `stream_url`.
+    """
+    if not await user_owns_server(db, server_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Server not found")
+    
+    cmd_history = await crud_command_history.create_command_history(
+        db,
+        server_id=server_id,
+        command=command_req.command,
+        user_id=current_user.id,
+        status=CommandStatus.RUNNING,
+    )
+    
+    # Only the start is acknowledged over RPC; output arrives as separate frames
+    response = await agent_manager.send_command(str(server_id), {
+        "type": "execute_command_stream",
+        "command_id": str(cmd_history.id),
+        "command": command_req.command,
+    })
+    
+    if response is None or response.get("type") != "command_started":
+        if response is None:
+            error, status_code = "Agent not connected", 503
+        else:
+            error, status_code = response.get("error") or response.get("message") or "Unexpected response from agent", 500
         await crud_command_history.update_command_history(
             db,
             command_id=cmd_history.id,
             status=CommandStatus.FAILED,
-            error_message="Unexpected response from agent",
+            error_message=error,
         )
-        raise HTTPException(
-            status_code=500,
-            detail="Unexpected response from agent",
-        )
-
+        raise HTTPException(status_code=status_code, detail=f"Failed to start command: {error}")
+    
+    return CommandStreamStarted(
+        command_id=cmd_history.id,
+        status=CommandStatus.RUNNING,
+        stream_url=f"{settings.API_V1_STR}/ws/commands/{cmd_history.id}",
+    )
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from datetime import datetime
 import uuid
 from app.db.base import get_db
 from app.api.deps import get_current_user
 from app.models.user import User
 from app.models.audit_log import AuditAction
 from app.models.log_entry import LogLevel, LogSource
-from app.crud import server as crud_server
+from app.services.server_service import user_owns_server
 from app.crud import log_entry as crud_log_entry
-from app.api.v1.metrics import metrics_cache
+from app.crud import inventory_snapshot as crud_snapshot
+from app.models.inventory_snapshot import SnapshotKind
+from app.api.v1.metrics import get_latest_metrics_payload, _as_utc
 from app.services.audit_service import log_audit
 from pydantic import BaseModel
 
@@ -30,21 +33,24 @@ class DockerContainer(BaseModel):
 async def get_containers(
     server_id: uuid.UUID,
     db: AsyncSession = Depends(get_db),
+    at: Optional[datetime] = Query(None, description="Return the containers as they were at this time"),
     current_user: User = Depends(get_current_user),
 ):
-    """Get Docker containers for a server (from metrics cache)"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    """Get Docker containers for a server (from metrics cache, or as of `at`)"""
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
-    # Get containers from metrics cache
-    server_id_str = str(server_id)
-    if server_id_str not in metrics_cache:
-        # Return empty list if no metrics available yet
-        return []
-    
-    metrics = metrics_cache[server_id_str]
-    containers = metrics.get("containers", [])
+    if at is not None:
+        containers = await crud_snapshot.get_state_at(
+            db, server_id, SnapshotKind.CONTAINERS.value, _as_utc(at)
+        ) or []
+    else:
+        # Get containers from the latest metrics
+        metrics = await get_latest_metrics_payload(db, server_id)
+        if metrics is None:
+            # Return empty list if no metrics available yet
+            return []
+        containers = metrics.get("containers", [])
     
     # Convert to DockerContainer format
     result = []
@@ -71,8 +77,7 @@ async def start_container(
     current_user: User = Depends(get_current_user),
 ):
     """Start a Docker container"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # Send command to agent via WebSocket
@@ -142,8 +147,7 @@ async def stop_container(
     current_user: User = Depends(get_current_user),
 ):
     """Stop a Docker container"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # Send command to agent via WebSocket
@@ -213,8 +217,7 @@ async def restart_container(
     current_user: User = Depends(get_current_user),
 ):
     """Restart a Docker container"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # Send command to agent via WebSocket
@@ -284,8 +287,7 @@ async def get_container_logs(
     current_user: User = Depends(get_current_user),
 ):
     """Get logs for a Docker container"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # Send command to agent via WebSocket
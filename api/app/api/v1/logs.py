@@ -25,9 +25,8 @@ async def get_server_logs(
 ):
     """Get logs for a specific server"""
     # Verify server ownership
-    from app.crud import server as crud_server
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    from app.services.server_service import user_owns_server
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     logs = await crud_log_entry.get_log_entries(
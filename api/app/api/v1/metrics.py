@@ -1,21 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Dict, List, Literal
+from datetime import datetime, timedelta, timezone
+import math
 import uuid
 from app.db.base import get_db
 from app.api.deps import get_current_user, get_current_user_or_api_key
 from app.models.user import User
-from app.crud import server as crud_server
+from app.services.server_service import user_owns_server
+from app.crud import metric as crud_metric
+from app.crud import inventory_snapshot as crud_snapshot
 from app.services.ws_manager import ws_manager
+from app.services.heartbeat import heartbeat_tracker
+from app.services.downsampling import lttb
+from app.services.metric_rollup import align_step, get_history_buckets
+from app.services.recent_metrics import recent_metrics
 from pydantic import BaseModel
 
 router = APIRouter()
 
+# Upper bound on buckets/points returned by the history endpoint
+MAX_HISTORY_POINTS = 5000
+# Fine buckets per output point fed into LTTB
+LTTB_OVERSAMPLING = 10
+
 # In-memory cache for metrics (server_id -> latest metrics)
+# Only holds servers whose agent is connected to this worker
 metrics_cache: Dict[str, dict] = {}
 
 
+async def get_latest_metrics_payload(db: AsyncSession, server_id: uuid.UUID) -> Optional[dict]:
+    """Latest metrics for a server: this worker's cache, else the newest stored sample"""
+    cached = metrics_cache.get(str(server_id))
+    if cached is not None:
+        return cached
+    # The agent may be connected to another worker
+    metric = await crud_metric.get_latest_metric(db, server_id)
+    if metric is None:
+        return None
+    payload = crud_metric.metric_to_payload(metric)
+    if metric.extra_data is None:
+        for kind in crud_snapshot.ITEM_KEYS:
+            payload[kind] = await crud_snapshot.get_state_at(db, server_id, kind) or []
+    return payload
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes from query parameters as UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate the comma-separated `fields` query parameter"""
+    if not fields:
+        return list(crud_metric.HISTORY_FIELDS)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in crud_metric.HISTORY_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(crud_metric.HISTORY_FIELDS)}",
+        )
+    return selected
+
+
+async def _history_buckets(
+    db: AsyncSession,
+    server_id: uuid.UUID,
+    start_time: datetime,
+    end_time: datetime,
+    step_seconds: int,
+    fields: List[str],
+):
+    """(source, buckets) from this worker's recent samples when they cover the range, else the database"""
+    buckets = recent_metrics.get_buckets(str(server_id), start_time, end_time, step_seconds, fields)
+    if buckets is not None:
+        return "memory", buckets
+    return await get_history_buckets(db, server_id, start_time, end_time, step_seconds, fields)
+
+
 class ServerMetrics(BaseModel):
     server_id: uuid.UUID
     timestamp: datetime
@@ -63,8 +126,7 @@ async def receive_metrics(
         user = auth["user"]
         try:
             server_uuid = uuid.UUID(metrics.server_id)
-            server = await crud_server.get_server(db, server_uuid, user_id=user.id)
-            if not server:
+            if not await user_owns_server(db, server_uuid, user.id):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Server not found or access denied"
@@ -89,6 +151,7 @@ async def receive_metrics(
     
     # Store in cache
     metrics_cache[server_id_str] = metrics_dict
+    heartbeat_tracker.touch(server_id_str)
     
     # Broadcast via WebSocket
     await ws_manager.send_metrics(server_id_str, metrics_dict)
@@ -116,8 +179,7 @@ async def receive_metrics_by_id(
     elif auth.get("type") == "user":
         # For user auth, verify server ownership
         user = auth["user"]
-        server = await crud_server.get_server(db, server_id, user_id=user.id)
-        if not server:
+        if not await user_owns_server(db, server_id, user.id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Server not found or access denied"
@@ -138,6 +200,7 @@ async def receive_metrics_by_id(
     
     # Store in cache
     metrics_cache[server_id_str] = metrics_dict
+    heartbeat_tracker.touch(server_id_str)
     
     # Broadcast via WebSocket
     await ws_manager.send_metrics(server_id_str, metrics_dict)
@@ -152,18 +215,17 @@ async def get_latest_metrics(
     current_user: User = Depends(get_current_user),
 ):
     """Get latest metrics for a server (only if owned by current user)"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
-    server_id_str = str(server_id)
-    if server_id_str not in metrics_cache:
+    metrics = await get_latest_metrics_payload(db, server_id)
+    if metrics is None:
         raise HTTPException(
             status_code=404,
             detail="No metrics available for this server"
         )
     
-    return metrics_cache[server_id_str]
+    return metrics
 
 
 @router.get("/{server_id}/history")
@@ -171,18 +233,74 @@ async def get_metrics_history(
     server_id: uuid.UUID,
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
-    limit: int = 100,
+    step: Optional[int] = Query(None, ge=1, description="Bucket width in seconds"),
+    max_points: int = Query(500, ge=2, le=MAX_HISTORY_POINTS),
+    fields: Optional[str] = Query(None, description="Comma-separated metric fields"),
+    downsample: Optional[Literal["lttb"]] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Get metrics history for a server (only if owned by current user)"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    """
+    Get metrics history for a server (only if owned by current user).
+    
+    Samples are aggregated into time buckets of `step` seconds (avg/min/max/last
+    per field). The step is widened if needed so no more than `max_points`
+    buckets are returned. With `downsample=lttb` each field is instead returned
+    as at most `max_points` points picked by LTTB from fine-grained buckets.
+    Buckets come from this worker's in-memory recent samples when they cover
+    the whole range, else from the coarsest rollup table whose resolution
+    divides the step, or from raw rows (reported as `source`).
+    """
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
-    # TODO: Get actual metrics history from database/cache
-    raise HTTPException(
-        status_code=501,
-        detail="Metrics history endpoint not yet implemented - requires agent connection",
+    end_time = _as_utc(end_time) if end_time else datetime.now(timezone.utc)
+    start_time = _as_utc(start_time) if start_time else end_time - timedelta(hours=1)
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start_time must be before end_time")
+    
+    selected = _parse_fields(fields)
+    range_seconds = (end_time - start_time).total_seconds()
+    
+    if downsample == "lttb":
+        # LTTB input is bounded too: pre-aggregate into LTTB_OVERSAMPLING x max_points buckets
+        fine_step = align_step(max(1, math.ceil(range_seconds / (max_points * LTTB_OVERSAMPLING))))
+        source, buckets = await _history_buckets(
+            db, server_id, start_time, end_time, fine_step, selected
+        )
+        series = {}
+        for field in selected:
+            points = [
+                (datetime.fromisoformat(b["timestamp"]).timestamp(), b[field]["avg"])
+                for b in buckets
+                if b[field]["avg"] is not None
+            ]
+            series[field] = [
+                {"timestamp": datetime.fromtimestamp(x, timezone.utc).isoformat(), "value": y}
+                for x, y in lttb(points, max_points)
+            ]
+        return {
+            "server_id": str(server_id),
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "downsample": "lttb",
+            "source": source,
+            "step_seconds": fine_step,
+            "series": series,
+        }
+    
+    step_seconds = step or 1
+    min_step = math.ceil(range_seconds / max_points)
+    if step_seconds < min_step:
+        step_seconds = align_step(min_step)
+    source, buckets = await _history_buckets(
+        db, server_id, start_time, end_time, step_seconds, selected
     )
-
+    return {
+        "server_id": str(server_id),
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "source": source,
+        "step_seconds": step_seconds,
+        "points": buckets,
+    }
@@ -1,17 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+from datetime import datetime, timedelta, timezone
 import uuid
 from app.db.base import get_db
 from app.api.deps import get_current_user
 from app.models.user import User
 from app.models.audit_log import AuditAction
 from app.crud import server as crud_server
+from app.services.server_service import user_owns_server
+from app.crud import metric as crud_metric
 from app.schemas.server import Server, ServerCreate, ServerUpdate, ServerResponse
 from app.services.audit_service import log_audit
+from app.services.heartbeat import heartbeat_tracker
+from app.services.bus import bus
+from app.api.v1.metrics import metrics_cache
 
 router = APIRouter()
 
+# Servers silent for longer are shown without metrics on the overview
+OVERVIEW_METRICS_MAX_AGE = timedelta(hours=24)
+
 
 @router.get("", response_model=List[ServerResponse])
 async def get_servers(
@@ -31,7 +40,7 @@ async def get_servers(
             server_metadata=s.server_metadata,
             status=s.status,
             health_status=s.health_status,
-            last_seen=s.last_seen,
+            last_seen=heartbeat_tracker.merge_last_seen(s.id, s.last_seen),
             created_at=s.created_at,
             updated_at=s.updated_at,
         )
@@ -39,6 +48,60 @@ async def get_servers(
     ]
 
 
+def _metrics_summary(metrics: dict) -> dict:
+    """Latest metrics without the container/process lists"""
+    return {
+        "timestamp": metrics.get("timestamp"),
+        "cpu": metrics.get("cpu"),
+        "memory": metrics.get("memory"),
+        "disk": metrics.get("disk"),
+        "network": metrics.get("network"),
+    }
+
+
+@router.get("/overview")
+async def get_servers_overview(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    All servers of the current user with status, last_seen, latest metrics and
+    unresolved alert counts by severity, for the fleet dashboard.
+    
+    Metrics come from this worker's cache; servers missing from it are looked
+    up with one extra query over recent samples.
+    """
+    rows = await crud_server.get_servers_with_open_alert_counts(db, current_user.id)
+    
+    latest = {}
+    missing = []
+    for server, _ in rows:
+        cached = metrics_cache.get(str(server.id))
+        if cached is not None:
+            latest[server.id] = _metrics_summary(cached)
+        else:
+            missing.append(server.id)
+    if missing:
+        since = datetime.now(timezone.utc) - OVERVIEW_METRICS_MAX_AGE
+        async for metric in crud_metric.stream_latest_metrics(db, since, server_ids=missing):
+            latest[metric.server_id] = _metrics_summary(crud_metric.metric_to_payload(metric))
+    
+    servers = []
+    for server, alert_counts in rows:
+        last_seen = heartbeat_tracker.merge_last_seen(server.id, server.last_seen)
+        servers.append({
+            "id": str(server.id),
+            "name": server.name,
+            "host": server.host,
+            "status": server.status.value,
+            "health_status": server.health_status.value,
+            "last_seen": last_seen.isoformat() if last_seen else None,
+            "metrics": latest.get(server.id),
+            "open_alerts": alert_counts,
+        })
+    return {"servers": servers, "total": len(servers)}
+
+
 @router.get("/{server_id}", response_model=ServerResponse)
 async def get_server(
     server_id: uuid.UUID,
@@ -57,7 +120,7 @@ async def get_server(
         server_metadata=server.server_metadata,
         status=server.status,
         health_status=server.health_status,
-        last_seen=server.last_seen,
+        last_seen=heartbeat_tracker.merge_last_seen(server.id, server.last_seen),
         created_at=server.created_at,
         updated_at=server.updated_at,
     )
@@ -72,6 +135,7 @@ async def create_server(
 ):
     """Create a new server"""
     server = await crud_server.create_server(db, server_in, current_user.id)
+    await bus.invalidate("server_owner", str(server.id))
     
     # Log audit event
     await log_audit(
@@ -93,7 +157,7 @@ async def create_server(
         server_metadata=server.server_metadata,
         status=server.status,
         health_status=server.health_status,
-        last_seen=server.last_seen,
+        last_seen=heartbeat_tracker.merge_last_seen(server.id, server.last_seen),
         created_at=server.created_at,
         updated_at=server.updated_at,
     )
@@ -109,13 +173,14 @@ async def update_server(
 ):
     """Update server (only if owned by current user)"""
     # Verify ownership first
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     server = await crud_server.update_server(db, server_id, server_in)
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
+    # Ownership may have been transferred
+    await bus.invalidate("server_owner", str(server_id))
     
     # Log audit event
     await log_audit(
@@ -136,7 +201,7 @@ async def update_server(
         server_metadata=server.server_metadata,
         status=server.status,
         health_status=server.health_status,
-        last_seen=server.last_seen,
+        last_seen=heartbeat_tracker.merge_last_seen(server.id, server.last_seen),
         created_at=server.created_at,
         updated_at=server.updated_at,
     )
@@ -157,6 +222,11 @@ async def delete_server(
     
     server_name = server.name
     success = await crud_server.delete_server(db, server_id)
+    heartbeat_tracker.forget(server_id)
+    await bus.invalidate("server_owner", str(server_id))
+    await bus.invalidate("alert_registry", str(server_id))
+    # The server's keys were removed by cascade
+    await bus.invalidate("api_keys_of_server", str(server_id))
     
     # Log audit event
     await log_audit(
@@ -179,8 +249,7 @@ async def check_server_health(
     current_user: User = Depends(get_current_user),
 ):
     """Check server health (only if owned by current user)"""
-    server = await crud_server.get_server(db, server_id, user_id=current_user.id)
-    if not server:
+    if not await user_owns_server(db, server_id, current_user.id):
         raise HTTPException(status_code=404, detail="Server not found")
     
     # TODO: Implement actual health check via agent
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends
+from app.api.deps import get_current_user
+from app.models.user import User
+from app.services.metric_writer import metric_writer
+from app.services.log_writer import log_writer
+from app.services.recent_metrics import recent_metrics
+from app.services.warm_start import warm_start
+from app.services.heartbeat import heartbeat_tracker
+from app.services.alert_service import alert_registry
+from app.services.agent_mailbox import agent_mailboxes
+from app.services.agent_manager import agent_manager
+from app.services.command_streams import command_streams
+from app.services.command_jobs import command_jobs
+from app.services.command_fanout import command_fanout
+from app.services.bus import bus
+from app.services.ws_manager import ws_manager
+from app.services.metric_rollup import metric_rollup_job
+from app.services.metric_retention import metric_retention_job
+from app.services.auth_service import api_key_cache, user_cache
+from app.services.server_service import server_owner_cache
+from app.core.hash_pool import user_hash_pool, agent_hash_pool
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def get_system_stats(
+    current_user: User = Depends(get_current_user),
+):
+    """Get internal pipeline counters (queue depths, flush latencies)"""
+    return {
+        "metric_writer": metric_writer.stats(),
+        "log_writer": log_writer.stats(),
+        "recent_metrics": recent_metrics.stats(),
+        "warm_start": warm_start.stats(),
+        "heartbeats": heartbeat_tracker.stats(),
+        "alert_registry": alert_registry.stats(),
+        "agent_mailboxes": agent_mailboxes.stats(),
+        "agent_commands": agent_manager.stats(),
+        "command_streams": command_streams.stats(),
+        "command_jobs": command_jobs.stats(),
+        "command_fanout": command_fanout.stats(),
+        "bus": bus.stats(),
+        "dashboard_clients": ws_manager.stats(),
+        "metric_rollups": metric_rollup_job.stats(),
+        "metric_retention": metric_retention_job.stats(),
+        "api_key_cache": api_key_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "server_owner_cache": server_owner_cache.stats(),
+        "hash_pools": {
+            "user": user_hash_pool.stats(),
+            "agent": agent_hash_pool.stats(),
+        },
+    }
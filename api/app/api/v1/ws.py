@@ -1,14 +1,25 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from app.services.ws_manager import ws_manager
+from app.services.ws_manager import ws_manager, ALL_TOPICS
+from app.services.metrics_projection import Projection, parse_fields
+from app.services.command_streams import command_streams, FollowerOverflow
+from app.models.command_history import CommandHistory
+from app.core.config import settings
 from app.db.base import AsyncSessionLocal
-from app.crud.user import get_user
-from app.crud import server as crud_server
+from app.services.auth_service import get_authenticated_user
+from app.services.server_service import get_owned_server_ids, user_owns_server
 from app.core.security import decode_access_token
+import asyncio
 import uuid
 import json
+from typing import List, Optional
 
 router = APIRouter()
 
+# Upper bound on servers one multiplexed connection may subscribe to
+MAX_STREAM_SUBSCRIPTIONS = 1000
+# Subscribe message keys that set the metrics projection
+PROJECTION_KEYS = ("fields", "delta", "epsilon", "max_rate")
+
 
 @router.websocket("/ws/metrics/{server_id}")
 async def metrics_websocket(
@@ -47,16 +58,15 @@ async def metrics_websocket(
         
         # Verify user exists and owns the server
         async with AsyncSessionLocal() as db:
-            user = await get_user(db, uuid.UUID(user_id))
-            if not user:
-                await websocket.close(code=1008, reason="User not found")
+            user = await get_authenticated_user(db, uuid.UUID(user_id))
+            if not user or not user.is_active:
+                await websocket.close(code=1008, reason="User not found or inactive")
                 return
             
             # Verify server ownership
             try:
                 server_uuid = uuid.UUID(server_id)
-                server = await crud_server.get_server(db, server_uuid, user_id=user.id)
-                if not server:
+                if not await user_owns_server(db, server_uuid, user.id):
                     await websocket.close(code=1008, reason="Server not found or access denied")
                     return
             except ValueError:
@@ -69,8 +79,8 @@ async def metrics_websocket(
     # Send authentication success
     await websocket.send_json({"type": "auth_success", "message": "Authenticated successfully"})
     
-    # Connect to WebSocket manager
-    await ws_manager.connect(websocket, server_id)
+    # Connect to WebSocket manager (outbound frames go through the client's queue)
+    client = await ws_manager.connect(websocket, server_id)
     
     try:
         # Keep connection alive and wait for disconnect
@@ -81,10 +91,12 @@ async def metrics_websocket(
             try:
                 msg = json.loads(data)
                 if msg.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    client.send(json.dumps({"type": "pong"}))
             except:
                 pass
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.disconnect(websocket, server_id)
 
 
@@ -125,16 +137,15 @@ async def logs_websocket(
         
         # Verify user exists and owns the server
         async with AsyncSessionLocal() as db:
-            user = await get_user(db, uuid.UUID(user_id))
-            if not user:
-                await websocket.close(code=1008, reason="User not found")
+            user = await get_authenticated_user(db, uuid.UUID(user_id))
+            if not user or not user.is_active:
+                await websocket.close(code=1008, reason="User not found or inactive")
                 return
             
             # Verify server ownership
             try:
                 server_uuid = uuid.UUID(server_id)
-                server = await crud_server.get_server(db, server_uuid, user_id=user.id)
-                if not server:
+                if not await user_owns_server(db, server_uuid, user.id):
                     await websocket.close(code=1008, reason="Server not found or access denied")
                     return
             except ValueError:
@@ -147,8 +158,8 @@ async def logs_websocket(
     # Send authentication success
     await websocket.send_json({"type": "auth_success", "message": "Authenticated successfully"})
     
-    # Connect to WebSocket manager
-    await ws_manager.connect(websocket, server_id)
+    # Connect to WebSocket manager (outbound frames go through the client's queue)
+    client = await ws_manager.connect(websocket, server_id)
     
     try:
         # Keep connection alive and wait for disconnect
@@ -159,9 +170,210 @@ async def logs_websocket(
             try:
                 msg = json.loads(data)
                 if msg.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
+                    client.send(json.dumps({"type": "pong"}))
             except:
                 pass
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.disconnect(websocket, server_id)
 
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[uuid.UUID]:
+    """Read the auth message and validate the JWT. Returns the user id, or None after closing."""
+    try:
+        data = json.loads(await websocket.receive_text())
+        if data.get("type") != "auth" or not data.get("token"):
+            await websocket.close(code=1008, reason="Authentication required: send {'type': 'auth', 'token': '...'} as first message")
+            return None
+        payload = decode_access_token(data["token"])
+        if not payload or not payload.get("sub"):
+            await websocket.close(code=1008, reason="Invalid token")
+            return None
+        async with AsyncSessionLocal() as db:
+            user = await get_authenticated_user(db, uuid.UUID(payload["sub"]))
+        if not user or not user.is_active:
+            await websocket.close(code=1008, reason="User not found or inactive")
+            return None
+        return user.id
+    except Exception as e:
+        await websocket.close(code=1008, reason=f"Authentication failed: {str(e)}")
+        return None
+
+
+def _parse_subscription(msg: dict):
+    """(server ids, topics, invalid ids) from a subscribe/unsubscribe message. Raises ValueError."""
+    servers = msg.get("servers") or []
+    if not isinstance(servers, list):
+        raise ValueError("servers must be a list")
+    if len(servers) > MAX_STREAM_SUBSCRIPTIONS:
+        raise ValueError(f"At most {MAX_STREAM_SUBSCRIPTIONS} servers per connection")
+    topics = msg.get("topics") or list(ALL_TOPICS)
+    if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+        raise ValueError("topics must be a list of strings")
+    unknown_topics = sorted(set(topics) - ALL_TOPICS)
+    if unknown_topics:
+        raise ValueError(f"Unknown topics: {', '.join(unknown_topics)}")
+
+    server_ids: List[uuid.UUID] = []
+    invalid: List[str] = []
+    for value in servers:
+        try:
+            server_ids.append(uuid.UUID(str(value)))
+        except ValueError:
+            invalid.append(str(value))
+    return server_ids, set(topics), invalid
+
+
+def _parse_projection(msg: dict) -> Optional[Projection]:
+    """Metrics projection requested in a subscribe message (None = full frames). Raises ValueError."""
+    fields = msg.get("fields")
+    delta = bool(msg.get("delta", False))
+    max_rate = msg.get("max_rate")
+    if fields is None and not delta and max_rate is None:
+        return None
+    if fields is not None and not isinstance(fields, list):
+        raise ValueError("fields must be a list")
+    epsilon = float(msg.get("epsilon", settings.WS_DELTA_EPSILON))
+    if epsilon < 0:
+        raise ValueError("epsilon must not be negative")
+    min_interval = 0.0
+    if max_rate is not None:
+        max_rate = float(max_rate)
+        if max_rate <= 0:
+            raise ValueError("max_rate must be positive")
+        min_interval = 1.0 / max_rate
+    return Projection(parse_fields(fields) if fields is not None else None, delta, epsilon, min_interval)
+
+
+@router.websocket("/ws/stream")
+async def stream_websocket(websocket: WebSocket):
+    """
+    Multiplexed WebSocket for dashboards: one connection for any number of
+    servers and topics. Authenticate with {"type": "auth", "token": "..."}, then send
+    {"type": "subscribe", "servers": [ids], "topics": ["metrics", "logs"]} or
+    {"type": "unsubscribe", ...}. Frames carry the server_id they belong to.
+    
+    A subscribe message may also ask for "fields" (dotted paths such as
+    "cpu.usage_percent") and "delta": true, in which case one full metrics
+    frame is followed by "metrics_delta" frames holding only the fields that
+    changed by more than "epsilon". "max_rate" caps metrics frames per second;
+    samples in between are conflated to the newest one. A subscribe without
+    any of these keeps the projection already set for a server; send
+    "fields": null to go back to full frames.
+    """
+    await websocket.accept()
+    user_id = await _authenticate(websocket)
+    if user_id is None:
+        return
+    
+    await websocket.send_json({"type": "auth_success", "message": "Authenticated successfully"})
+    client = ws_manager.open(websocket)
+    
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            msg_type = msg.get("type")
+            
+            if msg_type == "ping":
+                client.send(json.dumps({"type": "pong"}))
+            
+            elif msg_type in ("subscribe", "unsubscribe"):
+                try:
+                    server_ids, topics, invalid = _parse_subscription(msg)
+                    projection = _parse_projection(msg) if msg_type == "subscribe" else None
+                except (TypeError, ValueError) as e:
+                    client.send(json.dumps({"type": "error", "message": str(e)}))
+                    continue
+                
+                if msg_type == "unsubscribe":
+                    for server_id in server_ids:
+                        ws_manager.unsubscribe(client, str(server_id), topics)
+                    client.send(json.dumps({"type": "unsubscribed", "servers": [str(s) for s in server_ids], "topics": sorted(topics)}))
+                    continue
+                
+                new = {s for s in server_ids if str(s) not in client.subscriptions}
+                if len(client.subscriptions) + len(new) > MAX_STREAM_SUBSCRIPTIONS:
+                    client.send(json.dumps({"type": "error", "message": f"At most {MAX_STREAM_SUBSCRIPTIONS} servers per connection"}))
+                    continue
+                
+                # Ownership of every requested server in one query
+                async with AsyncSessionLocal() as db:
+                    owned = set(await get_owned_server_ids(db, user_id, server_ids))
+                replace_projection = any(key in msg for key in PROJECTION_KEYS)
+                for server_id in owned:
+                    ws_manager.subscribe(client, str(server_id), topics, projection, replace_projection)
+                client.send(json.dumps({
+                    "type": "subscribed",
+                    "servers": [str(s) for s in server_ids if s in owned],
+                    "denied": [str(s) for s in server_ids if s not in owned] + invalid,
+                    "topics": sorted(topics),
+                }))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ws_manager.close(client)
+
+
+async def _forward_command_output(websocket: WebSocket, command: CommandHistory) -> None:
+    try:
+        async for frame in command_streams.follow(command):
+            await asyncio.wait_for(websocket.send_json(frame), timeout=settings.WS_CLIENT_SEND_TIMEOUT_SECONDS)
+    except (FollowerOverflow, asyncio.TimeoutError):
+        # The stored output lets the client catch up after reconnecting
+        await websocket.close(code=1013, reason="Fell behind the output, reconnect to resume")
+        return
+    await websocket.close(code=1000, reason="Command finished")
+
+
+async def _drain(websocket: WebSocket) -> None:
+    """Consume client messages until the socket closes (answers pings)"""
+    while True:
+        try:
+            msg = json.loads(await websocket.receive_text())
+        except ValueError:
+            continue
+        if isinstance(msg, dict) and msg.get("type") == "ping":
+            await websocket.send_json({"type": "pong"})
+
+
+@router.websocket("/ws/commands/{command_id}")
+async def command_output_websocket(websocket: WebSocket, command_id: str):
+    """
+    Output of a command started with POST /commands/{server_id}/stream.
+    Authenticate with {"type": "auth", "token": "..."}; the output stored so
+    far is sent first ("catch_up": true), then "command_output" frames as the
+    agent produces them (ordered by "seq"), and finally "command_exit".
+    """
+    await websocket.accept()
+    user_id = await _authenticate(websocket)
+    if user_id is None:
+        return
+    
+    try:
+        command_uuid = uuid.UUID(command_id)
+    except ValueError:
+        await websocket.close(code=1008, reason="Invalid command ID")
+        return
+    async with AsyncSessionLocal() as db:
+        command = await db.get(CommandHistory, command_uuid)
+        if command is None or not await user_owns_server(db, command.server_id, user_id):
+            await websocket.close(code=1008, reason="Command not found or access denied")
+            return
+    
+    await websocket.send_json({"type": "auth_success", "command_id": command_id})
+    forward = asyncio.create_task(_forward_command_output(websocket, command))
+    drain = asyncio.create_task(_drain(websocket))
+    try:
+        await asyncio.wait({forward, drain}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (forward, drain):
+            task.cancel()
+        await asyncio.gather(forward, drain, return_exceptions=True)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import Dict, Literal, Optional
 import re
 
 
@@ -17,6 +17,18 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # Server-side pepper for API key digests (defaults to SECRET_KEY)
+    API_KEY_PEPPER: Optional[str] = None
+    API_KEY_CACHE_TTL_SECONDS: float = 60.0
+    # Authenticated users and (user, server) ownership checks, invalidated on change
+    USER_CACHE_TTL_SECONDS: float = 30.0
+    SERVER_OWNER_CACHE_TTL_SECONDS: float = 60.0
+    
+    # Password hashing worker pools (bcrypt runs off the event loop)
+    HASH_POOL_WORKERS: int = 2
+    HASH_POOL_MAX_PENDING: int = 32
+    AGENT_HASH_POOL_WORKERS: int = 1
+    AGENT_HASH_POOL_MAX_PENDING: int = 16
     
     # CORS
     CORS_ORIGINS: list[str] = ["http://localhost:5173", "http://localhost:3000", "https://chatops.ufazien.com"]
@@ -26,6 +38,103 @@ class Settings(BaseSettings):
     
     # WebSocket
     WS_PATH: str = "/ws"
+    # Dashboard clients are disconnected when this many frames are queued
+    # or a single send takes longer than the timeout
+    WS_CLIENT_QUEUE_SIZE: int = 256
+    WS_CLIENT_SEND_TIMEOUT_SECONDS: float = 10.0
+    # Default threshold below which numeric changes are left out of metrics deltas
+    WS_DELTA_EPSILON: float = 0.1
+    
+    # Metrics ingest (write-behind batching)
+    METRICS_BATCH_SIZE: int = 500
+    METRICS_FLUSH_INTERVAL_SECONDS: float = 1.0
+    METRICS_QUEUE_MAX_SIZE: int = 50000
+    
+    # Agent log ingest (per-server rate cap + write-behind batching)
+    LOG_INGEST_RATE_PER_SERVER: float = 50.0
+    LOG_INGEST_BURST: int = 500
+    LOG_BATCH_SIZE: int = 500
+    LOG_FLUSH_INTERVAL_SECONDS: float = 1.0
+    LOG_QUEUE_MAX_SIZE: int = 20000
+    LOG_MAX_MESSAGE_LENGTH: int = 8192
+    
+    # Recent samples kept in memory per connected server (900 = 75 min at 5 s)
+    RECENT_METRICS_SAMPLES: int = 900
+    
+    # Warm start: reload the latest sample per server (and optionally the last
+    # METRICS_WARM_START_HISTORY_MINUTES of samples) at startup
+    METRICS_WARM_START: bool = True
+    METRICS_WARM_START_MAX_AGE_HOURS: float = 24.0
+    METRICS_WARM_START_HISTORY: bool = True
+    METRICS_WARM_START_HISTORY_MINUTES: int = 60
+    
+    # Raw metrics retention (the metrics table is partitioned by day)
+    METRICS_RETENTION_DAYS: int = 30
+    METRICS_RETENTION_MODE: Literal["drop", "detach"] = "drop"
+    METRICS_PARTITION_PREMAKE_DAYS: int = 7
+    METRICS_RETENTION_INTERVAL_SECONDS: float = 3600.0
+    
+    # Container/process snapshot storage (keyframes + deltas)
+    SNAPSHOT_KEYFRAME_INTERVAL_SECONDS: float = 600.0
+    SNAPSHOT_MAX_DELTAS_PER_KEYFRAME: int = 120
+    # Process cpu/memory changes smaller than this are not recorded
+    SNAPSHOT_PROCESS_TOLERANCE: float = 1.0
+    
+    # Metric rollups (1m/5m/1h aggregates kept current by a background job)
+    METRICS_ROLLUP_INTERVAL_SECONDS: float = 60.0
+    METRICS_ROLLUP_LAG_SECONDS: float = 10.0
+    # How far behind their own timestamp samples may arrive and still be in the rollup part of a history query
+    METRICS_ROLLUP_LATENESS_SECONDS: float = 300.0
+    METRICS_ROLLUP_RETENTION_DAYS_1M: int = 7
+    METRICS_ROLLUP_RETENTION_DAYS_5M: int = 30
+    METRICS_ROLLUP_RETENTION_DAYS_1H: int = 365
+    
+    # Per-agent metrics mailbox (alert evaluation + dashboard broadcast)
+    AGENT_MAILBOX_SIZE: int = 100
+    AGENT_MAILBOX_OVERFLOW: Literal["drop_oldest", "conflate_latest"] = "drop_oldest"
+    
+    # Message bus between API workers ("memory" for a single worker,
+    # "postgres" to route commands and dashboard events via LISTEN/NOTIFY)
+    MESSAGE_BUS_BACKEND: Literal["memory", "postgres"] = "memory"
+    BUS_RPC_ACCEPT_TIMEOUT_SECONDS: float = 2.0
+    
+    # Agent commands: reply timeout per command type (JSON object in the
+    # environment) with a default, and commands in flight per agent
+    AGENT_RPC_TIMEOUT_SECONDS: float = 10.0
+    AGENT_RPC_TIMEOUTS: Dict[str, float] = {
+        "execute_command": 60.0,
+        "get_container_logs": 15.0,
+        "stop_container": 30.0,
+        "restart_container": 30.0,
+    }
+    AGENT_RPC_MAX_IN_FLIGHT: int = 4
+    
+    # Streamed command output: write-back interval, stored output cap per
+    # command and how long a streamed command may run
+    COMMAND_STREAM_FLUSH_INTERVAL_SECONDS: float = 0.5
+    COMMAND_OUTPUT_MAX_BYTES: int = 10 * 1024 * 1024
+    COMMAND_STREAM_TIMEOUT_SECONDS: float = 3600.0
+
+    # Outputs larger than COMMAND_OUTPUT_INLINE_BYTES are stored zlib-compressed
+    # in chunks of COMMAND_OUTPUT_CHUNK_BYTES, with a preview of that size kept
+    # in command_history; ranged reads return at most COMMAND_OUTPUT_READ_MAX_BYTES
+    COMMAND_OUTPUT_INLINE_BYTES: int = 64 * 1024
+    COMMAND_OUTPUT_CHUNK_BYTES: int = 256 * 1024
+    COMMAND_OUTPUT_READ_MAX_BYTES: int = 1024 * 1024
+
+    # Background command jobs (`?async=true`): commands run at once and
+    # jobs accepted (running + waiting for a slot) per worker
+    COMMAND_JOBS_MAX_RUNNING: int = 32
+    COMMAND_JOBS_MAX_QUEUED: int = 1000
+
+    # Fleet-wide command fan-out: default and maximum commands in flight per
+    # request, and servers per request
+    COMMAND_FANOUT_PARALLELISM: int = 50
+    COMMAND_FANOUT_MAX_PARALLELISM: int = 200
+    COMMAND_FANOUT_MAX_SERVERS: int = 1000
+    
+    # Agent liveness (servers.last_seen write-back interval)
+    HEARTBEAT_FLUSH_INTERVAL_SECONDS: float = 15.0
     
     @property
     def async_database_url(self) -> str:
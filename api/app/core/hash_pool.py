@@ -0,0 +1,113 @@
+"""Bounded worker pools for CPU-bound password and key hashing"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from app.core.config import settings
+
+
+class HashPoolBusy(Exception):
+    """Raised when a hash pool already has its maximum number of pending jobs"""
+
+    def __init__(self, pool_name: str):
+        self.pool_name = pool_name
+        super().__init__(f"Hash pool '{pool_name}' is at capacity")
+
+
+class HashPool:
+    """
+    Run blocking hash functions (bcrypt) on a small dedicated thread pool.
+
+    bcrypt releases the GIL while hashing, so threads keep the event loop free
+    without the cost of a process pool. Admission is bounded: once
+    `max_pending` jobs are queued or running, new jobs are rejected with
+    HashPoolBusy instead of piling up behind each other.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"hash-{name}"
+        )
+        self._pending = 0
+
+        # Counters
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_pending_seen = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_run_ms = 0.0
+
+    @property
+    def pending(self) -> int:
+        """Jobs currently queued or running"""
+        return self._pending
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool, raising HashPoolBusy if the pool is saturated"""
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HashPoolBusy(self.name)
+
+        self._pending += 1
+        self.submitted += 1
+        self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        submitted_at = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started - submitted_at, time.perf_counter() - started
+
+        try:
+            loop = asyncio.get_running_loop()
+            result, wait_s, run_s = await loop.run_in_executor(self._executor, job)
+        finally:
+            self._pending -= 1
+        self._record(wait_s, run_s)
+        return result
+
+    def _record(self, wait_s: float, run_s: float) -> None:
+        wait_ms = wait_s * 1000
+        self.completed += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.total_run_ms += run_s * 1000
+
+    def shutdown(self) -> None:
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """Queue depth, rejection and latency counters"""
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "max_pending_seen": self.max_pending_seen,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_ms / self.completed, 3) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 3),
+            "avg_run_ms": round(self.total_run_ms / self.completed, 3) if self.completed else 0.0,
+        }
+
+
+# User-facing hashing (login, register, change password, API key creation)
+user_hash_pool = HashPool(
+    "user",
+    max_workers=settings.HASH_POOL_WORKERS,
+    max_pending=settings.HASH_POOL_MAX_PENDING,
+)
+
+# Agent authentication gets its own pool so a login flood cannot delay agents reconnecting
+agent_hash_pool = HashPool(
+    "agent",
+    max_workers=settings.AGENT_HASH_POOL_WORKERS,
+    max_pending=settings.AGENT_HASH_POOL_MAX_PENDING,
+)
@@ -3,6 +3,7 @@ from typing import Optional
 from jose import JWTError, jwt
 import bcrypt
 from app.core.config import settings
+from app.core.hash_pool import HashPool, user_hash_pool
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -23,6 +24,18 @@ def get_password_hash(password: str) -> str:
     return hashed.decode('utf-8')
 
 
+async def verify_password_async(
+    plain_password: str, hashed_password: str, pool: HashPool = user_hash_pool
+) -> bool:
+    """Verify a password on the hash pool instead of the event loop"""
+    return await pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str, pool: HashPool = user_hash_pool) -> str:
+    """Hash a password on the hash pool instead of the event loop"""
+    return await pool.run(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
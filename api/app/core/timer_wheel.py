@@ -0,0 +1,86 @@
+import asyncio
+import math
+from typing import Callable, Hashable, List, Optional, Set, Tuple
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: many short one-shot timers on a single asyncio task.
+
+    Timers are rounded up to the next `tick` and kept in one of `slots`
+    buckets; each tick fires the due keys of the current bucket through
+    `callback(key)`. Scheduling and firing are O(1) per timer, and the task
+    only runs while timers are pending. With `autorun` off no task is
+    started and the owner moves the wheel with `advance` (used by tests).
+    """
+
+    def __init__(self, tick: float, slots: int, callback: Callable[[Hashable], None], autorun: bool = True):
+        self.tick = tick
+        self.slots = slots
+        self.callback = callback
+        self.autorun = autorun
+        # Each slot holds (key, due tick) pairs
+        self._wheel: List[Set[Tuple[Hashable, int]]] = [set() for _ in range(slots)]
+        self._current = 0
+        self._pending = 0
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.scheduled = 0
+        self.fired = 0
+        self.errors = 0
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        """Fire `callback(key)` after roughly `delay` seconds (never early)"""
+        due = self._current + max(1, math.ceil(delay / self.tick))
+        self._wheel[due % self.slots].add((key, due))
+        self._pending += 1
+        self.scheduled += 1
+        if self.autorun and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    def advance(self, ticks: int = 1) -> int:
+        """Move the wheel `ticks` ticks forward, firing due timers. Returns how many fired."""
+        fired = 0
+        for _ in range(ticks):
+            self._current += 1
+            bucket = self._wheel[self._current % self.slots]
+            due = [entry for entry in bucket if entry[1] <= self._current]
+            for entry in due:
+                bucket.discard(entry)
+                self._pending -= 1
+                self.fired += 1
+                fired += 1
+                try:
+                    self.callback(entry[0])
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error in timer callback: {e}")
+        return fired
+
+    async def _run(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+    async def stop(self) -> None:
+        """Cancel the tick task and drop pending timers"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for bucket in self._wheel:
+            bucket.clear()
+        self._pending = 0
+
+    def stats(self) -> dict:
+        """Timer counters"""
+        return {
+            "pending": self._pending,
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "errors": self.errors,
+        }
@@ -9,6 +9,7 @@ from app.crud import (
     alert,
     api_key,
     metric,
+    inventory_snapshot,
     log_entry,
     command_history,
     connection_event,
@@ -50,6 +50,14 @@ async def get_alerts(
     return list(result.scalars().all())
 
 
+async def get_open_alerts(db: AsyncSession, server_id: uuid.UUID) -> List[Alert]:
+    """Get all unresolved alerts for a server"""
+    result = await db.execute(
+        select(Alert).where(Alert.server_id == server_id, Alert.resolved == False)
+    )
+    return list(result.scalars().all())
+
+
 async def create_alert(db: AsyncSession, alert_in: AlertCreate) -> Alert:
     """Create a new alert"""
     db_alert = Alert(**alert_in.model_dump())
@@ -1,26 +1,50 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import Optional, List
+import hashlib
+import hmac
+import re
 import uuid
 import secrets
 from app.models.api_key import APIKey
 from app.schemas.api_key import APIKeyCreate
-from app.core.security import get_password_hash, verify_password
+from app.core.config import settings
+from app.core.security import verify_password
 
+# Keys look like chatops_<key_prefix>_<secret>; the prefix is public and indexed
+API_KEY_SCHEME = "chatops"
+# Marker for key hashes stored as a keyed digest (legacy keys are bcrypt hashes)
+HMAC_HASH_PREFIX = "hmac-sha256$"
+# Keys issued before prefixes existed were secrets.token_urlsafe(32)
+LEGACY_KEY_PATTERN = re.compile(r"[A-Za-z0-9_-]{43}")
 
-def generate_api_key() -> str:
-    """Generate a secure API key"""
-    # Generate a 32-byte random key and encode as hex (64 characters)
-    return secrets.token_urlsafe(32)
+
+def generate_api_key() -> tuple[str, str]:
+    """Generate a secure API key. Returns (key_prefix, plain_key)."""
+    key_prefix = secrets.token_hex(6)
+    secret = secrets.token_urlsafe(32)
+    return key_prefix, f"{API_KEY_SCHEME}_{key_prefix}_{secret}"
+
+
+def parse_key_prefix(plain_key: str) -> Optional[str]:
+    """Extract the public key prefix, or None for keys issued before prefixes existed"""
+    parts = plain_key.split("_", 2)
+    if len(parts) != 3 or parts[0] != API_KEY_SCHEME or not parts[1] or not parts[2]:
+        return None
+    return parts[1]
 
 
 def hash_api_key(key: str) -> str:
-    """Hash an API key for storage"""
-    return get_password_hash(key)
+    """Hash an API key for storage (HMAC-SHA256 with the server pepper)"""
+    pepper = (settings.API_KEY_PEPPER or settings.SECRET_KEY).encode('utf-8')
+    digest = hmac.new(pepper, key.encode('utf-8'), hashlib.sha256).hexdigest()
+    return HMAC_HASH_PREFIX + digest
 
 
 def verify_api_key(plain_key: str, hashed_key: str) -> bool:
-    """Verify an API key against its hash"""
+    """Verify an API key against its hash (keyed digest or legacy bcrypt)"""
+    if hashed_key.startswith(HMAC_HASH_PREFIX):
+        return hmac.compare_digest(hash_api_key(plain_key), hashed_key)
     return verify_password(plain_key, hashed_key)
 
 
@@ -36,6 +60,34 @@ async def get_api_key_by_hash(db: AsyncSession, key_hash: str) -> Optional[APIKe
     return result.scalar_one_or_none()
 
 
+async def get_active_api_key_by_prefix(db: AsyncSession, key_prefix: str) -> Optional[APIKey]:
+    """Get the active API key with a public key prefix"""
+    result = await db.execute(
+        select(APIKey).where(APIKey.key_prefix == key_prefix, APIKey.is_active == True)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_active_api_key_by_hash(db: AsyncSession, key_hash: str) -> Optional[APIKey]:
+    """Get the active API key with a hash"""
+    result = await db.execute(
+        select(APIKey).where(APIKey.key_hash == key_hash, APIKey.is_active == True)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_unmigrated_api_keys(db: AsyncSession) -> List[APIKey]:
+    """Active keys issued before prefixes existed that still have a bcrypt hash"""
+    result = await db.execute(
+        select(APIKey).where(
+            APIKey.is_active == True,
+            APIKey.key_prefix.is_(None),
+            ~APIKey.key_hash.startswith(HMAC_HASH_PREFIX),
+        )
+    )
+    return list(result.scalars().all())
+
+
 async def get_api_keys_by_server(
     db: AsyncSession, server_id: uuid.UUID, active_only: bool = False
 ) -> List[APIKey]:
@@ -52,11 +104,12 @@ async def create_api_key(
 ) -> tuple[APIKey, str]:
     """Create a new API key and return the key object and the plain key"""
     # Generate the API key
-    plain_key = generate_api_key()
+    key_prefix, plain_key = generate_api_key()
     key_hash = hash_api_key(plain_key)
     
     db_key = APIKey(
         server_id=key_in.server_id,
+        key_prefix=key_prefix,
         key_hash=key_hash,
         name=key_in.name,
         expires_at=key_in.expires_at,
@@ -69,25 +122,6 @@ async def create_api_key(
     return db_key, plain_key
 
 
-async def verify_and_get_api_key(db: AsyncSession, plain_key: str) -> Optional[APIKey]:
-    """Verify an API key and return the key object if valid"""
-    # We need to check all keys - this is not ideal for performance
-    # In production, you might want to add an index or use a different approach
-    result = await db.execute(select(APIKey).where(APIKey.is_active == True))
-    keys = result.scalars().all()
-    
-    for key in keys:
-        if verify_api_key(plain_key, key.key_hash):
-            # Update last_used timestamp
-            from datetime import datetime
-            key.last_used = datetime.utcnow()
-            await db.commit()
-            await db.refresh(key)
-            return key
-    
-    return None
-
-
 async def deactivate_api_key(db: AsyncSession, key_id: uuid.UUID) -> bool:
     """Deactivate an API key"""
     db_key = await get_api_key(db, key_id)
@@ -1,9 +1,59 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from typing import Optional, List
+from sqlalchemy import select, desc, update, insert, delete, func
+from sqlalchemy.orm import defer
+from typing import Optional, List, Tuple
 from datetime import datetime, timezone
 import uuid
-from app.models.command_history import CommandHistory, CommandStatus
+import zlib
+from app.core.config import settings
+from app.models.command_history import CommandHistory, CommandOutputChunk, CommandStatus
+
+OUTPUT_STREAMS = ("stdout", "stderr")
+
+
+def split_output(
+    command_id: uuid.UUID,
+    stream: str,
+    text: str,
+    inline_bytes: int = settings.COMMAND_OUTPUT_INLINE_BYTES,
+    chunk_bytes: int = settings.COMMAND_OUTPUT_CHUNK_BYTES,
+) -> Tuple[str, Optional[int], List[dict]]:
+    """
+    How to store one output: the inline value, the full size in bytes (None
+    when it fits inline) and the compressed chunk rows.
+    """
+    raw = text.encode()
+    if len(raw) <= inline_bytes:
+        return text, None, []
+    # The preview may end in the middle of a character; drop the partial one
+    preview = raw[:inline_bytes].decode(errors="ignore")
+    chunks = [
+        {
+            "command_id": command_id,
+            "stream": stream,
+            "start": start,
+            "size": len(raw[start:start + chunk_bytes]),
+            "data": zlib.compress(raw[start:start + chunk_bytes]),
+        }
+        for start in range(0, len(raw), chunk_bytes)
+    ]
+    return preview, len(raw), chunks
+
+
+async def _store_output(db: AsyncSession, cmd_history: CommandHistory, stream: str, text: str) -> None:
+    """Set stdout/stderr of a row, moving large outputs to command_output_chunks (caller commits)"""
+    preview, size, chunks = split_output(cmd_history.id, stream, text)
+    if getattr(cmd_history, f"{stream}_size") is not None:
+        await db.execute(
+            delete(CommandOutputChunk).where(
+                CommandOutputChunk.command_id == cmd_history.id,
+                CommandOutputChunk.stream == stream,
+            )
+        )
+    setattr(cmd_history, stream, preview)
+    setattr(cmd_history, f"{stream}_size", size)
+    if chunks:
+        await db.execute(insert(CommandOutputChunk).values(chunks))
 
 
 async def create_command_history(
@@ -37,6 +87,7 @@ async def update_command_history(
     stdout: Optional[str] = None,
     stderr: Optional[str] = None,
     error_message: Optional[str] = None,
+    started_at: Optional[datetime] = None,
 ) -> Optional[CommandHistory]:
     """Update a command history entry"""
     cmd_history = await db.get(CommandHistory, command_id)
@@ -48,11 +99,13 @@ async def update_command_history(
     if exit_code is not None:
         cmd_history.exit_code = exit_code
     if stdout is not None:
-        cmd_history.stdout = stdout
+        await _store_output(db, cmd_history, "stdout", stdout)
     if stderr is not None:
-        cmd_history.stderr = stderr
+        await _store_output(db, cmd_history, "stderr", stderr)
     if error_message is not None:
         cmd_history.error_message = error_message
+    if started_at is not None:
+        cmd_history.started_at = started_at
     
     # Calculate duration if completing
     if status in [CommandStatus.COMPLETED, CommandStatus.FAILED, CommandStatus.TIMEOUT]:
@@ -66,6 +119,99 @@ async def update_command_history(
     return cmd_history
 
 
+async def create_command_history_bulk(db: AsyncSession, rows: List[dict]) -> None:
+    """Insert many finished commands (e.g. one fan-out) in one statement, plus their large outputs"""
+    if not rows:
+        return
+    chunks: List[dict] = []
+    # Copies: callers may still send the full outputs of these rows to clients
+    rows = [dict(row) for row in rows]
+    for row in rows:
+        for stream in OUTPUT_STREAMS:
+            row[f"{stream}_size"] = None
+            if row.get(stream) is not None:
+                row[stream], row[f"{stream}_size"], stream_chunks = split_output(row["id"], stream, row[stream])
+                chunks.extend(stream_chunks)
+    await db.execute(insert(CommandHistory).values(rows))
+    if chunks:
+        await db.execute(insert(CommandOutputChunk).values(chunks))
+    await db.commit()
+
+
+async def append_command_output(
+    db: AsyncSession,
+    command_id: uuid.UUID,
+    output_seq: int,
+    stdout: str = "",
+    stderr: str = "",
+) -> None:
+    """Append streamed output to a command in one UPDATE and record the last chunk it includes"""
+    values = {"output_seq": output_seq}
+    if stdout:
+        values["stdout"] = func.coalesce(CommandHistory.stdout, "") + stdout
+    if stderr:
+        values["stderr"] = func.coalesce(CommandHistory.stderr, "") + stderr
+    await db.execute(update(CommandHistory).where(CommandHistory.id == command_id).values(**values))
+    await db.commit()
+
+
+async def compact_command_output(db: AsyncSession, command_id: uuid.UUID) -> bool:
+    """Move a finished command's large inline output (e.g. streamed) to chunks. Returns True if anything moved."""
+    cmd_history = await db.get(CommandHistory, command_id)
+    if not cmd_history:
+        return False
+    moved = False
+    for stream in OUTPUT_STREAMS:
+        text = getattr(cmd_history, stream)
+        if (
+            text
+            and getattr(cmd_history, f"{stream}_size") is None
+            and len(text) * 4 > settings.COMMAND_OUTPUT_INLINE_BYTES  # cheap upper bound before encoding
+            and len(text.encode()) > settings.COMMAND_OUTPUT_INLINE_BYTES
+        ):
+            await _store_output(db, cmd_history, stream, text)
+            moved = True
+    if moved:
+        await db.commit()
+    return moved
+
+
+async def read_command_output(
+    db: AsyncSession,
+    cmd_history: CommandHistory,
+    stream: str,
+    offset: int = 0,
+    length: Optional[int] = None,
+) -> Tuple[bytes, int]:
+    """Bytes [offset, offset + length) of a command's stdout or stderr, and the output's full size"""
+    size = getattr(cmd_history, f"{stream}_size")
+    if size is None:
+        raw = (getattr(cmd_history, stream) or "").encode()
+        end = len(raw) if length is None else offset + length
+        return raw[offset:end], len(raw)
+    
+    end = size if length is None else min(size, offset + length)
+    if offset >= end:
+        return b"", size
+    # Only the chunks overlapping the range are read
+    result = await db.execute(
+        select(CommandOutputChunk.start, CommandOutputChunk.data)
+        .where(
+            CommandOutputChunk.command_id == cmd_history.id,
+            CommandOutputChunk.stream == stream,
+            CommandOutputChunk.start < end,
+            CommandOutputChunk.start + CommandOutputChunk.size > offset,
+        )
+        .order_by(CommandOutputChunk.start)
+    )
+    chunks = result.all()
+    if not chunks:
+        return b"", size
+    raw = b"".join(zlib.decompress(data) for _, data in chunks)
+    first = chunks[0][0]
+    return raw[offset - first:end - first], size
+
+
 async def get_command_history(
     db: AsyncSession,
     server_id: Optional[uuid.UUID] = None,
@@ -73,8 +219,11 @@ async def get_command_history(
     status: Optional[CommandStatus] = None,
     limit: int = 100,
 ) -> List[CommandHistory]:
-    """Get command history with filters"""
-    query = select(CommandHistory)
+    """Get command history with filters (outputs are not loaded; read them with read_command_output)"""
+    query = select(CommandHistory).options(
+        defer(CommandHistory.stdout, raiseload=True),
+        defer(CommandHistory.stderr, raiseload=True),
+    )
     
     if server_id:
         query = query.where(CommandHistory.server_id == server_id)
@@ -0,0 +1,168 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, desc, insert, text, func, and_
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import uuid
+from app.models.inventory_snapshot import InventorySnapshot, SnapshotKind
+from app.models.metric import Metric
+
+
+# Field identifying an item across samples
+ITEM_KEYS = {
+    SnapshotKind.CONTAINERS.value: "id",
+    SnapshotKind.PROCESSES.value: "pid",
+}
+
+State = Dict[str, dict]
+
+
+def index_items(kind: str, items: Iterable[dict]) -> State:
+    """Key a list of containers/processes by their identifying field"""
+    key_field = ITEM_KEYS[kind]
+    return {str(item.get(key_field)): item for item in items}
+
+
+def apply_delta(kind: str, state: State, delta: dict) -> State:
+    """Apply a delta to a state (returns a new state)"""
+    state = dict(state)
+    for key in delta.get("remove", ()):
+        state.pop(key, None)
+    state.update(index_items(kind, delta.get("upsert", ())))
+    return state
+
+
+def rebuild_state(kind: str, rows: Iterable[Tuple[bool, dict]]) -> List[dict]:
+    """Rebuild a list from (is_keyframe, data) rows ordered by time, starting at a keyframe"""
+    state: State = {}
+    for is_keyframe, data in rows:
+        state = index_items(kind, data) if is_keyframe else apply_delta(kind, state, data)
+    return list(state.values())
+
+
+async def create_snapshots_bulk(db: AsyncSession, rows: List[dict]) -> int:
+    """Insert many snapshot rows in a single statement. Returns count of inserted rows."""
+    if not rows:
+        return 0
+
+    await db.execute(insert(InventorySnapshot), rows)
+    await db.commit()
+    return len(rows)
+
+
+async def get_state_at(
+    db: AsyncSession,
+    server_id: uuid.UUID,
+    kind: str,
+    at: Optional[datetime] = None,
+) -> Optional[List[dict]]:
+    """
+    Rebuild the container/process list of a server as of `at` (default: now).
+
+    Starts from the newest keyframe at or before `at` and applies the deltas
+    written after it. Falls back to the containers/processes that older rows
+    kept in metrics.extra_data. Returns None if nothing was recorded.
+    """
+    keyframe_query = select(InventorySnapshot.timestamp).where(
+        InventorySnapshot.server_id == server_id,
+        InventorySnapshot.kind == kind,
+        InventorySnapshot.is_keyframe.is_(True),
+    )
+    if at is not None:
+        keyframe_query = keyframe_query.where(InventorySnapshot.timestamp <= at)
+    keyframe_query = keyframe_query.order_by(desc(InventorySnapshot.timestamp)).limit(1)
+    keyframe_at = (await db.execute(keyframe_query)).scalar_one_or_none()
+
+    if keyframe_at is not None:
+        query = select(InventorySnapshot.is_keyframe, InventorySnapshot.data).where(
+            InventorySnapshot.server_id == server_id,
+            InventorySnapshot.kind == kind,
+            InventorySnapshot.timestamp >= keyframe_at,
+        )
+        if at is not None:
+            query = query.where(InventorySnapshot.timestamp <= at)
+        # The keyframe sorts first when a delta shares its timestamp
+        query = query.order_by(InventorySnapshot.timestamp, desc(InventorySnapshot.is_keyframe))
+        result = await db.execute(query)
+        return rebuild_state(kind, result.all())
+
+    # Rows written before snapshots moved out of the metrics table
+    legacy_query = select(Metric.extra_data).where(
+        Metric.server_id == server_id,
+        Metric.extra_data.isnot(None),
+    )
+    if at is not None:
+        legacy_query = legacy_query.where(Metric.timestamp <= at)
+    legacy_query = legacy_query.order_by(desc(Metric.timestamp)).limit(1)
+    extra_data = (await db.execute(legacy_query)).scalar_one_or_none()
+    if extra_data is None:
+        return None
+    return extra_data.get(kind, [])
+
+
+async def get_latest_states(
+    db: AsyncSession, since: datetime, batch_size: int = 1000
+) -> Dict[Tuple[uuid.UUID, str], List[dict]]:
+    """
+    Current container/process lists of every server with a keyframe since
+    `since`, keyed by (server_id, kind). One streamed query: each server's
+    newest keyframe and the deltas after it.
+    """
+    latest = (
+        select(
+            InventorySnapshot.server_id,
+            InventorySnapshot.kind,
+            func.max(InventorySnapshot.timestamp).label("keyframe_at"),
+        )
+        .where(InventorySnapshot.is_keyframe.is_(True), InventorySnapshot.timestamp >= since)
+        .group_by(InventorySnapshot.server_id, InventorySnapshot.kind)
+        .subquery()
+    )
+    query = (
+        select(
+            InventorySnapshot.server_id,
+            InventorySnapshot.kind,
+            InventorySnapshot.is_keyframe,
+            InventorySnapshot.data,
+        )
+        .join(latest, and_(
+            InventorySnapshot.server_id == latest.c.server_id,
+            InventorySnapshot.kind == latest.c.kind,
+            InventorySnapshot.timestamp >= latest.c.keyframe_at,
+        ))
+        .order_by(
+            InventorySnapshot.server_id,
+            InventorySnapshot.kind,
+            InventorySnapshot.timestamp,
+            desc(InventorySnapshot.is_keyframe),
+        )
+        .execution_options(yield_per=batch_size)
+    )
+
+    rows: Dict[Tuple[uuid.UUID, str], list] = {}
+    result = await db.stream(query)
+    async for server_id, kind, is_keyframe, data in result:
+        rows.setdefault((server_id, kind), []).append((is_keyframe, data))
+    return {key: rebuild_state(key[1], chain) for key, chain in rows.items()}
+
+
+async def delete_old_snapshots(db: AsyncSession, older_than_days: int = 30) -> int:
+    """
+    Delete snapshots older than specified days. Returns count deleted.
+
+    Rows are only removed before the newest keyframe preceding the cutoff, so
+    every remaining delta still has a keyframe to start from.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    result = await db.execute(
+        text(
+            "DELETE FROM inventory_snapshots s "
+            "USING ("
+            "  SELECT server_id, kind, max(timestamp) AS keyframe_at FROM inventory_snapshots "
+            "  WHERE is_keyframe AND timestamp <= :cutoff GROUP BY server_id, kind"
+            ") k "
+            "WHERE s.server_id = k.server_id AND s.kind = k.kind AND s.timestamp < k.keyframe_at"
+        ),
+        {"cutoff": cutoff},
+    )
+    await db.commit()
+    return result.rowcount
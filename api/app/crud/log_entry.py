@@ -1,5 +1,5 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, insert
 from typing import Optional, List
 from datetime import datetime
 import uuid
@@ -31,6 +31,16 @@ async def create_log_entry(
     return log_entry
 
 
+async def create_log_entries_bulk(db: AsyncSession, rows: List[dict]) -> int:
+    """Insert many log rows in a single multi-row statement. Returns count of inserted rows."""
+    if not rows:
+        return 0
+    
+    await db.execute(insert(LogEntry), rows)
+    await db.commit()
+    return len(rows)
+
+
 async def get_log_entries(
     db: AsyncSession,
     server_id: Optional[uuid.UUID] = None,
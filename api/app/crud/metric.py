@@ -1,44 +1,101 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from typing import Optional, List
-from datetime import datetime, timedelta
+from sqlalchemy import select, desc, insert, func, literal_column, text, Float
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from typing import AsyncIterator, Dict, Optional, List, Sequence, Tuple
+from datetime import date, datetime, timedelta, timezone
 import uuid
-from app.models.metric import Metric
+from app.models.metric import Metric, SERIES_FIELDS
 
 
-async def create_metric(db: AsyncSession, server_id: uuid.UUID, metrics_data: dict) -> Metric:
-    """Create a new metric entry"""
+# Numeric columns that can be requested from the history endpoint
+HISTORY_FIELDS = SERIES_FIELDS
+
+
+def _parse_timestamp(value) -> datetime:
+    """Parse an agent timestamp (datetime or ISO string), defaulting to now"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def build_metric_values(server_id: uuid.UUID, metrics_data: dict) -> dict:
+    """Build the column values for a metrics row from an agent metrics payload"""
     cpu = metrics_data.get("cpu", {})
     memory = metrics_data.get("memory", {})
     disk = metrics_data.get("disk", {})
     network = metrics_data.get("network", {})
     
-    # Extract containers and processes for extra_data
-    extra_data = {
-        "containers": metrics_data.get("containers", []),
-        "processes": metrics_data.get("processes", []),
+    return {
+        "id": uuid.uuid4(),
+        "server_id": server_id,
+        "timestamp": _parse_timestamp(metrics_data.get("timestamp")),
+        "cpu_usage_percent": cpu.get("usage_percent", 0.0),
+        "cpu_cores": cpu.get("cores"),
+        "cpu_frequency_mhz": cpu.get("frequency_mhz"),
+        "memory_total_gb": memory.get("total_gb", 0.0),
+        "memory_used_gb": memory.get("used_gb", 0.0),
+        "memory_available_gb": memory.get("available_gb", 0.0),
+        "memory_usage_percent": memory.get("usage_percent", 0.0),
+        "disk_total_gb": disk.get("total_gb", 0.0),
+        "disk_used_gb": disk.get("used_gb", 0.0),
+        "disk_available_gb": disk.get("available_gb", 0.0),
+        "disk_usage_percent": disk.get("usage_percent", 0.0),
+        "network_bytes_sent": network.get("bytes_sent"),
+        "network_bytes_recv": network.get("bytes_recv"),
+        "network_packets_sent": network.get("packets_sent"),
+        "network_packets_recv": network.get("packets_recv"),
+        # Containers and processes are stored as deltas in inventory_snapshots
+        "extra_data": None,
     }
+
+
+def metric_to_payload(metric: Metric) -> dict:
+    """
+    Rebuild the agent-style metrics payload from a stored metrics row.
     
-    metric = Metric(
-        server_id=server_id,
-        timestamp=metrics_data.get("timestamp", datetime.utcnow()),
-        cpu_usage_percent=cpu.get("usage_percent", 0.0),
-        cpu_cores=cpu.get("cores"),
-        cpu_frequency_mhz=cpu.get("frequency_mhz"),
-        memory_total_gb=memory.get("total_gb", 0.0),
-        memory_used_gb=memory.get("used_gb", 0.0),
-        memory_available_gb=memory.get("available_gb", 0.0),
-        memory_usage_percent=memory.get("usage_percent", 0.0),
-        disk_total_gb=disk.get("total_gb", 0.0),
-        disk_used_gb=disk.get("used_gb", 0.0),
-        disk_available_gb=disk.get("available_gb", 0.0),
-        disk_usage_percent=disk.get("usage_percent", 0.0),
-        network_bytes_sent=network.get("bytes_sent"),
-        network_bytes_recv=network.get("bytes_recv"),
-        network_packets_sent=network.get("packets_sent"),
-        network_packets_recv=network.get("packets_recv"),
-        extra_data=extra_data,
-    )
+    Only rows written before inventory snapshots existed carry containers and
+    processes; callers fill them in from crud.inventory_snapshot otherwise.
+    """
+    extra_data = metric.extra_data or {}
+    return {
+        "server_id": str(metric.server_id),
+        "timestamp": metric.timestamp.isoformat(),
+        "cpu": {
+            "usage_percent": metric.cpu_usage_percent,
+            "cores": metric.cpu_cores,
+            "frequency_mhz": metric.cpu_frequency_mhz,
+        },
+        "memory": {
+            "total_gb": metric.memory_total_gb,
+            "used_gb": metric.memory_used_gb,
+            "available_gb": metric.memory_available_gb,
+            "usage_percent": metric.memory_usage_percent,
+        },
+        "disk": {
+            "total_gb": metric.disk_total_gb,
+            "used_gb": metric.disk_used_gb,
+            "available_gb": metric.disk_available_gb,
+            "usage_percent": metric.disk_usage_percent,
+        },
+        "network": {
+            "bytes_sent": metric.network_bytes_sent,
+            "bytes_recv": metric.network_bytes_recv,
+            "packets_sent": metric.network_packets_sent,
+            "packets_recv": metric.network_packets_recv,
+        },
+        "containers": extra_data.get("containers", []),
+        "processes": extra_data.get("processes", []),
+    }
+
+
+async def create_metric(db: AsyncSession, server_id: uuid.UUID, metrics_data: dict) -> Metric:
+    """Create a new metric entry"""
+    metric = Metric(**build_metric_values(server_id, metrics_data))
     
     db.add(metric)
     await db.commit()
@@ -46,6 +103,17 @@ async def create_metric(db: AsyncSession, server_id: uuid.UUID, metrics_data: di
     return metric
 
 
+async def create_metrics_bulk(db: AsyncSession, rows: List[dict]) -> int:
+    """Insert many metric rows in a single multi-row statement. Returns count of inserted rows."""
+    if not rows:
+        return 0
+    
+    # A list of parameter sets makes SQLAlchemy use executemany / insertmanyvalues
+    await db.execute(insert(Metric), rows)
+    await db.commit()
+    return len(rows)
+
+
 async def get_metrics(
     db: AsyncSession,
     server_id: uuid.UUID,
@@ -67,6 +135,66 @@ async def get_metrics(
     return list(result.scalars().all())
 
 
+async def get_metric_buckets(
+    db: AsyncSession,
+    server_id: uuid.UUID,
+    start_time: datetime,
+    end_time: datetime,
+    step_seconds: int,
+    fields: Sequence[str] = HISTORY_FIELDS,
+) -> List[dict]:
+    """
+    Aggregate metrics into fixed time buckets (avg/min/max/last per field).
+    
+    Buckets are aligned to the Unix epoch with date_bin, so the same step
+    always yields the same bucket boundaries. The range filter uses
+    idx_metrics_server_timestamp.
+    """
+    bucket = func.date_bin(
+        func.make_interval(0, 0, 0, 0, 0, 0, step_seconds),
+        Metric.timestamp,
+        func.to_timestamp(0),
+    ).label("bucket")
+    
+    columns = [bucket, func.count().label("count")]
+    for field in fields:
+        column = getattr(Metric, field)
+        columns.extend([
+            func.avg(column).label(f"{field}__avg"),
+            func.min(column).label(f"{field}__min"),
+            func.max(column).label(f"{field}__max"),
+            func.array_agg(
+                aggregate_order_by(column, Metric.timestamp.desc()), type_=ARRAY(Float)
+            )[1].label(f"{field}__last"),
+        ])
+    
+    query = (
+        select(*columns)
+        .where(
+            Metric.server_id == server_id,
+            Metric.timestamp >= start_time,
+            Metric.timestamp < end_time,
+        )
+        # Group by the output alias so the bucket expression is not repeated with new binds
+        .group_by(literal_column("bucket"))
+        .order_by(literal_column("bucket"))
+    )
+    
+    result = await db.execute(query)
+    buckets = []
+    for row in result.mappings():
+        point = {"timestamp": row["bucket"].isoformat(), "count": row["count"]}
+        for field in fields:
+            point[field] = {
+                "avg": row[f"{field}__avg"],
+                "min": row[f"{field}__min"],
+                "max": row[f"{field}__max"],
+                "last": row[f"{field}__last"],
+            }
+        buckets.append(point)
+    return buckets
+
+
 async def get_latest_metric(db: AsyncSession, server_id: uuid.UUID) -> Optional[Metric]:
     """Get the latest metric for a server"""
     query = (
@@ -79,17 +207,175 @@ async def get_latest_metric(db: AsyncSession, server_id: uuid.UUID) -> Optional[
     return result.scalar_one_or_none()
 
 
-async def delete_old_metrics(db: AsyncSession, older_than_days: int = 30) -> int:
-    """Delete metrics older than specified days. Returns count of deleted records."""
-    cutoff_date = datetime.utcnow() - timedelta(days=older_than_days)
-    query = select(Metric).where(Metric.timestamp < cutoff_date)
-    result = await db.execute(query)
-    metrics_to_delete = result.scalars().all()
-    count = len(metrics_to_delete)
+async def stream_latest_metrics(
+    db: AsyncSession,
+    since: datetime,
+    server_ids: Optional[Sequence[uuid.UUID]] = None,
+    batch_size: int = 500,
+) -> AsyncIterator[Metric]:
+    """
+    Newest metric of every server (or of `server_ids`) that reported since
+    `since`, in one DISTINCT ON (server_id) query streamed through a
+    server-side cursor.
     
-    for metric in metrics_to_delete:
-        await db.delete(metric)
+    The `since` bound lets Postgres skip older partitions.
+    """
+    query = select(Metric).where(Metric.timestamp >= since)
+    if server_ids is not None:
+        query = query.where(Metric.server_id.in_(server_ids))
+    query = (
+        query
+        .distinct(Metric.server_id)
+        .order_by(Metric.server_id, desc(Metric.timestamp))
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(query)
+    async for metric in result.scalars():
+        yield metric
+
+
+async def stream_recent_series(
+    db: AsyncSession, since: datetime, fields: Sequence[str] = SERIES_FIELDS, batch_size: int = 5000
+) -> AsyncIterator:
+    """Rows of (server_id, timestamp, *fields) since `since`, ordered by server and time, streamed"""
+    query = (
+        select(Metric.server_id, Metric.timestamp, *[getattr(Metric, field) for field in fields])
+        .where(Metric.timestamp >= since)
+        .order_by(Metric.server_id, Metric.timestamp)
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(query)
+    async for row in result:
+        yield row
+
+
+# Daily partitions of the metrics table are named metrics_pYYYYMMDD
+PARTITION_PREFIX = "metrics_p"
+
+
+def partition_name(day: date) -> str:
+    """Name of the metrics partition holding a given UTC day"""
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+async def list_metric_partitions(db: AsyncSession) -> Dict[str, date]:
+    """Daily partitions attached to the metrics table (name -> day)"""
+    result = await db.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'metrics'"
+    ))
+    partitions = {}
+    for (name,) in result.all():
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        try:
+            partitions[name] = datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()
+        except ValueError:
+            continue
+    return partitions
+
+
+async def create_metric_partitions(db: AsyncSession, first_day: date, days: int) -> List[str]:
+    """
+    Create missing daily partitions for [first_day, first_day + days). Returns names created.
+
+    CREATE TABLE ... PARTITION OF fails when metrics_default already holds
+    rows for the day, so each partition is created as a standalone table,
+    those rows are moved into it, and then it is attached. A day that fails
+    is rolled back on its own and retried on the next run.
+    """
+    existing = await list_metric_partitions(db)
+    columns = ", ".join(column.name for column in Metric.__table__.columns)
+    created = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        name = partition_name(day)
+        if name in existing:
+            continue
+        # Bounds are UTC midnights; names come from dates, never from user input
+        lower = f"'{day.isoformat()} 00:00:00+00'"
+        upper = f"'{(day + timedelta(days=1)).isoformat()} 00:00:00+00'"
+        try:
+            async with db.begin_nested():
+                await db.execute(text(f"CREATE TABLE {name} (LIKE metrics INCLUDING DEFAULTS)"))
+                # Lets ATTACH trust the bounds instead of scanning the new table
+                await db.execute(text(
+                    f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds "
+                    f"CHECK (timestamp >= {lower} AND timestamp < {upper})"
+                ))
+                await db.execute(text(
+                    f"WITH moved AS (DELETE FROM metrics_default "
+                    f"WHERE timestamp >= {lower} AND timestamp < {upper} RETURNING {columns}) "
+                    f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+                ))
+                await db.execute(text(
+                    f"ALTER TABLE metrics ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"
+                ))
+                await db.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+        except Exception as e:
+            print(f"Error creating metrics partition {name}: {e}")
+            continue
+        created.append(name)
+    await db.commit()
+    return created
+
+
+async def drop_old_metric_partitions(
+    db: AsyncSession, older_than_days: int = 30, detach_only: bool = False
+) -> List[str]:
+    """
+    Remove whole daily partitions whose day is entirely older than the cutoff,
+    plus expired rows that landed in the default partition. With
+    `detach_only`, partitions are detached (kept as standalone tables for
+    archiving) instead of dropped. Returns names removed.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    removed, _ = await _drop_partitions_before(db, cutoff, detach_only)
+    return removed
+
+
+async def _drop_partitions_before(db: AsyncSession, cutoff: datetime, detach_only: bool) -> Tuple[List[str], int]:
+    """Remove partitions older than the cutoff. Returns names removed and the (estimated) rows in them."""
+    expired = [
+        name
+        for name, day in sorted((await list_metric_partitions(db)).items(), key=lambda item: item[1])
+        if datetime.combine(day + timedelta(days=1), datetime.min.time(), timezone.utc) <= cutoff
+    ]
+    rows = 0
+    if expired:
+        # Planner statistics instead of a count(*) over every row being dropped
+        result = await db.execute(
+            text("SELECT COALESCE(sum(GREATEST(reltuples, 0)), 0) FROM pg_class WHERE relname = ANY(:names)"),
+            {"names": expired},
+        )
+        rows = int(result.scalar_one())
+    for name in expired:
+        await db.execute(text(f"ALTER TABLE metrics DETACH PARTITION {name}"))
+        if not detach_only:
+            await db.execute(text(f"DROP TABLE {name}"))
     
+    result = await db.execute(text("DELETE FROM metrics_default WHERE timestamp < :cutoff"), {"cutoff": cutoff})
+    rows += result.rowcount
     await db.commit()
-    return count
+    return expired, rows
+
 
+async def delete_old_metrics(db: AsyncSession, older_than_days: int = 30) -> int:
+    """
+    Delete metrics older than specified days. Returns count of deleted records.
+
+    Whole days are removed by dropping their partitions, counted from the
+    table statistics (pg_class.reltuples) so the count is an estimate for
+    them; only the day the cutoff falls in is deleted row by row.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    day_start = datetime.combine(cutoff.date(), datetime.min.time(), timezone.utc)
+    result = await db.execute(
+        text("DELETE FROM metrics WHERE timestamp >= :day_start AND timestamp < :cutoff"),
+        {"day_start": day_start, "cutoff": cutoff},
+    )
+    deleted = result.rowcount
+    _, dropped = await _drop_partitions_before(db, cutoff, detach_only=False)
+    return deleted + dropped
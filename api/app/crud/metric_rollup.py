@@ -0,0 +1,211 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func, literal_column, text, Float
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+from datetime import datetime, timedelta, timezone
+import uuid
+from app.models.metric import SERIES_FIELDS
+from app.models.metric_rollup import (
+    MetricRollupMixin,
+    MetricRollup1m,
+    MetricRollup5m,
+    MetricRollup1h,
+    MetricRollupWatermark,
+)
+
+# resolution name -> (model, bucket width in seconds), finest first
+ROLLUP_RESOLUTIONS: Dict[str, tuple] = {
+    "1m": (MetricRollup1m, 60),
+    "5m": (MetricRollup5m, 300),
+    "1h": (MetricRollup1h, 3600),
+}
+
+
+def _rollup_sql(table: str) -> str:
+    """INSERT ... SELECT that folds raw rows created in (low, high] into a rollup table"""
+    columns = ["server_id", "bucket", "sample_count", "last_timestamp"]
+    aggregates = [
+        "server_id",
+        "date_bin(make_interval(secs => :bucket_seconds), timestamp, to_timestamp(0))",
+        "count(*)",
+        "max(timestamp)",
+    ]
+    updates = [
+        "sample_count = r.sample_count + EXCLUDED.sample_count",
+        "last_timestamp = GREATEST(r.last_timestamp, EXCLUDED.last_timestamp)",
+    ]
+    for field in SERIES_FIELDS:
+        columns += [f"{field}_sum", f"{field}_count", f"{field}_min", f"{field}_max", f"{field}_last"]
+        aggregates += [
+            f"sum({field})",
+            f"count({field})",
+            f"min({field})",
+            f"max({field})",
+            f"(array_agg({field} ORDER BY timestamp DESC))[1]",
+        ]
+        updates += [
+            f"{field}_sum = COALESCE(r.{field}_sum + EXCLUDED.{field}_sum, r.{field}_sum, EXCLUDED.{field}_sum)",
+            f"{field}_count = r.{field}_count + EXCLUDED.{field}_count",
+            # LEAST/GREATEST ignore NULLs
+            f"{field}_min = LEAST(r.{field}_min, EXCLUDED.{field}_min)",
+            f"{field}_max = GREATEST(r.{field}_max, EXCLUDED.{field}_max)",
+            f"{field}_last = CASE WHEN r.last_timestamp IS NULL OR EXCLUDED.last_timestamp >= r.last_timestamp "
+            f"THEN COALESCE(EXCLUDED.{field}_last, r.{field}_last) ELSE r.{field}_last END",
+        ]
+    return (
+        f"INSERT INTO {table} AS r ({', '.join(columns)}) "
+        f"SELECT {', '.join(aggregates)} FROM metrics "
+        f"WHERE created_at > :low AND created_at <= :high "
+        f"GROUP BY 1, 2 "
+        f"ON CONFLICT (server_id, bucket) DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+# Built once per resolution
+_ROLLUP_SQL = {name: text(_rollup_sql(model.__tablename__)) for name, (model, _) in ROLLUP_RESOLUTIONS.items()}
+
+
+async def get_watermark(db: AsyncSession, resolution: str) -> Optional[datetime]:
+    """created_at of the newest raw metric folded into a resolution"""
+    result = await db.execute(
+        select(MetricRollupWatermark.watermark).where(MetricRollupWatermark.resolution == resolution)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_watermarks(db: AsyncSession) -> Dict[str, datetime]:
+    """Watermarks of all resolutions"""
+    result = await db.execute(select(MetricRollupWatermark.resolution, MetricRollupWatermark.watermark))
+    return {resolution: watermark for resolution, watermark in result.all()}
+
+
+async def get_complete_before(db: AsyncSession) -> Dict[str, datetime]:
+    """Sample timestamp before which each populated resolution is complete"""
+    result = await db.execute(
+        select(MetricRollupWatermark.resolution, MetricRollupWatermark.complete_before)
+        .where(MetricRollupWatermark.complete_before.is_not(None))
+    )
+    return {resolution: complete_before for resolution, complete_before in result.all()}
+
+
+async def roll_up(
+    db: AsyncSession,
+    resolution: str,
+    lag_seconds: float,
+    max_window: timedelta,
+    lateness_seconds: float = 0.0,
+) -> Tuple[Optional[datetime], bool]:
+    """
+    Fold raw metrics created since the resolution's watermark into its rollup table
+    and advance the watermark, in one transaction.
+    
+    Rows created in the last `lag_seconds` are left for the next run so slow
+    in-flight inserts are not skipped. At most `max_window` of raw rows is
+    processed per call so catching up on a backlog happens in bounded
+    transactions. Returns (new watermark, whether the rollup is caught up).
+    
+    The watermark is an insertion time; history queries need a sample time.
+    `complete_before` is set to the newest folded sample timestamp (capped at
+    the watermark, for agents with a clock running ahead) minus
+    `lateness_seconds`, so samples that arrive late are still covered.
+    """
+    _, bucket_seconds = ROLLUP_RESOLUTIONS[resolution]
+    limit = (await db.execute(text("SELECT now()"))).scalar_one() - timedelta(seconds=lag_seconds)
+    low = await get_watermark(db, resolution)
+    if low is None:
+        # First run: start just before the oldest raw row
+        oldest = (await db.execute(text("SELECT min(created_at) FROM metrics"))).scalar_one()
+        if oldest is None:
+            return None, True
+        low = oldest - timedelta(microseconds=1)
+    
+    high = min(limit, low + max_window)
+    if high <= low:
+        return low, True
+    
+    await db.execute(
+        _ROLLUP_SQL[resolution],
+        {"bucket_seconds": bucket_seconds, "low": low, "high": high},
+    )
+    newest = (await db.execute(
+        text("SELECT max(timestamp) FROM metrics WHERE created_at > :low AND created_at <= :high"),
+        {"low": low, "high": high},
+    )).scalar_one()
+    complete_before = min(newest, high) - timedelta(seconds=lateness_seconds) if newest is not None else None
+    await db.execute(
+        text(
+            "INSERT INTO metric_rollup_watermarks (resolution, watermark, complete_before) "
+            "VALUES (:resolution, :watermark, :complete_before) "
+            "ON CONFLICT (resolution) DO UPDATE SET watermark = EXCLUDED.watermark, "
+            "complete_before = GREATEST(metric_rollup_watermarks.complete_before, EXCLUDED.complete_before)"
+        ),
+        {"resolution": resolution, "watermark": high, "complete_before": complete_before},
+    )
+    await db.commit()
+    return high, high >= limit
+
+
+async def delete_expired_rollups(db: AsyncSession, resolution: str, retention_days: int) -> int:
+    """Delete rollup buckets older than the resolution's retention. Returns count deleted."""
+    model, _ = ROLLUP_RESOLUTIONS[resolution]
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    result = await db.execute(delete(model).where(model.bucket < cutoff))
+    await db.commit()
+    return result.rowcount
+
+
+async def get_rollup_buckets(
+    db: AsyncSession,
+    resolution: str,
+    server_id: uuid.UUID,
+    start_time: datetime,
+    end_time: datetime,
+    step_seconds: int,
+    fields: Sequence[str] = SERIES_FIELDS,
+) -> List[dict]:
+    """Re-aggregate rollup rows into `step_seconds` buckets (same shape as get_metric_buckets)"""
+    model: Type[MetricRollupMixin] = ROLLUP_RESOLUTIONS[resolution][0]
+    bucket = func.date_bin(
+        func.make_interval(0, 0, 0, 0, 0, 0, step_seconds),
+        model.bucket,
+        func.to_timestamp(0),
+    ).label("bucket")
+
+    columns = [bucket, func.sum(model.sample_count).label("count")]
+    for field in fields:
+        total = func.sum(getattr(model, f"{field}_sum"))
+        count = func.sum(getattr(model, f"{field}_count"))
+        columns.extend([
+            (total / func.nullif(count, 0)).label(f"{field}__avg"),
+            func.min(getattr(model, f"{field}_min")).label(f"{field}__min"),
+            func.max(getattr(model, f"{field}_max")).label(f"{field}__max"),
+            func.array_agg(
+                aggregate_order_by(getattr(model, f"{field}_last"), model.last_timestamp.desc()),
+                type_=ARRAY(Float),
+            )[1].label(f"{field}__last"),
+        ])
+
+    query = (
+        select(*columns)
+        .where(
+            model.server_id == server_id,
+            model.bucket >= start_time,
+            model.bucket < end_time,
+        )
+        .group_by(literal_column("bucket"))
+        .order_by(literal_column("bucket"))
+    )
+
+    result = await db.execute(query)
+    buckets = []
+    for row in result.mappings():
+        point = {"timestamp": row["bucket"].isoformat(), "count": row["count"]}
+        for field in fields:
+            point[field] = {
+                "avg": row[f"{field}__avg"],
+                "min": row[f"{field}__min"],
+                "max": row[f"{field}__max"],
+                "last": row[f"{field}__last"],
+            }
+        buckets.append(point)
+    return buckets
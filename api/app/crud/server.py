@@ -1,9 +1,10 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional, List
+from sqlalchemy import select, text, func, and_
+from typing import Optional, List, Dict, Set, Tuple
 import uuid
 from datetime import datetime
 from app.models.server import Server, ServerStatus
+from app.models.alert import Alert, AlertSeverity
 from app.schemas.server import ServerCreate, ServerUpdate
 
 
@@ -41,6 +42,52 @@ async def get_servers(
     return list(result.scalars().all())
 
 
+async def filter_owned_server_ids(
+    db: AsyncSession, user_id: uuid.UUID, server_ids: List[uuid.UUID]
+) -> Set[uuid.UUID]:
+    """Which of `server_ids` belong to the user, in one query"""
+    result = await db.execute(
+        select(Server.id).where(Server.user_id == user_id, Server.id.in_(server_ids))
+    )
+    return set(result.scalars().all())
+
+
+async def get_server_ids_by_metadata(
+    db: AsyncSession, user_id: uuid.UUID, selector: Dict[str, str], limit: int
+) -> List[uuid.UUID]:
+    """Servers of a user whose metadata has every key/value of `selector`"""
+    query = select(Server.id).where(Server.user_id == user_id)
+    for key, value in selector.items():
+        query = query.where(Server.server_metadata[key].as_string() == value)
+    result = await db.execute(query.order_by(Server.name).limit(limit))
+    return list(result.scalars().all())
+
+
+async def get_servers_with_open_alert_counts(
+    db: AsyncSession, user_id: uuid.UUID
+) -> List[Tuple[Server, Dict[str, int]]]:
+    """
+    All servers of a user with their unresolved alert counts per severity,
+    in one grouped query (LEFT JOIN so servers without alerts are included).
+    """
+    counts = [
+        func.count(Alert.id).filter(Alert.severity == severity).label(severity.value)
+        for severity in AlertSeverity
+    ]
+    query = (
+        select(Server, *counts)
+        .outerjoin(Alert, and_(Alert.server_id == Server.id, Alert.resolved.is_(False)))
+        .where(Server.user_id == user_id)
+        .group_by(Server.id)
+        .order_by(Server.name)
+    )
+    result = await db.execute(query)
+    return [
+        (row[0], {severity.value: row[i + 1] for i, severity in enumerate(AlertSeverity)})
+        for row in result.all()
+    ]
+
+
 async def create_server(db: AsyncSession, server_in: ServerCreate, user_id: uuid.UUID) -> Server:
     """Create a new server"""
     # Use by_alias=False to get actual field names (server_metadata, not metadata)
@@ -106,3 +153,28 @@ async def update_server_status(
     await db.refresh(db_server)
     return db_server
 
+
+
+async def bulk_update_last_seen(db: AsyncSession, last_seen: Dict[uuid.UUID, datetime]) -> int:
+    """Write many last_seen timestamps in a single UPDATE. Returns count of updated rows."""
+    if not last_seen:
+        return 0
+    
+    server_ids = list(last_seen.keys())
+    timestamps = [last_seen[server_id] for server_id in server_ids]
+    
+    # GREATEST keeps a newer value written by another process (e.g. on agent connect)
+    result = await db.execute(
+        text(
+            """
+            UPDATE servers
+            SET last_seen = GREATEST(servers.last_seen, beats.last_seen)
+            FROM unnest(CAST(:server_ids AS uuid[]), CAST(:timestamps AS timestamptz[]))
+                AS beats(id, last_seen)
+            WHERE servers.id = beats.id
+            """
+        ),
+        {"server_ids": server_ids, "timestamps": timestamps},
+    )
+    await db.commit()
+    return result.rowcount
@@ -4,7 +4,7 @@ from typing import Optional
 import uuid
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
-from app.core.security import get_password_hash, verify_password
+from app.core.security import get_password_hash_async, verify_password_async
 
 
 async def get_user(db: AsyncSession, user_id: uuid.UUID) -> Optional[User]:
@@ -27,7 +27,7 @@ async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User
 
 async def create_user(db: AsyncSession, user_in: UserCreate) -> User:
     """Create a new user"""
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash_async(user_in.password)
     db_user = User(
         email=user_in.email,
         username=user_in.username,
@@ -60,7 +60,7 @@ async def authenticate_user(db: AsyncSession, email: str, password: str) -> Opti
     user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
@@ -72,11 +72,11 @@ async def change_password(db: AsyncSession, user_id: uuid.UUID, current_password
         return False
     
     # Verify current password
-    if not verify_password(current_password, user.hashed_password):
+    if not await verify_password_async(current_password, user.hashed_password):
         return False
     
     # Update password
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = await get_password_hash_async(new_password)
     await db.commit()
     return True
 
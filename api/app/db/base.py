@@ -1,3 +1,4 @@
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from app.core.config import settings
@@ -22,6 +23,12 @@ AsyncSessionLocal = async_sessionmaker(
 Base = declarative_base()
 
 
+async def try_advisory_xact_lock(db: AsyncSession, key: int) -> bool:
+    """Take a transaction-scoped advisory lock if no other session holds it"""
+    result = await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": key})
+    return bool(result.scalar_one())
+
+
 async def get_db() -> AsyncSession:
     """Dependency to get database session"""
     async with AsyncSessionLocal() as session:
@@ -1,10 +1,24 @@
 # FastAPI application entry point
 # CI/CD: Changes here trigger API build and test workflow
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
+from app.core.hash_pool import HashPoolBusy, user_hash_pool, agent_hash_pool
 from app.api.v1 import api_router
+from app.services.metric_writer import metric_writer
+from app.services.log_writer import log_writer
+from app.services.command_streams import command_streams
+from app.services.command_jobs import command_jobs
+from app.services.heartbeat import heartbeat_tracker
+from app.services.bus import bus
+from app.services.metric_rollup import metric_rollup_job
+from app.services.metric_retention import metric_retention_job
+from app.services.agent_manager import agent_manager
+from app.services.ws_manager import ws_manager
+from app.services.warm_start import warm_start
+from app.api.v1.metrics import metrics_cache
 
 
 @asynccontextmanager
@@ -13,8 +27,32 @@ async def lifespan(app: FastAPI):
     # Startup
     # Database schema is managed by Alembic migrations
     # Run 'alembic upgrade head' to apply migrations
+    await bus.start()
+    if settings.METRICS_WARM_START:
+        try:
+            await warm_start.run(metrics_cache)
+        except Exception as e:
+            print(f"Error warming metrics cache: {e}")
+    agent_manager.start()
+    metric_writer.start()
+    log_writer.start()
+    command_streams.start()
+    heartbeat_tracker.start()
+    metric_rollup_job.start()
+    metric_retention_job.start()
     yield
-    # Shutdown (if needed)
+    # Shutdown - flush buffered metrics, logs and heartbeats before the process exits
+    await metric_retention_job.stop()
+    await metric_rollup_job.stop()
+    await metric_writer.stop()
+    await log_writer.stop()
+    await command_jobs.stop()
+    await command_streams.stop()
+    await heartbeat_tracker.stop()
+    await ws_manager.stop()
+    user_hash_pool.shutdown()
+    agent_hash_pool.shutdown()
+    await bus.stop()
 
 
 app = FastAPI(
@@ -33,6 +71,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy_handler(request: Request, exc: HashPoolBusy):
+    """Shed load when too many password hashes are already queued"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -3,8 +3,10 @@ from app.models.server import Server
 from app.models.alert import Alert, AlertThreshold
 from app.models.api_key import APIKey
 from app.models.metric import Metric
+from app.models.metric_rollup import MetricRollup1m, MetricRollup5m, MetricRollup1h, MetricRollupWatermark
 from app.models.log_entry import LogEntry
-from app.models.command_history import CommandHistory
+from app.models.inventory_snapshot import InventorySnapshot
+from app.models.command_history import CommandHistory, CommandOutputChunk
 from app.models.connection_event import ConnectionEvent
 from app.models.audit_log import AuditLog
 
@@ -15,8 +17,14 @@ __all__ = [
     "AlertThreshold",
     "APIKey",
     "Metric",
+    "MetricRollup1m",
+    "MetricRollup5m",
+    "MetricRollup1h",
+    "MetricRollupWatermark",
     "LogEntry",
+    "InventorySnapshot",
     "CommandHistory",
+    "CommandOutputChunk",
     "ConnectionEvent",
     "AuditLog",
 ]
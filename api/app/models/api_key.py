@@ -11,6 +11,7 @@ class APIKey(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     server_id = Column(UUID(as_uuid=True), ForeignKey("servers.id", ondelete="CASCADE"), nullable=False, index=True)
+    key_prefix = Column(String, nullable=True, unique=True, index=True)  # Public key id embedded in the key
     key_hash = Column(String, nullable=False, unique=True, index=True)
     name = Column(String, nullable=True)  # Optional name for the key
     is_active = Column(Boolean, default=True, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Enum as SQLEnum
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, LargeBinary, Enum as SQLEnum
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -28,6 +28,11 @@ class CommandHistory(Base):
     exit_code = Column(Integer, nullable=True)
     stdout = Column(Text, nullable=True)
     stderr = Column(Text, nullable=True)
+    output_seq = Column(Integer, nullable=True)  # Last streamed chunk included in stdout/stderr
+    # Full size in bytes when the output is kept in command_output_chunks
+    # (stdout/stderr then only hold a preview); NULL when stored inline
+    stdout_size = Column(Integer, nullable=True)
+    stderr_size = Column(Integer, nullable=True)
     started_at = Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
     completed_at = Column(DateTime(timezone=True), nullable=True)
     duration_ms = Column(Integer, nullable=True)  # Duration in milliseconds
@@ -37,3 +42,14 @@ class CommandHistory(Base):
     server = relationship("Server", backref="command_history", passive_deletes=True)
     user = relationship("User", backref="command_history")
 
+
+
+class CommandOutputChunk(Base):
+    """zlib-compressed piece of a large command output, covering bytes [start, start + size)"""
+    __tablename__ = "command_output_chunks"
+
+    command_id = Column(UUID(as_uuid=True), ForeignKey("command_history.id", ondelete="CASCADE"), primary_key=True)
+    stream = Column(String, primary_key=True)  # stdout / stderr
+    start = Column(Integer, primary_key=True)  # Offset of the chunk in the raw output
+    size = Column(Integer, nullable=False)  # Raw (uncompressed) bytes in the chunk
+    data = Column(LargeBinary, nullable=False)
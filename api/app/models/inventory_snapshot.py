@@ -0,0 +1,38 @@
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, JSON, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+import uuid
+import enum
+from app.db.base import Base
+
+
+class SnapshotKind(str, enum.Enum):
+    CONTAINERS = "containers"
+    PROCESSES = "processes"
+
+
+class InventorySnapshot(Base):
+    """
+    Container/process lists reported by agents, stored as changes.
+    
+    A keyframe row holds the full list; a delta row holds only the items that
+    were added or changed ("upsert") and the keys that disappeared ("remove")
+    since the previous row for the same server and kind.
+    """
+    __tablename__ = "inventory_snapshots"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    server_id = Column(UUID(as_uuid=True), ForeignKey("servers.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+    is_keyframe = Column(Boolean, nullable=False, default=False)
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Relationship - passive_deletes=True lets database handle CASCADE
+    server = relationship("Server", backref="inventory_snapshots", passive_deletes=True)
+
+    __table_args__ = (
+        Index('idx_inventory_snapshots_lookup', 'server_id', 'kind', 'timestamp'),
+    )
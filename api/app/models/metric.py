@@ -5,6 +5,17 @@ from sqlalchemy.sql import func
 import uuid
 from app.db.base import Base
 
+# Numeric columns exposed as time series (history API, rollups)
+SERIES_FIELDS = (
+    "cpu_usage_percent",
+    "memory_usage_percent",
+    "memory_used_gb",
+    "disk_usage_percent",
+    "disk_used_gb",
+    "network_bytes_sent",
+    "network_bytes_recv",
+)
+
 
 class Metric(Base):
     """Time-series metrics data for servers"""
@@ -12,7 +23,8 @@ class Metric(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     server_id = Column(UUID(as_uuid=True), ForeignKey("servers.id", ondelete="CASCADE"), nullable=False, index=True)
-    timestamp = Column(DateTime(timezone=True), nullable=False, index=True, server_default=func.now())
+    # Part of the primary key because the table is range-partitioned by day on it
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False, index=True, server_default=func.now())
     
     # CPU metrics
     cpu_usage_percent = Column(Float, nullable=False)
@@ -40,7 +52,7 @@ class Metric(Base):
     # Additional data (containers, processes, etc.)
     extra_data = Column(JSON, nullable=True)
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
     # Relationship - passive_deletes=True lets database handle CASCADE
     server = relationship("Server", backref="metrics", passive_deletes=True)
@@ -48,5 +60,6 @@ class Metric(Base):
     # Composite index for efficient time-series queries
     __table_args__ = (
         Index('idx_metrics_server_timestamp', 'server_id', 'timestamp'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
 
@@ -0,0 +1,67 @@
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, PrimaryKeyConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import declared_attr
+from app.db.base import Base
+from app.models.metric import SERIES_FIELDS
+
+
+def _series_columns() -> dict:
+    """sum/count/min/max/last columns for every series field"""
+    columns = {}
+    for field in SERIES_FIELDS:
+        columns[f"{field}_sum"] = Column(Float, nullable=True)
+        columns[f"{field}_count"] = Column(Integer, nullable=False, default=0)
+        columns[f"{field}_min"] = Column(Float, nullable=True)
+        columns[f"{field}_max"] = Column(Float, nullable=True)
+        columns[f"{field}_last"] = Column(Float, nullable=True)
+    return columns
+
+
+# Per-field aggregate columns shared by every rollup resolution
+MetricRollupColumns = type("MetricRollupColumns", (), _series_columns())
+
+
+class MetricRollupMixin(MetricRollupColumns):
+    """
+    One row per server per time bucket. Averages are sum / count so buckets
+    can be merged incrementally as new raw samples are rolled up.
+    """
+
+    @declared_attr
+    def server_id(cls):
+        return Column(UUID(as_uuid=True), ForeignKey("servers.id", ondelete="CASCADE"), nullable=False)
+
+    bucket = Column(DateTime(timezone=True), nullable=False)
+    sample_count = Column(Integer, nullable=False, default=0)
+    # Timestamp of the newest sample in the bucket (decides which *_last wins on merge)
+    last_timestamp = Column(DateTime(timezone=True), nullable=True)
+
+    @declared_attr
+    def __table_args__(cls):
+        # (server_id, bucket) order serves per-server range scans
+        return (PrimaryKeyConstraint("server_id", "bucket"),)
+
+
+class MetricRollup1m(MetricRollupMixin, Base):
+    """1-minute metric rollups"""
+    __tablename__ = "metric_rollups_1m"
+
+
+class MetricRollup5m(MetricRollupMixin, Base):
+    """5-minute metric rollups"""
+    __tablename__ = "metric_rollups_5m"
+
+
+class MetricRollup1h(MetricRollupMixin, Base):
+    """1-hour metric rollups"""
+    __tablename__ = "metric_rollups_1h"
+
+
+class MetricRollupWatermark(Base):
+    """Raw metrics with created_at up to `watermark` are included in the rollup"""
+    __tablename__ = "metric_rollup_watermarks"
+
+    resolution = Column(String, primary_key=True)
+    watermark = Column(DateTime(timezone=True), nullable=False)
+    # Buckets before this sample timestamp are treated as complete by history queries
+    complete_before = Column(DateTime(timezone=True), nullable=True)
@@ -18,6 +18,7 @@ class APIKeyResponse(APIKeyBase):
     
     id: uuid.UUID
     server_id: uuid.UUID
+    key_prefix: Optional[str] = None
     key: str  # Only returned on creation
     is_active: bool
     last_used: Optional[datetime] = None
@@ -30,6 +31,7 @@ class APIKeyInfo(APIKeyBase):
     
     id: uuid.UUID
     server_id: uuid.UUID
+    key_prefix: Optional[str] = None
     is_active: bool
     last_used: Optional[datetime] = None
     created_at: datetime
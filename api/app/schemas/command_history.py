@@ -33,6 +33,9 @@ class CommandHistoryResponse(CommandHistoryBase):
     exit_code: Optional[int]
     stdout: Optional[str]
     stderr: Optional[str]
+    # Full output sizes when stdout/stderr only hold a preview
+    stdout_size: Optional[int] = None
+    stderr_size: Optional[int] = None
     started_at: datetime
     completed_at: Optional[datetime]
     duration_ms: Optional[int]
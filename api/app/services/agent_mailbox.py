@@ -0,0 +1,155 @@
+"""Per-agent bounded mailboxes so slow sample processing never blocks an agent's socket"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from app.core.config import settings
+
+DROP_OLDEST = "drop_oldest"
+CONFLATE_LATEST = "conflate_latest"
+
+Handler = Callable[[str, Any], Awaitable[None]]
+
+
+class AgentMailbox:
+    """
+    Bounded FIFO of metric samples for one agent, drained by its own worker task.
+
+    When the mailbox is full the overflow policy decides what is lost:
+    `drop_oldest` discards the oldest queued sample, `conflate_latest`
+    collapses the whole backlog into the newest sample (the agent is behind,
+    so only its latest state is worth evaluating).
+    """
+
+    def __init__(self, server_id: str, handler: Handler, max_size: int, overflow: str):
+        self.server_id = server_id
+        self.max_size = max_size
+        self.overflow = overflow
+        self._handler = handler
+
+        # (enqueued_at, sample)
+        self._queue: Deque[Tuple[float, Any]] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.last_process_ms = 0.0
+
+    def put(self, sample: Any) -> None:
+        """Queue a sample for the worker (never blocks)"""
+        if len(self._queue) >= self.max_size:
+            if self.overflow == CONFLATE_LATEST:
+                self.conflated += len(self._queue)
+                self._queue.clear()
+            else:
+                self._queue.popleft()
+                self.dropped += 1
+        self._queue.append((time.monotonic(), sample))
+        self.enqueued += 1
+        self._ready.set()
+
+    def start(self) -> None:
+        """Start the worker task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the worker and discard anything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue.clear()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            enqueued_at, sample = self._queue.popleft()
+            started = time.monotonic()
+            self.last_lag_ms = (started - enqueued_at) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+            try:
+                await self._handler(self.server_id, sample)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error processing sample for server {self.server_id}: {e}")
+            self.last_process_ms = (time.monotonic() - started) * 1000
+
+    def stats(self) -> dict:
+        """Depth, lag and loss counters"""
+        oldest_age_ms = (time.monotonic() - self._queue[0][0]) * 1000 if self._queue else 0.0
+        return {
+            "depth": len(self._queue),
+            "max_size": self.max_size,
+            "overflow": self.overflow,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "oldest_age_ms": round(oldest_age_ms, 3),
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "last_process_ms": round(self.last_process_ms, 3),
+        }
+
+
+class AgentMailboxes:
+    """Registry of mailboxes for connected agents"""
+
+    def __init__(self, max_size: int, overflow: str):
+        self.max_size = max_size
+        self.overflow = overflow
+        # server_id -> AgentMailbox
+        self._mailboxes: Dict[str, AgentMailbox] = {}
+
+    async def open(self, server_id: str, handler: Handler) -> AgentMailbox:
+        """Create and start a mailbox for an agent, replacing any previous one"""
+        await self.close(server_id)
+        mailbox = AgentMailbox(server_id, handler, self.max_size, self.overflow)
+        self._mailboxes[server_id] = mailbox
+        mailbox.start()
+        return mailbox
+
+    async def close(self, server_id: str, mailbox: Optional[AgentMailbox] = None) -> None:
+        """
+        Stop and remove an agent's mailbox. If `mailbox` is given, only that
+        mailbox is closed, so a stale connection cannot close its replacement.
+        """
+        current = self._mailboxes.get(server_id)
+        if mailbox is None:
+            mailbox = current
+        if mailbox is None:
+            return
+        if mailbox is current:
+            del self._mailboxes[server_id]
+        await mailbox.close()
+
+    def get(self, server_id: str) -> Optional[AgentMailbox]:
+        return self._mailboxes.get(server_id)
+
+    def stats(self) -> dict:
+        """Per-agent mailbox stats keyed by server_id"""
+        return {server_id: mailbox.stats() for server_id, mailbox in self._mailboxes.items()}
+
+
+# Global agent mailbox registry
+agent_mailboxes = AgentMailboxes(
+    max_size=settings.AGENT_MAILBOX_SIZE,
+    overflow=settings.AGENT_MAILBOX_OVERFLOW,
+)
@@ -1,77 +1,357 @@
-from typing import Dict, Optional
+from typing import Deque, Dict, Optional
 from fastapi import WebSocket
-import json
 import uuid
+import time
 import asyncio
-from collections import defaultdict
+from collections import deque
+from app.core.config import settings
+from app.core.histogram import LatencyHistogram
+from app.services.bus import bus, agent_channel, worker_channel
 
 
-class AgentManager:
-    """Manage agent WebSocket connections"""
-    
+class AgentDisconnected(Exception):
+    """The agent went away while a command was queued or in flight"""
+
+
+class AgentSession:
+    """
+    One connected agent and its command slots.
+
+    At most `max_in_flight` commands are outstanding per agent; further
+    callers wait in FIFO order. Closing the session fails every waiter.
+    """
+
+    def __init__(self, websocket: WebSocket, max_in_flight: int):
+        self.websocket = websocket
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.closed = False
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        """Take a command slot. Raises AgentDisconnected if the session closes first."""
+        if self.closed:
+            raise AgentDisconnected()
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self) -> None:
+        """Hand the slot to the next waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def close(self) -> None:
+        """Fail everyone waiting for a slot"""
+        self.closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(AgentDisconnected())
+
+
+class PendingCall:
+    """A command sent to an agent, resolved by put_response"""
+
+    __slots__ = ("server_id", "command_type", "future")
+
+    def __init__(self, server_id: str, command_type: str, future: asyncio.Future):
+        self.server_id = server_id
+        self.command_type = command_type
+        self.future = future
+
+
+class CommandStats:
+    """Outcome counters and latency histogram for one command type"""
+
+    __slots__ = ("ok", "errors", "timeouts", "disconnected", "cancelled", "latency")
+
     def __init__(self):
-        # server_id -> WebSocket
-        self.agent_connections: Dict[str, WebSocket] = {}
-        # request_id -> asyncio.Queue for responses
-        self.response_queues: Dict[str, asyncio.Queue] = {}
-    
+        self.ok = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.disconnected = 0
+        self.cancelled = 0
+        self.latency = LatencyHistogram()
+
+    def stats(self) -> dict:
+        return {
+            "ok": self.ok,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "disconnected": self.disconnected,
+            "cancelled": self.cancelled,
+            "latency": self.latency.stats(),
+        }
+
+
+class AgentManager:
+    """
+    Manage agent WebSocket connections and the commands sent over them.
+
+    Each command gets a request_id and a future that the agent's reply
+    resolves. Commands time out per type (AGENT_RPC_TIMEOUTS, falling back
+    to AGENT_RPC_TIMEOUT_SECONDS); on timeout or caller cancellation the
+    agent is sent {"type": "cancel", "request_id": ...}. When an agent
+    disconnects, its queued and in-flight commands fail immediately.
+
+    Commands for an agent connected to another worker are routed over the
+    message bus: the request is published on the agent's channel, the worker
+    holding the connection acknowledges it, runs the command locally and
+    publishes the response back on the requesting worker's channel.
+    """
+
+    def __init__(self, max_in_flight: int, default_timeout: float, timeouts: Dict[str, float]):
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts
+        # server_id -> AgentSession
+        self.sessions: Dict[str, AgentSession] = {}
+        # request_id -> command awaiting its reply from a local agent
+        self.pending: Dict[str, PendingCall] = {}
+        # request_id -> reply future for a command routed to another worker
+        self.remote_pending: Dict[str, asyncio.Future] = {}
+        # request_id -> set once the owning worker accepted a routed command
+        self.remote_accepted: Dict[str, asyncio.Event] = {}
+        # command type -> counters
+        self.command_stats: Dict[str, CommandStats] = {}
+
+        # Counters
+        self.late_replies = 0
+        self.cancels_sent = 0
+
+    def start(self):
+        """Receive routed command replies addressed to this worker"""
+        bus.subscribe(worker_channel(bus.worker_id), self._on_worker_message)
+
     def register_agent(self, server_id: str, websocket: WebSocket):
         """Register an agent connection for a server"""
-        self.agent_connections[server_id] = websocket
-    
-    def unregister_agent(self, server_id: str):
-        """Unregister an agent connection"""
-        if server_id in self.agent_connections:
-            del self.agent_connections[server_id]
-    
+        previous = self.sessions.get(server_id)
+        if previous is not None:
+            self._fail_session(server_id, previous)
+        self.sessions[server_id] = AgentSession(websocket, self.max_in_flight)
+        bus.subscribe(agent_channel(server_id), self._on_agent_request)
+
+    def unregister_agent(self, server_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """
+        Unregister an agent connection and fail its outstanding commands.
+        Returns False if `websocket` is no longer the agent's current connection.
+        """
+        session = self.sessions.get(server_id)
+        if session is None:
+            return False
+        # A reconnected agent may already have replaced this connection
+        if websocket is not None and session.websocket is not websocket:
+            return False
+        del self.sessions[server_id]
+        bus.unsubscribe(agent_channel(server_id), self._on_agent_request)
+        self._fail_session(server_id, session)
+        return True
+
+    def _fail_session(self, server_id: str, session: AgentSession) -> None:
+        session.close()
+        for call in self.pending.values():
+            if call.server_id == server_id and not call.future.done():
+                call.future.set_exception(AgentDisconnected())
+
     def get_agent_connection(self, server_id: str) -> Optional[WebSocket]:
         """Get the agent connection for a server"""
-        return self.agent_connections.get(server_id)
-    
-    def create_response_queue(self, request_id: str) -> asyncio.Queue:
-        """Create a queue for a request ID"""
-        queue = asyncio.Queue()
-        self.response_queues[request_id] = queue
-        return queue
-    
+        session = self.sessions.get(server_id)
+        return session.websocket if session is not None else None
+
+    def timeout_for(self, command_type: str) -> float:
+        """Reply timeout in seconds for a command type"""
+        return self.timeouts.get(command_type, self.default_timeout)
+
     def put_response(self, request_id: str, response: dict):
-        """Put a response in the queue for a request ID"""
-        if request_id in self.response_queues:
-            self.response_queues[request_id].put_nowait(response)
-            del self.response_queues[request_id]
-    
-    async def send_command(self, server_id: str, command: dict) -> Optional[dict]:
-        """Send a command to an agent and wait for response"""
-        websocket = self.get_agent_connection(server_id)
-        if not websocket:
+        """Resolve the command waiting for this reply"""
+        call = self.pending.pop(request_id, None)
+        if call is None or call.future.done():
+            # The caller already gave up (timeout, cancellation or disconnect)
+            self.late_replies += 1
+            return
+        call.future.set_result(response)
+
+    async def send_command(self, server_id: str, command: dict, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Send a command to an agent and wait for its reply.
+        Returns None if the agent is not connected, {"error": ...} on failure.
+        """
+        if timeout is None:
+            timeout = self.timeout_for(command.get("type", ""))
+        if server_id not in self.sessions and bus.distributed:
+            return await self._send_remote_command(server_id, command, timeout)
+        return await self._send_local_command(server_id, command, timeout)
+
+    async def _send_local_command(self, server_id: str, command: dict, timeout: float) -> Optional[dict]:
+        """Send a command to an agent connected to this worker"""
+        session = self.sessions.get(server_id)
+        if session is None:
             return None
-        
-        # Generate request ID
+
+        command_type = command.get("type", "unknown")
+        stats = self.command_stats.get(command_type)
+        if stats is None:
+            stats = self.command_stats[command_type] = CommandStats()
         request_id = str(uuid.uuid4())
         command["request_id"] = request_id
-        
-        # Create response queue
-        response_queue = self.create_response_queue(request_id)
-        
-        try:
-            # Send command
-            await websocket.send_json(command)
-            
-            # Wait for response (with timeout)
+        future = asyncio.get_running_loop().create_future()
+        sent = False
+        started = time.perf_counter()
+
+        async def call() -> dict:
+            nonlocal sent
+            await session.acquire()
             try:
-                response = await asyncio.wait_for(response_queue.get(), timeout=10.0)
-                return response
-            except asyncio.TimeoutError:
-                # Clean up queue
-                if request_id in self.response_queues:
-                    del self.response_queues[request_id]
-                return {"error": "Timeout waiting for agent response"}
+                self.pending[request_id] = PendingCall(server_id, command_type, future)
+                await session.websocket.send_json(command)
+                sent = True
+                return await future
+            finally:
+                session.release()
+
+        try:
+            response = await asyncio.wait_for(call(), timeout=timeout)
+            stats.ok += 1
+            return response
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            if sent:
+                asyncio.create_task(self._send_cancel(session, request_id))
+            return {"error": f"Timeout waiting for agent response after {timeout:g}s", "timeout": True}
+        except AgentDisconnected:
+            stats.disconnected += 1
+            return {"error": "Agent disconnected"}
+        except asyncio.CancelledError:
+            # The caller went away (e.g. the HTTP client disconnected)
+            stats.cancelled += 1
+            if sent:
+                asyncio.create_task(self._send_cancel(session, request_id))
+            raise
         except Exception as e:
-            # Clean up queue
-            if request_id in self.response_queues:
-                del self.response_queues[request_id]
+            stats.errors += 1
             return {"error": str(e)}
+        finally:
+            self.pending.pop(request_id, None)
+            stats.latency.observe((time.perf_counter() - started) * 1000)
+
+    async def cancel(self, server_id: str, request_id: str) -> None:
+        """Ask an agent connected to this worker to stop a request"""
+        session = self.sessions.get(server_id)
+        if session is not None:
+            await self._send_cancel(session, request_id)
+
+    async def _send_cancel(self, session: AgentSession, request_id: str) -> None:
+        """Tell the agent to stop working on a request nobody waits for anymore"""
+        if session.closed:
+            return
+        try:
+            await session.websocket.send_json({"type": "cancel", "request_id": request_id})
+            self.cancels_sent += 1
+        except Exception as e:
+            print(f"Error sending cancel for request {request_id}: {e}")
+
+    async def _send_remote_command(self, server_id: str, command: dict, timeout: float) -> Optional[dict]:
+        """Route a command to the worker holding the agent connection"""
+        request_id = str(uuid.uuid4())
+        future = self.remote_pending[request_id] = asyncio.get_running_loop().create_future()
+        accepted = self.remote_accepted[request_id] = asyncio.Event()
+
+        try:
+            await bus.publish(agent_channel(server_id), {
+                "kind": "command",
+                "server_id": server_id,
+                "request_id": request_id,
+                "reply_to": bus.worker_id,
+                "command": command,
+                "timeout": timeout,
+            })
+
+            # No worker holds this agent if nobody accepts the request quickly
+            try:
+                await asyncio.wait_for(accepted.wait(), timeout=settings.BUS_RPC_ACCEPT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return None
+
+            # The owning worker enforces the timeout (and cancels on the agent);
+            # the margin covers the trip back over the bus
+            try:
+                return await asyncio.wait_for(future, timeout=timeout + settings.BUS_RPC_ACCEPT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return {"error": f"Timeout waiting for agent response after {timeout:g}s", "timeout": True}
+        finally:
+            self.remote_pending.pop(request_id, None)
+            self.remote_accepted.pop(request_id, None)
+
+    async def _on_agent_request(self, message: dict):
+        """Handle a command routed to an agent connected to this worker"""
+        if message.get("kind") != "command" or message["server_id"] not in self.sessions:
+            return
+        reply_channel = worker_channel(message["reply_to"])
+        await bus.publish(reply_channel, {"kind": "accepted", "request_id": message["request_id"]})
+        asyncio.create_task(self._run_routed_command(message, reply_channel))
+
+    async def _run_routed_command(self, message: dict, reply_channel: str):
+        timeout = message.get("timeout") or self.timeout_for(message["command"].get("type", ""))
+        response = await self._send_local_command(message["server_id"], dict(message["command"]), timeout)
+        await bus.publish(reply_channel, {
+            "kind": "response",
+            "request_id": message["request_id"],
+            "response": response,
+        })
+
+    async def _on_worker_message(self, message: dict):
+        """Handle acknowledgements and responses for commands this worker routed"""
+        request_id = message.get("request_id")
+        if message.get("kind") == "accepted":
+            accepted = self.remote_accepted.get(request_id)
+            if accepted is not None:
+                accepted.set()
+        elif message.get("kind") == "response":
+            future = self.remote_pending.get(request_id)
+            if future is not None and not future.done():
+                future.set_result(message.get("response"))
+            else:
+                self.late_replies += 1
 
+    def stats(self) -> dict:
+        """Connected agents, outstanding commands and per-type RPC latency"""
+        return {
+            "agents": len(self.sessions),
+            "in_flight": sum(session.in_flight for session in self.sessions.values()),
+            "queued": sum(session.queued for session in self.sessions.values()),
+            "max_in_flight_per_agent": self.max_in_flight,
+            "remote_pending": len(self.remote_pending),
+            "late_replies": self.late_replies,
+            "cancels_sent": self.cancels_sent,
+            "commands": {name: stats.stats() for name, stats in sorted(self.command_stats.items())},
+        }
 
-agent_manager = AgentManager()
 
+agent_manager = AgentManager(
+    max_in_flight=settings.AGENT_RPC_MAX_IN_FLIGHT,
+    default_timeout=settings.AGENT_RPC_TIMEOUT_SECONDS,
+    timeouts=settings.AGENT_RPC_TIMEOUTS,
+)
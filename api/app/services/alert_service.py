@@ -1,10 +1,234 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import Dict, List, Optional, Union
+import asyncio
+import operator
 import uuid
-from datetime import datetime
 from app.crud import alert as crud_alert
 from app.schemas.alert import AlertCreate
 from app.models.alert import AlertType, AlertSeverity, ComparisonType
+from app.services.bus import bus
+
+
+# Metric section of an agent metrics payload for each alert type.
+# Network alerts are not evaluated yet (no single usage_percent value).
+METRIC_SECTIONS = {
+    AlertType.CPU: "cpu",
+    AlertType.MEMORY: "memory",
+    AlertType.DISK: "disk",
+}
+
+COMPARATORS = {
+    ComparisonType.GT: operator.gt,
+    ComparisonType.LT: operator.lt,
+}
+
+
+class CompiledThreshold:
+    """An enabled alert threshold reduced to what is needed to evaluate a sample"""
+
+    __slots__ = ("metric_type", "section", "comparison", "threshold_value", "_compare")
+
+    def __init__(self, metric_type: AlertType, comparison: ComparisonType, threshold_value: float):
+        self.metric_type = metric_type
+        self.section = METRIC_SECTIONS[metric_type]
+        self.comparison = comparison
+        self.threshold_value = threshold_value
+        self._compare = COMPARATORS[comparison]
+
+    def value(self, metrics: dict) -> Optional[float]:
+        """Extract the current value for this threshold from a metrics payload"""
+        return metrics.get(self.section, {}).get("usage_percent")
+
+    def exceeded(self, value: float) -> bool:
+        return self._compare(value, self.threshold_value)
+
+
+class ServerAlertState:
+    """Compiled thresholds and currently-open alerts for one server"""
+
+    __slots__ = ("thresholds", "open_alerts")
+
+    def __init__(self, thresholds: List[CompiledThreshold], open_alerts: Dict[AlertType, uuid.UUID]):
+        self.thresholds = thresholds
+        # alert type -> id of the unresolved alert for that type
+        self.open_alerts = open_alerts
+
+
+class _ServerSlot:
+    """Lock serialising load/evaluate for one server while samples are being evaluated"""
+
+    __slots__ = ("lock", "users", "generation")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Evaluations holding or waiting for the lock
+        self.users = 0
+        # Bumped by invalidate(); a load started before the bump is not cached
+        self.generation = 0
+
+
+def _severity(threshold: CompiledThreshold, current_value: float) -> AlertSeverity:
+    """Determine severity based on how far over the threshold the value is"""
+    severity = AlertSeverity.WARNING
+    if threshold.comparison == ComparisonType.GT:
+        if current_value > threshold.threshold_value * 1.5:
+            severity = AlertSeverity.CRITICAL
+        elif current_value > threshold.threshold_value * 1.2:
+            severity = AlertSeverity.WARNING
+    elif threshold.comparison == ComparisonType.LT:
+        if current_value < threshold.threshold_value * 0.5:
+            severity = AlertSeverity.CRITICAL
+        elif current_value < threshold.threshold_value * 0.8:
+            severity = AlertSeverity.WARNING
+    return severity
+
+
+class AlertRegistry:
+    """
+    Per-server cache of compiled alert thresholds and open alert state.
+
+    A server's state is loaded from the database the first time one of its
+    samples is evaluated and kept until it is invalidated (threshold CRUD,
+    manual alert resolution, server deletion). Evaluating a sample does no
+    database reads; it only writes when an alert opens or resolves.
+    """
+
+    def __init__(self):
+        # server_id -> ServerAlertState
+        self._servers: Dict[str, ServerAlertState] = {}
+        # server_id -> lock of the servers currently being evaluated
+        self._slots: Dict[str, _ServerSlot] = {}
+
+        # Counters
+        self.loads = 0
+        self.invalidations = 0
+        self.evaluations = 0
+        self.alerts_opened = 0
+        self.alerts_resolved = 0
+
+    def invalidate(self, server_id: Union[str, uuid.UUID]) -> None:
+        """Drop cached state for a server so it is reloaded on the next sample"""
+        key = str(server_id)
+        self._servers.pop(key, None)
+        slot = self._slots.get(key)
+        if slot is not None:
+            slot.generation += 1
+        self.invalidations += 1
+
+    async def _load(self, db: AsyncSession, server_id: uuid.UUID) -> ServerAlertState:
+        """Load and compile thresholds and open alerts for a server"""
+        thresholds = await crud_alert.get_alert_thresholds(db, server_id=server_id)
+        compiled = [
+            CompiledThreshold(t.metric_type, t.comparison, t.threshold_value)
+            for t in thresholds
+            if t.enabled and t.metric_type in METRIC_SECTIONS
+        ]
+
+        open_alerts: Dict[AlertType, uuid.UUID] = {}
+        if compiled:
+            for alert in await crud_alert.get_open_alerts(db, server_id):
+                open_alerts.setdefault(alert.type, alert.id)
+
+        self.loads += 1
+        return ServerAlertState(compiled, open_alerts)
+
+    async def evaluate(self, db: AsyncSession, server_id: uuid.UUID, metrics: dict) -> None:
+        """Evaluate a metrics sample, opening or resolving alerts as needed"""
+        key = str(server_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _ServerSlot()
+        slot.users += 1
+        try:
+            async with slot.lock:
+                await self._evaluate(db, server_id, metrics, slot)
+        finally:
+            slot.users -= 1
+            if slot.users == 0:
+                del self._slots[key]
+
+    async def _evaluate(self, db: AsyncSession, server_id: uuid.UUID, metrics: dict, slot: _ServerSlot) -> None:
+        key = str(server_id)
+        state = self._servers.get(key)
+        if state is None:
+            generation = slot.generation
+            state = await self._load(db, server_id)
+            # An invalidation during the load may mean it read outdated rows: use them for
+            # this sample only
+            if slot.generation == generation:
+                self._servers[key] = state
+
+        if not state.thresholds:
+            return
+        self.evaluations += 1
+
+        # A metric type is in violation if any of its thresholds is exceeded
+        violations: Dict[AlertType, tuple] = {}
+        evaluated = set()
+        for threshold in state.thresholds:
+            current_value = threshold.value(metrics)
+            if current_value is None:
+                continue
+            evaluated.add(threshold.metric_type)
+            if threshold.metric_type not in violations and threshold.exceeded(current_value):
+                violations[threshold.metric_type] = (threshold, current_value)
+
+        for metric_type in evaluated:
+            open_alert_id = state.open_alerts.get(metric_type)
+            if metric_type in violations:
+                if open_alert_id is None:
+                    threshold, current_value = violations[metric_type]
+                    alert = await self._open_alert(db, server_id, threshold, current_value)
+                    state.open_alerts[metric_type] = alert.id
+            elif open_alert_id is not None:
+                # Threshold no longer exceeded - resolve the open alert
+                await crud_alert.resolve_alert(db, open_alert_id)
+                del state.open_alerts[metric_type]
+                self.alerts_resolved += 1
+
+    async def _open_alert(
+        self,
+        db: AsyncSession,
+        server_id: uuid.UUID,
+        threshold: CompiledThreshold,
+        current_value: float,
+    ):
+        comparison_str = ">" if threshold.comparison == ComparisonType.GT else "<"
+        message = (
+            f"{threshold.metric_type.upper()} usage is {current_value:.1f}%, "
+            f"which exceeds threshold of {comparison_str} {threshold.threshold_value}%"
+        )
+
+        alert_create = AlertCreate(
+            server_id=server_id,
+            type=threshold.metric_type,
+            severity=_severity(threshold, current_value),
+            message=message,
+            threshold=threshold.threshold_value,
+            current_value=current_value,
+        )
+
+        alert = await crud_alert.create_alert(db, alert_create)
+        self.alerts_opened += 1
+        print(f"Alert created for {threshold.metric_type} on server {server_id}")
+        return alert
+
+    def stats(self) -> dict:
+        """Registry size and evaluation counters"""
+        return {
+            "cached_servers": len(self._servers),
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "evaluations": self.evaluations,
+            "alerts_opened": self.alerts_opened,
+            "alerts_resolved": self.alerts_resolved,
+        }
+
+
+# Global alert registry instance
+alert_registry = AlertRegistry()
+# Threshold changes made on any worker reach the worker evaluating the server's samples
+bus.on_invalidate("alert_registry", alert_registry.invalidate)
 
 
 async def check_metrics_against_thresholds(
@@ -16,103 +240,4 @@ async def check_metrics_against_thresholds(
     Check metrics against alert thresholds and create alerts if thresholds are exceeded.
     This should be called whenever new metrics are received.
     """
-    # Get all enabled thresholds for this server
-    thresholds = await crud_alert.get_alert_thresholds(db, server_id=server_id)
-    enabled_thresholds = [t for t in thresholds if t.enabled]
-    
-    if not enabled_thresholds:
-        return
-    
-    print(f"Checking {len(enabled_thresholds)} thresholds for server {server_id}")
-    
-    # Get existing unresolved alerts for this server to avoid duplicates
-    # We need to get all unresolved alerts and filter by server_id
-    all_existing_alerts = await crud_alert.get_alerts(
-        db, skip=0, limit=1000, resolved=False
-    )
-    existing_alert_keys = {
-        (str(a.server_id), a.type): a 
-        for a in all_existing_alerts 
-        if str(a.server_id) == str(server_id)
-    }
-    
-    # Check each threshold
-    for threshold in enabled_thresholds:
-        # Get the current metric value based on threshold type
-        current_value = None
-        metric_data = None
-        
-        if threshold.metric_type == AlertType.CPU:
-            metric_data = metrics.get("cpu", {})
-            current_value = metric_data.get("usage_percent")
-        elif threshold.metric_type == AlertType.MEMORY:
-            metric_data = metrics.get("memory", {})
-            current_value = metric_data.get("usage_percent")
-        elif threshold.metric_type == AlertType.DISK:
-            metric_data = metrics.get("disk", {})
-            current_value = metric_data.get("usage_percent")
-        elif threshold.metric_type == AlertType.NETWORK:
-            # For network, we might want to check bytes sent/recv
-            # For now, let's skip network alerts or use a different metric
-            continue
-        
-        if current_value is None:
-            print(f"Warning: No current_value for {threshold.metric_type} metric")
-            continue
-        
-        print(f"Checking {threshold.metric_type}: current={current_value:.1f}%, threshold={threshold.comparison.value} {threshold.threshold_value}%")
-        
-        # Check if threshold is exceeded
-        threshold_exceeded = False
-        if threshold.comparison == ComparisonType.GT:
-            threshold_exceeded = current_value > threshold.threshold_value
-        elif threshold.comparison == ComparisonType.LT:
-            threshold_exceeded = current_value < threshold.threshold_value
-        
-        print(f"Threshold exceeded: {threshold_exceeded}")
-        
-        # Create alert if threshold is exceeded and no unresolved alert exists
-        if threshold_exceeded:
-            alert_key = (str(server_id), threshold.metric_type)
-            if alert_key not in existing_alert_keys:
-                print(f"Creating alert for {threshold.metric_type} threshold exceeded")
-                # Determine severity based on how far over the threshold
-                severity = AlertSeverity.WARNING
-                if threshold.comparison == ComparisonType.GT:
-                    if current_value > threshold.threshold_value * 1.5:
-                        severity = AlertSeverity.CRITICAL
-                    elif current_value > threshold.threshold_value * 1.2:
-                        severity = AlertSeverity.WARNING
-                elif threshold.comparison == ComparisonType.LT:
-                    if current_value < threshold.threshold_value * 0.5:
-                        severity = AlertSeverity.CRITICAL
-                    elif current_value < threshold.threshold_value * 0.8:
-                        severity = AlertSeverity.WARNING
-                
-                # Create alert message
-                comparison_str = ">" if threshold.comparison == ComparisonType.GT else "<"
-                message = (
-                    f"{threshold.metric_type.upper()} usage is {current_value:.1f}%, "
-                    f"which exceeds threshold of {comparison_str} {threshold.threshold_value}%"
-                )
-                
-                # Create alert
-                alert_create = AlertCreate(
-                    server_id=server_id,
-                    type=threshold.metric_type,
-                    severity=severity,
-                    message=message,
-                    threshold=threshold.threshold_value,
-                    current_value=current_value,
-                )
-                
-                await crud_alert.create_alert(db, alert_create)
-                print(f"Alert created successfully for {threshold.metric_type}")
-        else:
-            # Threshold not exceeded - resolve any existing alerts for this metric type
-            alert_key = (str(server_id), threshold.metric_type)
-            if alert_key in existing_alert_keys:
-                existing_alert = existing_alert_keys[alert_key]
-                if not existing_alert.resolved:
-                    await crud_alert.resolve_alert(db, existing_alert.id)
-
+    await alert_registry.evaluate(db, server_id, metrics)
@@ -1,11 +1,36 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
+from typing import Optional
+import hmac
+import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.crud.user import authenticate_user, create_user, get_user_by_email, get_user_by_username
+from app.crud import api_key as crud_api_key
+from app.crud.user import authenticate_user, create_user, get_user, get_user_by_email, get_user_by_username
+from app.models.api_key import APIKey
+from app.models.user import User
 from app.schemas.user import UserCreate
 from app.schemas.auth import Token, RefreshTokenResponse
-from app.core.security import create_access_token, create_refresh_token, decode_refresh_token
+from app.core.cache import TTLCache
+from app.core.hash_pool import agent_hash_pool
+from app.core.security import create_access_token, create_refresh_token, decode_refresh_token, verify_password_async
 from app.core.config import settings
 from app.schemas.user import UserResponse
+from app.services.bus import bus
+
+# user id -> User resolved from an access token (detached, column attributes only)
+user_cache = TTLCache(ttl_seconds=settings.USER_CACHE_TTL_SECONDS)
+bus.on_invalidate("user", user_cache.delete)
+
+# digest of the plain key -> verified APIKey
+api_key_cache = TTLCache(ttl_seconds=settings.API_KEY_CACHE_TTL_SECONDS)
+bus.on_invalidate("api_key", api_key_cache.delete)
+bus.on_invalidate(
+    "api_keys_of_server",
+    lambda server_id: api_key_cache.delete_where(lambda _, key: str(key.server_id) == server_id),
+)
+# digests of legacy-format keys that matched no legacy key, so repeats skip the bcrypt scan
+rejected_legacy_keys = TTLCache(ttl_seconds=settings.API_KEY_CACHE_TTL_SECONDS)
+# Cleared once a scan finds no bcrypt-hashed key left; none are ever created again
+_legacy_keys_remaining = True
 
 
 async def login_user(db: AsyncSession, email: str, password: str) -> Token:
@@ -84,8 +109,6 @@ async def refresh_access_token(db: AsyncSession, refresh_token: str) -> RefreshT
         raise ValueError("Invalid refresh token")
     
     # Verify user exists and is active
-    from app.crud.user import get_user
-    import uuid
     user = await get_user(db, uuid.UUID(user_id))
     if not user:
         raise ValueError("User not found")
@@ -105,3 +128,73 @@ async def refresh_access_token(db: AsyncSession, refresh_token: str) -> RefreshT
         token_type="bearer",
     )
 
+
+async def get_authenticated_user(db: AsyncSession, user_id: uuid.UUID) -> Optional[User]:
+    """User for an access token's subject, cached for USER_CACHE_TTL_SECONDS"""
+    key = str(user_id)
+    cached = user_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    user = await get_user(db, user_id)
+    if user is None:
+        return None
+    # The instance is shared between requests, so keep it out of this session
+    db.expunge(user)
+    user_cache.set(key, user)
+    return user
+
+
+async def _lookup_api_key(db: AsyncSession, plain_key: str, key_hash: str) -> Optional[APIKey]:
+    """Find the active key matching a plain key without scanning the table"""
+    key_prefix = crud_api_key.parse_key_prefix(plain_key)
+    if key_prefix:
+        key = await crud_api_key.get_active_api_key_by_prefix(db, key_prefix)
+        if key and hmac.compare_digest(key.key_hash, key_hash):
+            return key
+        return None
+    
+    # Anything else can only be a key issued before prefixes existed
+    if not crud_api_key.LEGACY_KEY_PATTERN.fullmatch(plain_key) or rejected_legacy_keys.get(key_hash):
+        return None
+    
+    # Legacy key that has already been migrated to a digest
+    key = await crud_api_key.get_active_api_key_by_hash(db, key_hash)
+    if key:
+        return key
+    
+    # Legacy bcrypt-hashed key: scan only keys that have not been migrated yet,
+    # then replace the bcrypt hash with the digest so later lookups are indexed
+    global _legacy_keys_remaining
+    if not _legacy_keys_remaining:
+        return None
+    legacy_keys = await crud_api_key.get_unmigrated_api_keys(db)
+    if not legacy_keys:
+        _legacy_keys_remaining = False
+    for key in legacy_keys:
+        if await verify_password_async(plain_key, key.key_hash, pool=agent_hash_pool):
+            key.key_hash = key_hash
+            return key
+    
+    rejected_legacy_keys.set(key_hash, True)
+    return None
+
+
+async def verify_and_get_api_key(db: AsyncSession, plain_key: str) -> Optional[APIKey]:
+    """Verify an API key and return the key object if valid"""
+    key_hash = crud_api_key.hash_api_key(plain_key)
+    cached = api_key_cache.get(key_hash)
+    if cached is not None:
+        return cached
+    
+    key = await _lookup_api_key(db, plain_key, key_hash)
+    if not key:
+        return None
+    
+    # Update last_used timestamp (at most once per cache TTL per key)
+    key.last_used = datetime.utcnow()
+    await db.commit()
+    await db.refresh(key)
+    
+    api_key_cache.set(key_hash, key)
+    return key
@@ -0,0 +1,411 @@
+"""
+Message bus connecting API worker processes.
+
+Agent connections and dashboard sockets live in whichever worker accepted
+them. The bus lets any worker publish to a channel and have every worker
+that subscribed to it (including itself) receive the message. The default
+in-process backend is enough for a single worker; the Postgres backend uses
+LISTEN/NOTIFY so several workers or replicas can share one database without
+extra infrastructure.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from app.core.config import settings
+
+Handler = Callable[[dict], Awaitable[None]]
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_MAX_PAYLOAD = 7900
+# How long a partially received chunked message is kept
+CHUNK_TTL_SECONDS = 30.0
+
+INVALIDATION_CHANNEL = "chatops:invalidate"
+# Workers announce which stream channels they have subscribers for
+INTEREST_CHANNEL = "chatops:interest"
+STREAM_CHANNEL_PREFIX = "chatops:stream:"
+# Interest is re-announced this often and forgotten after three missed announcements
+INTEREST_INTERVAL_SECONDS = 10.0
+# Notifications sent per round trip on the publish connection
+PUBLISH_BATCH_SIZE = 500
+
+
+def stream_channel(server_id: str) -> str:
+    """Dashboard events (metrics, logs) for one server"""
+    return f"{STREAM_CHANNEL_PREFIX}{server_id}"
+
+
+def command_channel(command_id: str) -> str:
+    """Streamed output of one command"""
+    return f"chatops:command:{command_id}"
+
+
+def agent_channel(server_id: str) -> str:
+    """Requests for the worker that holds the agent connection of one server"""
+    return f"chatops:agent:{server_id}"
+
+
+def worker_channel(worker_id: str) -> str:
+    """Replies addressed to one worker"""
+    return f"chatops:worker:{worker_id}"
+
+
+class MessageBus:
+    """In-process bus: messages are delivered to local subscribers only"""
+
+    # Whether messages can reach other processes
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        # channel -> handlers
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        # cache name -> callback(key)
+        self._invalidators: Dict[str, Callable[[str], None]] = {}
+        self._handlers[INVALIDATION_CHANNEL].append(self._on_invalidation)
+
+        # Counters
+        self.published = 0
+        self.delivered = 0
+        self.handler_errors = 0
+
+    async def start(self) -> None:
+        """Start the bus"""
+
+    async def stop(self) -> None:
+        """Stop the bus"""
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        """Deliver messages published on `channel` to `handler`"""
+        if handler not in self._handlers[channel]:
+            self._handlers[channel].append(handler)
+
+    def unsubscribe(self, channel: str, handler: Handler) -> None:
+        """Stop delivering `channel` to `handler`"""
+        handlers = self._handlers.get(channel)
+        if not handlers:
+            return
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            del self._handlers[channel]
+
+    def has_subscribers(self, channel: str) -> bool:
+        """Whether this worker has local subscribers for a channel"""
+        return bool(self._handlers.get(channel))
+
+    async def publish(self, channel: str, message: dict) -> None:
+        """Publish a message to every subscriber of a channel"""
+        self.published += 1
+        await self._deliver(channel, message)
+
+    async def _deliver(self, channel: str, message: dict) -> None:
+        """Run local handlers for a channel"""
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(message)
+                self.delivered += 1
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"Error handling bus message on {channel}: {e}")
+
+    def on_invalidate(self, cache_name: str, callback: Callable[[str], None]) -> None:
+        """Register the local invalidation callback for a named cache"""
+        self._invalidators[cache_name] = callback
+
+    async def invalidate(self, cache_name: str, key: str) -> None:
+        """Invalidate a cache entry on every worker"""
+        await self.publish(INVALIDATION_CHANNEL, {"cache": cache_name, "key": key})
+
+    async def _on_invalidation(self, message: dict) -> None:
+        callback = self._invalidators.get(message.get("cache"))
+        if callback is not None:
+            callback(message.get("key"))
+
+    def stats(self) -> dict:
+        """Backend, subscription and delivery counters"""
+        return {
+            "backend": "memory",
+            "worker_id": self.worker_id,
+            "channels": len(self._handlers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "handler_errors": self.handler_errors,
+        }
+
+
+class PostgresBus(MessageBus):
+    """
+    Bus backed by Postgres LISTEN/NOTIFY.
+
+    Publishing delivers to local subscribers directly and queues a NOTIFY
+    so other workers receive it; a worker ignores notifications it sent
+    itself. NOTIFYs are sent in batches by one task over a dedicated
+    connection, so publishers never wait for a round trip and the LISTEN
+    connection only receives. A worker only LISTENs on channels it has local
+    subscribers for, and announces its stream channels to the others: a
+    stream event nobody else subscribed to is not NOTIFYed at all.
+    Messages too large for one NOTIFY are split into chunks and reassembled.
+    """
+
+    distributed = True
+
+    def __init__(self, dsn: str, dispatch_queue_size: int = 10000, publish_queue_size: int = 10000):
+        super().__init__()
+        self.dsn = dsn
+        self._conn = None
+        self._conn_lock = asyncio.Lock()
+        self._pub_conn = None
+        self._listening: Set[str] = set()
+        # Incoming messages are dispatched in arrival order by one task
+        self._inbox: asyncio.Queue = asyncio.Queue(maxsize=dispatch_queue_size)
+        # Outgoing (channel, payload) pairs, sent in order by one task
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=publish_queue_size)
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._publisher: Optional[asyncio.Task] = None
+        self._announcer: Optional[asyncio.Task] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._msg_seq = 0
+        # (origin, msg_id) -> (first_seen, total, {index: chunk})
+        self._chunks: Dict[Tuple[str, str], Tuple[float, int, Dict[int, str]]] = {}
+        # worker id -> (last announcement, stream channels it subscribes to)
+        self._remote_interest: Dict[str, Tuple[float, Set[str]]] = {}
+        self._interest_changed = asyncio.Event()
+        self._handlers[INTEREST_CHANNEL].append(self._on_interest)
+
+        # Counters
+        self.notifies = 0
+        self.publish_errors = 0
+        self.publish_dropped = 0
+        self.skipped_no_interest = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    async def start(self) -> None:
+        await self._connect()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self._publisher = asyncio.create_task(self._publish_loop())
+        self._announcer = asyncio.create_task(self._announce_loop())
+        self._supervisor = asyncio.create_task(self._supervise())
+        # Ask the other workers for their interest instead of waiting for their next announcement
+        await self.publish(INTEREST_CHANNEL, {"kind": "query", "worker": self.worker_id})
+
+    async def stop(self) -> None:
+        for task in (self._supervisor, self._announcer, self._publisher, self._dispatcher):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._supervisor = self._announcer = self._publisher = self._dispatcher = None
+        for conn in (self._conn, self._pub_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        self._conn = self._pub_conn = None
+        self._listening.clear()
+
+    async def _connect(self) -> None:
+        import asyncpg
+
+        self._conn = await asyncpg.connect(self.dsn)
+        self._listening.clear()
+        await self._sync_listeners()
+
+    async def _supervise(self) -> None:
+        """Reconnect and re-LISTEN if the connection drops"""
+        while True:
+            await asyncio.sleep(5)
+            if self._conn is not None and not self._conn.is_closed():
+                continue
+            try:
+                async with self._conn_lock:
+                    await self._connect()
+                self.reconnects += 1
+            except Exception as e:
+                print(f"Error reconnecting message bus: {e}")
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        first = not self.has_subscribers(channel)
+        super().subscribe(channel, handler)
+        if first:
+            asyncio.get_running_loop().create_task(self._sync_listeners_locked())
+            if channel.startswith(STREAM_CHANNEL_PREFIX):
+                self._interest_changed.set()
+
+    def unsubscribe(self, channel: str, handler: Handler) -> None:
+        super().unsubscribe(channel, handler)
+        if not self.has_subscribers(channel) and channel in self._listening:
+            asyncio.get_running_loop().create_task(self._sync_listeners_locked())
+            if channel.startswith(STREAM_CHANNEL_PREFIX):
+                self._interest_changed.set()
+
+    async def _sync_listeners_locked(self) -> None:
+        try:
+            async with self._conn_lock:
+                await self._sync_listeners()
+        except Exception as e:
+            print(f"Error updating message bus subscriptions: {e}")
+
+    async def _sync_listeners(self) -> None:
+        """LISTEN/UNLISTEN so the connection matches the local subscriptions"""
+        if self._conn is None or self._conn.is_closed():
+            return
+        wanted = set(self._handlers)
+        for channel in wanted - self._listening:
+            await self._conn.add_listener(channel, self._on_notify)
+            self._listening.add(channel)
+        for channel in self._listening - wanted:
+            await self._conn.remove_listener(channel, self._on_notify)
+            self._listening.discard(channel)
+
+    async def publish(self, channel: str, message: dict) -> None:
+        self.published += 1
+        await self._deliver(channel, message)
+
+        if channel.startswith(STREAM_CHANNEL_PREFIX) and not self.remote_interest(channel):
+            self.skipped_no_interest += 1
+            return
+
+        body = json.dumps(message, default=str)
+        self._msg_seq += 1
+        msg_id = str(self._msg_seq)
+        # JSON is ASCII-only by default, so characters and bytes line up
+        size = NOTIFY_MAX_PAYLOAD - 64
+        chunks = [body[i:i + size] for i in range(0, len(body), size)] or [""]
+        if self._outbox.maxsize - self._outbox.qsize() < len(chunks):
+            self.publish_dropped += 1
+            print(f"Message bus publish queue full, dropping message on {channel}")
+            return
+        for index, chunk in enumerate(chunks):
+            self._outbox.put_nowait((channel, f"{self.worker_id}:{msg_id}:{index}:{len(chunks)}:{chunk}"))
+
+    def remote_interest(self, channel: str) -> bool:
+        """Whether another worker recently announced subscribers for a stream channel"""
+        cutoff = time.monotonic() - 3 * INTEREST_INTERVAL_SECONDS
+        return any(seen >= cutoff and channel in channels for seen, channels in self._remote_interest.values())
+
+    async def _publish_loop(self) -> None:
+        """Send queued notifications in batches over the publish connection"""
+        while True:
+            batch = [await self._outbox.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE and not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            try:
+                if self._pub_conn is None or self._pub_conn.is_closed():
+                    import asyncpg
+
+                    self._pub_conn = await asyncpg.connect(self.dsn)
+                await self._pub_conn.executemany("SELECT pg_notify($1, $2)", batch)
+                self.notifies += len(batch)
+            except Exception as e:
+                self.publish_errors += len(batch)
+                print(f"Error publishing {len(batch)} notifications to the message bus: {e}")
+                if self._pub_conn is not None and not self._pub_conn.is_closed():
+                    await self._pub_conn.close()
+                self._pub_conn = None
+                await asyncio.sleep(1)
+
+    async def _announce_loop(self) -> None:
+        """Announce this worker's stream channels on change and every INTEREST_INTERVAL_SECONDS"""
+        while True:
+            try:
+                await asyncio.wait_for(self._interest_changed.wait(), timeout=INTEREST_INTERVAL_SECONDS)
+                # Let a burst of subscription changes settle into one announcement
+                await asyncio.sleep(0.05)
+            except asyncio.TimeoutError:
+                pass
+            self._interest_changed.clear()
+            await self._announce()
+
+    async def _announce(self) -> None:
+        channels = [channel for channel in self._handlers if channel.startswith(STREAM_CHANNEL_PREFIX)]
+        await self.publish(INTEREST_CHANNEL, {"kind": "interest", "worker": self.worker_id, "channels": channels})
+
+    async def _on_interest(self, message: dict) -> None:
+        worker = message.get("worker")
+        if worker == self.worker_id:
+            return
+        if message.get("kind") == "query":
+            self._interest_changed.set()
+        elif message.get("kind") == "interest":
+            self._remote_interest[worker] = (time.monotonic(), set(message.get("channels") or ()))
+        cutoff = time.monotonic() - 3 * INTEREST_INTERVAL_SECONDS
+        for stale in [w for w, (seen, _) in self._remote_interest.items() if seen < cutoff]:
+            del self._remote_interest[stale]
+
+    def _on_notify(self, connection, pid, channel: str, payload: str) -> None:
+        """asyncpg notification callback: reassemble and queue for dispatch"""
+        try:
+            origin, msg_id, index, total, chunk = payload.split(":", 4)
+            index, total = int(index), int(total)
+        except ValueError:
+            return
+        if origin == self.worker_id:
+            return
+
+        if total > 1:
+            loop_time = asyncio.get_running_loop().time()
+            key = (origin, msg_id)
+            first_seen, _, parts = self._chunks.setdefault(key, (loop_time, total, {}))
+            parts[index] = chunk
+            if len(parts) < total:
+                self._expire_chunks(loop_time)
+                return
+            del self._chunks[key]
+            chunk = "".join(parts[i] for i in range(total))
+
+        try:
+            message = json.loads(chunk)
+        except ValueError:
+            return
+        self.received += 1
+        try:
+            self._inbox.put_nowait((channel, message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _expire_chunks(self, now: float) -> None:
+        stale = [key for key, (first_seen, _, _) in self._chunks.items() if now - first_seen > CHUNK_TTL_SECONDS]
+        for key in stale:
+            del self._chunks[key]
+
+    async def _dispatch(self) -> None:
+        while True:
+            channel, message = await self._inbox.get()
+            await self._deliver(channel, message)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "backend": "postgres",
+            "connected": self._conn is not None and not self._conn.is_closed(),
+            "listening": len(self._listening),
+            "notifies": self.notifies,
+            "publish_queue_depth": self._outbox.qsize(),
+            "publish_errors": self.publish_errors,
+            "publish_dropped": self.publish_dropped,
+            "skipped_no_interest": self.skipped_no_interest,
+            "remote_workers": len(self._remote_interest),
+            "received": self.received,
+            "dropped": self.dropped,
+            "inbox_depth": self._inbox.qsize(),
+            "pending_chunked": len(self._chunks),
+            "reconnects": self.reconnects,
+        })
+        return stats
+
+
+def _create_bus() -> MessageBus:
+    if settings.MESSAGE_BUS_BACKEND == "postgres":
+        dsn = settings.async_database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+        return PostgresBus(dsn)
+    return MessageBus()
+
+
+# Global message bus instance
+bus = _create_bus()
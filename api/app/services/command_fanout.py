@@ -0,0 +1,220 @@
+"""Run one command on many servers concurrently"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import command_history as crud_command_history
+from app.models.command_history import CommandStatus
+from app.services.agent_manager import agent_manager
+from app.services.command_jobs import command_outcome
+
+# Results are stored once this many have accumulated (and at the end of every batch)
+WRITE_BATCH_SIZE = 100
+
+
+class CommandFanout:
+    """
+    Fleet-wide command execution.
+
+    `run` sends a command to every server with at most `parallelism`
+    commands outstanding and yields each server's result as soon as it
+    arrives. With `batch_size`, servers are processed in rolling batches:
+    the next batch starts once the previous one has finished, and with
+    `stop_on_failure` the remaining batches are skipped after a failure.
+    Results are stored in command_history with multi-row INSERTs every
+    WRITE_BATCH_SIZE completions and at the end of each batch, so a long run
+    is visible in the history while it progresses. When the caller goes away
+    mid-run, outstanding commands are cancelled and recorded as failed.
+    """
+
+    def __init__(self, default_parallelism: int, max_parallelism: int):
+        self.default_parallelism = default_parallelism
+        self.max_parallelism = max_parallelism
+        self.running = 0
+        self.in_flight = 0
+
+        # Counters
+        self.fanouts = 0
+        self.commands = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.failed_writes = 0
+
+    async def run(
+        self,
+        user_id: uuid.UUID,
+        server_ids: List[uuid.UUID],
+        command: str,
+        parallelism: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        stop_on_failure: bool = False,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[dict]:
+        """Yield a `result` frame per server (in completion order), then a `summary` frame"""
+        parallelism = min(parallelism or self.default_parallelism, self.max_parallelism)
+        batch_size = batch_size or len(server_ids) or 1
+        slots = asyncio.Semaphore(parallelism)
+        results: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[uuid.UUID, asyncio.Task] = {}
+        # server id -> when its command was sent
+        sent: Dict[uuid.UUID, datetime] = {}
+        rows: Dict[uuid.UUID, dict] = {}
+        # Results not stored yet
+        unwritten: List[dict] = []
+        counts = {status.value: 0 for status in (CommandStatus.COMPLETED, CommandStatus.FAILED, CommandStatus.TIMEOUT)}
+        started = time.perf_counter()
+
+        async def execute(server_id: uuid.UUID) -> None:
+            async with slots:
+                started_at = sent[server_id] = datetime.now(timezone.utc)
+                self.in_flight += 1
+                try:
+                    response = await agent_manager.send_command(
+                        str(server_id),
+                        {"type": "execute_command", "command": command},
+                        timeout=timeout,
+                    )
+                    outcome = command_outcome(response)
+                except Exception as e:
+                    outcome = {"status": CommandStatus.FAILED, "error_message": str(e)}
+                finally:
+                    self.in_flight -= 1
+            row = _history_row(user_id, server_id, command, started_at, outcome)
+            rows[server_id] = row
+            unwritten.append(row)
+            results.put_nowait(row)
+
+        self.running += 1
+        self.fanouts += 1
+        try:
+            skipped: List[uuid.UUID] = []
+            for start in range(0, len(server_ids), batch_size):
+                batch = server_ids[start:start + batch_size]
+                if stop_on_failure and counts[CommandStatus.FAILED.value] + counts[CommandStatus.TIMEOUT.value]:
+                    skipped.extend(batch)
+                    continue
+                for server_id in batch:
+                    tasks[server_id] = asyncio.create_task(execute(server_id))
+                for index in range(len(batch)):
+                    row = await results.get()
+                    counts[row["status"].value] += 1
+                    yield _result_frame(row)
+                    if len(unwritten) >= WRITE_BATCH_SIZE or index == len(batch) - 1:
+                        await self._write(unwritten)
+
+            for server_id in skipped:
+                self.skipped += 1
+                yield {"type": "result", "server_id": str(server_id), "command_id": None, "status": "skipped"}
+            yield {
+                "type": "summary",
+                "servers": len(server_ids),
+                **counts,
+                "skipped": len(skipped),
+                "duration_ms": int((time.perf_counter() - started) * 1000),
+            }
+        finally:
+            self.running -= 1
+            await self._finish(user_id, command, tasks, sent, rows, unwritten)
+
+    async def _write(self, unwritten: List[dict]) -> None:
+        """Store accumulated results in one INSERT; rows that failed stay for the next write"""
+        if not unwritten:
+            return
+        batch = list(unwritten)
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud_command_history.create_command_history_bulk(db, batch)
+        except Exception as e:
+            self.failed_writes += 1
+            print(f"Error storing {len(batch)} fan-out results: {e}")
+            return
+        # Results that arrived during the INSERT are kept
+        del unwritten[:len(batch)]
+        self.commands += len(batch)
+
+    async def _finish(
+        self,
+        user_id: uuid.UUID,
+        command: str,
+        tasks: Dict[uuid.UUID, asyncio.Task],
+        sent: Dict[uuid.UUID, datetime],
+        rows: Dict[uuid.UUID, dict],
+        unwritten: List[dict],
+    ) -> None:
+        """Cancel what is still running and store the results not written yet"""
+        unfinished = [task for task in tasks.values() if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+        self.cancelled += len(unfinished)
+        # Commands that reached an agent are recorded even if nobody waits for them anymore
+        for server_id, started_at in sent.items():
+            if server_id not in rows:
+                rows[server_id] = _history_row(user_id, server_id, command, started_at, {
+                    "status": CommandStatus.FAILED,
+                    "error_message": "Fan-out cancelled before the command finished",
+                })
+                unwritten.append(rows[server_id])
+        await self._write(unwritten)
+
+    def stats(self) -> dict:
+        """Running fan-outs and commands in flight"""
+        return {
+            "running": self.running,
+            "in_flight": self.in_flight,
+            "default_parallelism": self.default_parallelism,
+            "max_parallelism": self.max_parallelism,
+            "fanouts": self.fanouts,
+            "commands": self.commands,
+            "skipped": self.skipped,
+            "cancelled": self.cancelled,
+            "failed_writes": self.failed_writes,
+        }
+
+
+def _history_row(
+    user_id: uuid.UUID,
+    server_id: uuid.UUID,
+    command: str,
+    started_at: datetime,
+    outcome: dict,
+) -> dict:
+    completed_at = datetime.now(timezone.utc)
+    return {
+        "id": uuid.uuid4(),
+        "server_id": server_id,
+        "user_id": user_id,
+        "command": command,
+        "status": outcome["status"],
+        "exit_code": outcome.get("exit_code"),
+        "stdout": outcome.get("stdout"),
+        "stderr": outcome.get("stderr"),
+        "error_message": outcome.get("error_message"),
+        "started_at": started_at,
+        "completed_at": completed_at,
+        "duration_ms": int((completed_at - started_at).total_seconds() * 1000),
+    }
+
+
+def _result_frame(row: dict) -> dict:
+    return {
+        "type": "result",
+        "server_id": str(row["server_id"]),
+        "command_id": str(row["id"]),
+        "status": row["status"].value,
+        "exit_code": row["exit_code"],
+        "stdout": row["stdout"],
+        "stderr": row["stderr"],
+        "error": row["error_message"],
+        "duration_ms": row["duration_ms"],
+    }
+
+
+# Global fan-out runner
+command_fanout = CommandFanout(
+    default_parallelism=settings.COMMAND_FANOUT_PARALLELISM,
+    max_parallelism=settings.COMMAND_FANOUT_MAX_PARALLELISM,
+)
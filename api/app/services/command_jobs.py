@@ -0,0 +1,157 @@
+"""Background execution of agent commands for callers that poll for the result"""
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import command_history as crud_command_history
+from app.models.command_history import CommandStatus
+from app.services.agent_manager import agent_manager
+from app.services.bus import bus, command_channel
+
+
+def command_outcome(response: Optional[dict]) -> dict:
+    """command_history fields for an agent's reply to execute_command (None = agent not connected)"""
+    if response is None:
+        return {"status": CommandStatus.FAILED, "error_message": "Agent not connected"}
+    if "error" in response:
+        status = CommandStatus.TIMEOUT if response.get("timeout") else CommandStatus.FAILED
+        return {"status": status, "error_message": response["error"]}
+    if response.get("type") == "command_result":
+        result_data = response.get("data") or {}
+        output = result_data.get("output", "")
+        exit_code = result_data.get("exit_code", 0)
+        success = exit_code == 0
+        return {
+            "status": CommandStatus.COMPLETED if success else CommandStatus.FAILED,
+            "exit_code": exit_code,
+            "stdout": output if success else None,
+            "stderr": output if not success else None,
+        }
+    if response.get("type") == "error":
+        return {"status": CommandStatus.FAILED, "error_message": response.get("message", "Unknown error")}
+    return {"status": CommandStatus.FAILED, "error_message": "Unexpected response from agent"}
+
+
+class CommandJobs:
+    """
+    Run commands submitted with `?async=true` in the background.
+
+    A job is a command_history row: PENDING until one of `max_running` slots
+    is free, RUNNING while the agent works on it, then COMPLETED, FAILED or
+    TIMEOUT. No request or database session is held while it runs. When a job
+    finishes, a `command_exit` event is published on the command's bus
+    channel so long-polling callers on any worker return right away.
+    """
+
+    def __init__(self, max_running: int, max_jobs: int):
+        self.max_running = max_running
+        self.max_jobs = max_jobs
+        self._slots = asyncio.Semaphore(max_running)
+        # command_id -> task (pending or running)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.running = 0
+
+        # Counters
+        self.submitted = 0
+        self.rejected = 0
+        self.finished: Dict[str, int] = {}
+
+    def submit(self, command_id: uuid.UUID, server_id: uuid.UUID, command: str, timeout: Optional[float] = None) -> bool:
+        """Queue a job for a PENDING command_history row. Returns False when too many jobs are queued."""
+        if len(self._tasks) >= self.max_jobs:
+            self.rejected += 1
+            return False
+        key = str(command_id)
+        task = asyncio.create_task(self._run(command_id, server_id, command, timeout))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        self.submitted += 1
+        return True
+
+    async def _run(self, command_id: uuid.UUID, server_id: uuid.UUID, command: str, timeout: Optional[float]) -> None:
+        outcome = {"status": CommandStatus.FAILED, "error_message": "Internal error"}
+        try:
+            async with self._slots:
+                self.running += 1
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await crud_command_history.update_command_history(
+                            db,
+                            command_id=command_id,
+                            status=CommandStatus.RUNNING,
+                            started_at=datetime.now(timezone.utc),
+                        )
+                    response = await agent_manager.send_command(
+                        str(server_id),
+                        {"type": "execute_command", "command": command},
+                        timeout=timeout,
+                    )
+                    outcome = command_outcome(response)
+                finally:
+                    self.running -= 1
+        except asyncio.CancelledError:
+            outcome = {"status": CommandStatus.FAILED, "error_message": "API shut down before the command finished"}
+            raise
+        except Exception as e:
+            print(f"Error running command job {command_id}: {e}")
+        finally:
+            await self._record(command_id, outcome)
+
+    async def _record(self, command_id: uuid.UUID, outcome: dict) -> None:
+        status = outcome["status"]
+        self.finished[status.value] = self.finished.get(status.value, 0) + 1
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud_command_history.update_command_history(db, command_id=command_id, **outcome)
+        except Exception as e:
+            print(f"Error recording result of command job {command_id}: {e}")
+        await bus.publish(command_channel(str(command_id)), {
+            "type": "command_exit",
+            "command_id": str(command_id),
+            "status": status.value,
+        })
+
+    @asynccontextmanager
+    async def watch(self, command_id: uuid.UUID) -> AsyncIterator[asyncio.Event]:
+        """Event set when the command finishes (subscribe before reading its row)"""
+        finished = asyncio.Event()
+
+        async def on_event(event: dict) -> None:
+            if event.get("type") == "command_exit":
+                finished.set()
+
+        channel = command_channel(str(command_id))
+        bus.subscribe(channel, on_event)
+        try:
+            yield finished
+        finally:
+            bus.unsubscribe(channel, on_event)
+
+    async def stop(self) -> None:
+        """Cancel unfinished jobs; their rows are marked FAILED"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Queued/running jobs and outcomes"""
+        return {
+            "pending": len(self._tasks) - self.running,
+            "running": self.running,
+            "max_running": self.max_running,
+            "max_jobs": self.max_jobs,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "finished": dict(self.finished),
+        }
+
+
+# Global command job runner
+command_jobs = CommandJobs(
+    max_running=settings.COMMAND_JOBS_MAX_RUNNING,
+    max_jobs=settings.COMMAND_JOBS_MAX_QUEUED,
+)
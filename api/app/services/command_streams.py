@@ -0,0 +1,409 @@
+"""Streamed command output: agent chunks -> command_history and WebSocket followers"""
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import command_history as crud_command_history
+from app.crud.command_history import OUTPUT_STREAMS
+from app.models.command_history import CommandHistory, CommandStatus
+from app.services.agent_manager import agent_manager
+from app.services.bus import bus, command_channel
+
+FINISHED_STATUSES = (CommandStatus.COMPLETED, CommandStatus.FAILED, CommandStatus.TIMEOUT)
+
+# Reloads (two write-back intervals apart) a follower waits for missing chunks to be stored
+GAP_RELOADS = 5
+
+
+class FollowerOverflow(Exception):
+    """A follower fell too far behind the live output, or missing output was never stored"""
+
+
+class CommandStream:
+    """A running command on an agent connected to this worker"""
+
+    __slots__ = (
+        "command_id", "server_id", "request_id", "connection", "started", "last_seq",
+        "stdout", "stderr", "pending_seq", "stored_bytes", "truncated",
+    )
+
+    def __init__(self, command_id: str, server_id: str, request_id: str, connection: Any = None):
+        self.command_id = command_id
+        self.server_id = server_id
+        self.request_id = request_id
+        # Agent WebSocket the command runs on (an agent may reconnect mid-command)
+        self.connection = connection
+        self.started = time.monotonic()
+        self.last_seq = 0
+        # Output received since the last write-back
+        self.stdout: List[str] = []
+        self.stderr: List[str] = []
+        self.pending_seq: Optional[int] = None
+        self.stored_bytes = 0
+        self.truncated = False
+
+
+class CommandStreams:
+    """
+    Relay streamed command output from agents.
+
+    Every `command_output` chunk is published on the command's bus channel as
+    soon as it arrives and appended to command_history every `flush_interval`
+    seconds (one UPDATE per command). The final `command_exit` frame is
+    published only after the output and status are stored, so a follower that
+    sees it can rely on the row. Output beyond `max_output_bytes` is still
+    relayed but no longer stored. When the command finishes, output larger
+    than COMMAND_OUTPUT_INLINE_BYTES is moved to compressed chunks.
+    """
+
+    def __init__(self, flush_interval: float, max_output_bytes: int, timeout: float, follower_queue_size: int):
+        self.flush_interval = flush_interval
+        self.max_output_bytes = max_output_bytes
+        self.timeout = timeout
+        self.follower_queue_size = follower_queue_size
+        # command_id -> stream
+        self._streams: Dict[str, CommandStream] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.started = 0
+        self.finished = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.unknown = 0
+        self.truncated = 0
+        self.timeouts = 0
+        self.failed_flushes = 0
+        self.followers = 0
+
+    def open(self, server_id: str, command_id: str, request_id: str, connection: Any = None) -> None:
+        """Start tracking a command the agent has acknowledged on `connection`"""
+        self._streams[command_id] = CommandStream(command_id, server_id, request_id, connection)
+        self.started += 1
+
+    async def on_output(self, server_id: str, frame: dict) -> None:
+        """Handle a `command_output` frame from an agent"""
+        stream = self._streams.get(str(frame.get("command_id")))
+        if stream is None or stream.server_id != server_id:
+            self.unknown += 1
+            return
+        try:
+            seq = int(frame["seq"])
+        except (KeyError, TypeError, ValueError):
+            self.unknown += 1
+            return
+        if seq <= stream.last_seq:
+            self.duplicates += 1
+            return
+        if seq != stream.last_seq + 1:
+            self.gaps += 1
+        stream.last_seq = seq
+
+        data = frame.get("data") or ""
+        name = "stderr" if frame.get("stream") == "stderr" else "stdout"
+        self.chunks += 1
+        self.bytes += len(data)
+        if not stream.truncated:
+            size = len(data.encode())
+            if stream.stored_bytes + size > self.max_output_bytes:
+                stream.truncated = True
+                self.truncated += 1
+            else:
+                stream.stored_bytes += size
+                getattr(stream, name).append(data)
+        stream.pending_seq = seq
+
+        await bus.publish(command_channel(stream.command_id), {
+            "type": "command_output",
+            "command_id": stream.command_id,
+            "seq": seq,
+            "stream": name,
+            "data": data,
+        })
+
+    async def on_exit(self, server_id: str, frame: dict) -> None:
+        """Handle the final `command_exit` frame from an agent"""
+        stream = self._streams.get(str(frame.get("command_id")))
+        if stream is None or stream.server_id != server_id:
+            self.unknown += 1
+            return
+        exit_code = frame.get("exit_code")
+        error = frame.get("error")
+        if error:
+            status = CommandStatus.FAILED
+        else:
+            status = CommandStatus.COMPLETED if exit_code == 0 else CommandStatus.FAILED
+        await self._finish(stream, status, exit_code=exit_code, error=error)
+
+    async def agent_disconnected(self, server_id: str, connection: Any = None) -> None:
+        """
+        Fail the commands of an agent connection that went away. Commands
+        started on a newer connection of the same agent are left running.
+        """
+        for stream in [
+            s for s in self._streams.values()
+            if s.server_id == server_id and (connection is None or s.connection is connection)
+        ]:
+            await self._finish(stream, CommandStatus.FAILED, error="Agent disconnected")
+
+    async def _finish(
+        self,
+        stream: CommandStream,
+        status: CommandStatus,
+        exit_code: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        if self._streams.pop(stream.command_id, None) is None:
+            return
+        if stream.truncated:
+            error = error or f"Output truncated after {self.max_output_bytes} bytes"
+        # A flush that picked up this stream before it was removed must not
+        # append to the row while its output is being compacted
+        async with self._flush_lock:
+            try:
+                await self._write(stream)
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Error appending output of command {stream.command_id}: {e}")
+            try:
+                async with AsyncSessionLocal() as db:
+                    await crud_command_history.compact_command_output(db, uuid.UUID(stream.command_id))
+                    await crud_command_history.update_command_history(
+                        db,
+                        command_id=uuid.UUID(stream.command_id),
+                        status=status,
+                        exit_code=exit_code,
+                        error_message=error,
+                    )
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Error storing result of command {stream.command_id}: {e}")
+        self.finished += 1
+        await bus.publish(command_channel(stream.command_id), {
+            "type": "command_exit",
+            "command_id": stream.command_id,
+            "seq": stream.last_seq + 1,
+            "status": status.value,
+            "exit_code": exit_code,
+            "error": error,
+        })
+
+    async def _write(self, stream: CommandStream) -> None:
+        """Append a stream's buffered output to its command_history row"""
+        if stream.pending_seq is None:
+            return
+        stdout, stderr, seq = "".join(stream.stdout), "".join(stream.stderr), stream.pending_seq
+        stream.stdout, stream.stderr, stream.pending_seq = [], [], None
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud_command_history.append_command_output(
+                    db, uuid.UUID(stream.command_id), seq, stdout=stdout, stderr=stderr,
+                )
+        except Exception:
+            # Keep the output (ahead of anything newer) for the next flush
+            stream.stdout.insert(0, stdout)
+            stream.stderr.insert(0, stderr)
+            if stream.pending_seq is None:
+                stream.pending_seq = seq
+            raise
+
+    async def flush(self) -> None:
+        """Write back buffered output of every running command"""
+        async with self._flush_lock:
+            for stream in list(self._streams.values()):
+                if self._streams.get(stream.command_id) is not stream:
+                    # Finished meanwhile; _finish writes what is left
+                    continue
+                try:
+                    await self._write(stream)
+                except Exception as e:
+                    self.failed_flushes += 1
+                    print(f"Error appending output of command {stream.command_id}: {e}")
+
+    async def _expire(self) -> None:
+        """Stop commands that ran longer than `timeout`"""
+        deadline = time.monotonic() - self.timeout
+        for stream in [s for s in self._streams.values() if s.started < deadline]:
+            self.timeouts += 1
+            await agent_manager.cancel(stream.server_id, stream.request_id)
+            await self._finish(
+                stream, CommandStatus.TIMEOUT,
+                error=f"Command did not finish within {self.timeout:g}s",
+            )
+
+    def start(self) -> None:
+        """Start the background write-back task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and write out buffered output"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self._expire()
+            except Exception as e:
+                print(f"Error in command stream write-back: {e}")
+
+    async def follow(self, command: CommandHistory) -> AsyncIterator[dict]:
+        """
+        Frames for one command: the output stored so far, then live chunks,
+        ending with `command_exit`. Works on any worker.
+
+        Chunks published before the subscription may not be stored yet; when
+        a live chunk reveals such a gap, the row is read again until the
+        missing output is stored and sent from it. If that does not happen
+        within GAP_RELOADS reloads, FollowerOverflow is raised so the client
+        reconnects instead of receiving output with a hole in it.
+        Live events are buffered up to `follower_queue_size`; once the
+        consumer falls that far behind, the rest are dropped and
+        FollowerOverflow is raised at the next frame.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.follower_queue_size)
+        overflowed = False
+        command_id = str(command.id)
+        channel = command_channel(command_id)
+
+        async def on_event(event: dict) -> None:
+            nonlocal overflowed
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                overflowed = True
+
+        # Subscribe before reading the row so nothing published afterwards is missed
+        bus.subscribe(channel, on_event)
+        self.followers += 1
+        try:
+            sent_seq = 0
+            sent = {"stdout": 0, "stderr": 0}
+
+            def catch_up(row: CommandHistory, outputs: Dict[str, str]) -> List[dict]:
+                nonlocal sent_seq
+                frames = []
+                for name in OUTPUT_STREAMS:
+                    text = outputs[name]
+                    if len(text) > sent[name]:
+                        frames.append({
+                            "type": "command_output",
+                            "command_id": command_id,
+                            "seq": row.output_seq or 0,
+                            "stream": name,
+                            "data": text[sent[name]:],
+                            "catch_up": True,
+                        })
+                        sent[name] = len(text)
+                sent_seq = max(sent_seq, row.output_seq or 0)
+                return frames
+
+            for frame in catch_up(command, await _outputs(command)):
+                yield frame
+            if command.status in FINISHED_STATUSES:
+                yield _exit_frame(command, sent_seq + 1)
+                return
+
+            while True:
+                if overflowed:
+                    raise FollowerOverflow()
+                event = await queue.get()
+                if event["type"] == "command_exit":
+                    # Everything before the exit frame is stored by now
+                    if event["seq"] > sent_seq + 1:
+                        row = await _reload(command.id)
+                        if row is not None:
+                            for frame in catch_up(row, await _outputs(row)):
+                                yield frame
+                    yield event
+                    return
+                if event["seq"] <= sent_seq:
+                    continue
+                for _ in range(GAP_RELOADS):
+                    if event["seq"] <= sent_seq + 1:
+                        break
+                    await asyncio.sleep(self.flush_interval * 2)
+                    row = await _reload(command.id)
+                    if row is None:
+                        break
+                    for frame in catch_up(row, await _outputs(row)):
+                        yield frame
+                if event["seq"] <= sent_seq:
+                    continue
+                if event["seq"] > sent_seq + 1:
+                    # Skipping the chunks would shift every later catch-up offset
+                    raise FollowerOverflow()
+                sent_seq = event["seq"]
+                sent[event["stream"]] += len(event["data"])
+                yield event
+        finally:
+            bus.unsubscribe(channel, on_event)
+            self.followers -= 1
+
+    def stats(self) -> dict:
+        """Running commands and relay counters"""
+        return {
+            "running": len(self._streams),
+            "followers": self.followers,
+            "started": self.started,
+            "finished": self.finished,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "duplicates": self.duplicates,
+            "gaps": self.gaps,
+            "unknown": self.unknown,
+            "truncated": self.truncated,
+            "timeouts": self.timeouts,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+async def _reload(command_id: uuid.UUID) -> Optional[CommandHistory]:
+    async with AsyncSessionLocal() as db:
+        return await db.get(CommandHistory, command_id)
+
+
+async def _outputs(command: CommandHistory) -> Dict[str, str]:
+    """Full stdout/stderr of a row, including output moved to command_output_chunks"""
+    outputs = {name: getattr(command, name) or "" for name in OUTPUT_STREAMS}
+    chunked = [name for name in OUTPUT_STREAMS if getattr(command, f"{name}_size") is not None]
+    if chunked:
+        async with AsyncSessionLocal() as db:
+            for name in chunked:
+                raw, _ = await crud_command_history.read_command_output(db, command, name)
+                outputs[name] = raw.decode(errors="replace")
+    return outputs
+
+
+def _exit_frame(command: CommandHistory, seq: int) -> dict:
+    return {
+        "type": "command_exit",
+        "command_id": str(command.id),
+        "seq": seq,
+        "status": command.status.value,
+        "exit_code": command.exit_code,
+        "error": command.error_message,
+    }
+
+
+# Global command stream relay
+command_streams = CommandStreams(
+    flush_interval=settings.COMMAND_STREAM_FLUSH_INTERVAL_SECONDS,
+    max_output_bytes=settings.COMMAND_OUTPUT_MAX_BYTES,
+    timeout=settings.COMMAND_STREAM_TIMEOUT_SECONDS,
+    follower_queue_size=settings.WS_CLIENT_QUEUE_SIZE,
+)
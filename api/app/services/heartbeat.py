@@ -0,0 +1,131 @@
+"""In-memory agent liveness tracking with periodic write-back to servers.last_seen"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional, Union
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import server as crud_server
+
+
+class HeartbeatTracker:
+    """
+    Keep the last time each server was heard from in memory.
+
+    Every metrics frame only touches a dict entry; the accumulated timestamps
+    are written back to the `servers` table in one bulk UPDATE every
+    `flush_interval` seconds. Readers merge the in-memory value with the
+    database value so they always see the freshest timestamp.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+
+        # server_id -> last time a frame was received
+        self._last_seen: Dict[str, datetime] = {}
+        # server_id -> last_seen not yet written to the database
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_updated = 0
+        self.last_flush_ms = 0.0
+
+    def touch(self, server_id: Union[str, uuid.UUID], when: Optional[datetime] = None) -> None:
+        """Record that a server was just heard from"""
+        key = str(server_id)
+        when = when or datetime.now(timezone.utc)
+        self._last_seen[key] = when
+        self._pending[key] = when
+
+    def get_last_seen(self, server_id: Union[str, uuid.UUID]) -> Optional[datetime]:
+        """Get the in-memory last_seen for a server, if any"""
+        return self._last_seen.get(str(server_id))
+
+    def merge_last_seen(
+        self, server_id: Union[str, uuid.UUID], db_value: Optional[datetime]
+    ) -> Optional[datetime]:
+        """Return the fresher of the database value and the in-memory value"""
+        memory_value = self._last_seen.get(str(server_id))
+        if memory_value is None:
+            return db_value
+        if db_value is None:
+            return memory_value
+        if db_value.tzinfo is None:
+            db_value = db_value.replace(tzinfo=timezone.utc)
+        return max(db_value, memory_value)
+
+    def forget(self, server_id: Union[str, uuid.UUID]) -> None:
+        """Drop all state for a server (e.g. after it was deleted)"""
+        key = str(server_id)
+        self._last_seen.pop(key, None)
+        self._pending.pop(key, None)
+
+    def start(self) -> None:
+        """Start the periodic write-back task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the write-back task and write out pending timestamps"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing heartbeats on shutdown: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing heartbeats: {e}")
+
+    async def flush(self) -> int:
+        """Write pending last_seen values in one bulk UPDATE. Returns count of updated rows."""
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                updated = await crud_server.bulk_update_last_seen(
+                    db, {uuid.UUID(server_id): when for server_id, when in pending.items()}
+                )
+        except Exception:
+            self.failed_flushes += 1
+            # Keep the values for the next attempt unless a newer one arrived meanwhile
+            for server_id, when in pending.items():
+                self._pending.setdefault(server_id, when)
+            raise
+
+        self.flushes += 1
+        self.rows_updated += updated
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return updated
+
+    def stats(self) -> dict:
+        """Tracker size and write-back counters"""
+        return {
+            "tracked_servers": len(self._last_seen),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "rows_updated": self.rows_updated,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+
+# Global heartbeat tracker instance
+heartbeat_tracker = HeartbeatTracker(flush_interval=settings.HEARTBEAT_FLUSH_INTERVAL_SECONDS)
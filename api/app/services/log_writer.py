@@ -0,0 +1,345 @@
+"""Rate-capped write-behind batching for log lines received from agents"""
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import log_entry as crud_log_entry
+from app.models.log_entry import LogLevel, LogSource
+from app.services.ws_manager import ws_manager
+
+
+class TokenBucket:
+    """Allow `rate` items per second on average with bursts of up to `burst`"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, wanted: int) -> int:
+        """Consume up to `wanted` tokens. Returns how many were granted."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, str):
+        try:
+            timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            return timestamp
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+def _enum_value(enum_cls, value, default):
+    try:
+        return enum_cls(str(value).lower())
+    except ValueError:
+        return default
+
+
+def build_log_values(server_id: uuid.UUID, entry: dict, max_length: int) -> Optional[dict]:
+    """Normalise one log line from an agent into a log_entries row (None if unusable)"""
+    if not isinstance(entry, dict):
+        return None
+    message = entry.get("message")
+    if not isinstance(message, str) or not message:
+        return None
+
+    component = entry.get("component")
+    extra_data = entry.get("extra_data")
+    if extra_data is not None and not isinstance(extra_data, str):
+        extra_data = json.dumps(extra_data, default=str)
+    return {
+        "id": uuid.uuid4(),
+        "server_id": server_id,
+        "timestamp": _parse_timestamp(entry.get("timestamp")),
+        "level": _enum_value(LogLevel, entry.get("level", "info"), LogLevel.INFO),
+        "source": _enum_value(LogSource, entry.get("source", "agent"), LogSource.AGENT),
+        "message": message[:max_length],
+        "component": str(component)[:255] if component is not None else None,
+        "extra_data": extra_data[:max_length] if extra_data is not None else None,
+    }
+
+
+def log_row_to_payload(row: dict) -> dict:
+    """Dashboard frame data for a log row (same shape as LogEntryResponse)"""
+    return {
+        "id": str(row["id"]),
+        "server_id": str(row["server_id"]),
+        "timestamp": row["timestamp"].isoformat(),
+        "level": row["level"].value,
+        "source": row["source"].value,
+        "message": row["message"],
+        "component": row["component"],
+        "extra_data": row["extra_data"],
+    }
+
+
+class LogWriter:
+    """
+    Admit log lines from agents and persist them in multi-row batches.
+
+    Every server has a token bucket (`rate_per_server` lines per second,
+    bursts of `burst`); lines over the cap are dropped before they reach the
+    buffer or the dashboards. The buffer itself is bounded: when it is full,
+    new lines are rejected rather than evicting older ones, so `ingest`
+    always tells the caller exactly what was kept and the agent can back off.
+
+    Flushes happen when the buffer reaches `batch_size` or every
+    `flush_interval` seconds, whichever comes first.
+
+    Accepted lines are also pushed to dashboards by a separate publisher
+    task, one bus message per agent frame, so a large batch never holds up
+    the agent's receive loop. Rate-limit state is kept across reconnects and
+    dropped only once a bucket has been idle long enough to be full again.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        max_queue_size: int,
+        rate_per_server: float,
+        burst: int,
+        max_message_length: int,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.rate_per_server = rate_per_server
+        self.burst = burst
+        self.max_message_length = max_message_length
+
+        self._buffer: Deque[dict] = deque()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # (server_id, rows) waiting to be pushed to dashboards, bounded by max_queue_size lines
+        self._outbox: Deque[Tuple[str, List[dict]]] = deque()
+        self._outbox_lines = 0
+        self._outbox_ready = asyncio.Event()
+        self._publisher: Optional[asyncio.Task] = None
+
+        # Counters
+        self.received = 0
+        self.enqueued = 0
+        self.written = 0
+        self.invalid = 0
+        self.dropped_rate_limited = 0
+        self.dropped_queue_full = 0
+        self.dropped_by_server: Dict[str, int] = {}
+        self.dropped_broadcasts = 0
+        self.broadcasts = 0
+        self.failed_flushes = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of log lines waiting to be written"""
+        return len(self._buffer)
+
+    def ingest(self, server_id: str, entries: Iterable[dict]) -> Tuple[List[dict], int]:
+        """
+        Rate-limit, normalise and buffer log lines from one server (never blocks).
+        Returns the accepted rows and the number of lines dropped.
+        """
+        rows = []
+        server_uuid = uuid.UUID(server_id)
+        for entry in entries:
+            self.received += 1
+            row = build_log_values(server_uuid, entry, self.max_message_length)
+            if row is None:
+                self.invalid += 1
+            else:
+                rows.append(row)
+
+        bucket = self._buckets.get(server_id)
+        if bucket is None:
+            bucket = self._buckets[server_id] = TokenBucket(self.rate_per_server, self.burst)
+        allowed = bucket.take(len(rows))
+        rate_limited = len(rows) - allowed
+
+        room = max(0, self.max_queue_size - len(self._buffer))
+        accepted = rows[:min(allowed, room)]
+        queue_full = allowed - len(accepted)
+
+        self._buffer.extend(accepted)
+        self.enqueued += len(accepted)
+        dropped = rate_limited + queue_full
+        if dropped:
+            self.dropped_rate_limited += rate_limited
+            self.dropped_queue_full += queue_full
+            self.dropped_by_server[server_id] = self.dropped_by_server.get(server_id, 0) + dropped
+
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        if accepted:
+            if self._outbox_lines + len(accepted) > self.max_queue_size:
+                # Dashboards miss these lines; they are still stored
+                self.dropped_broadcasts += len(accepted)
+            else:
+                self._outbox.append((server_id, accepted))
+                self._outbox_lines += len(accepted)
+                self._outbox_ready.set()
+        return accepted, dropped
+
+    def prune_buckets(self) -> int:
+        """
+        Drop token buckets that have been idle long enough to refill
+        completely; a new bucket starts full, so nothing changes for the
+        server. Returns how many were dropped.
+        """
+        refill_seconds = self.burst / self.rate_per_server if self.rate_per_server > 0 else float("inf")
+        cutoff = time.monotonic() - refill_seconds
+        idle = [server_id for server_id, bucket in self._buckets.items() if bucket.updated < cutoff]
+        for server_id in idle:
+            del self._buckets[server_id]
+        return len(idle)
+
+    async def broadcast(self) -> int:
+        """Push queued lines to dashboard subscribers, one bus message per frame. Returns lines sent."""
+        sent = 0
+        while self._outbox:
+            server_id, rows = self._outbox.popleft()
+            self._outbox_lines -= len(rows)
+            try:
+                await ws_manager.send_logs(server_id, [log_row_to_payload(row) for row in rows])
+                self.broadcasts += 1
+                sent += len(rows)
+            except Exception as e:
+                print(f"Error broadcasting {len(rows)} log lines: {e}")
+        return sent
+
+    def start(self) -> None:
+        """Start the background flush and publisher tasks"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.create_task(self._publish())
+
+    async def stop(self) -> None:
+        """Stop the background tasks and write out everything still buffered"""
+        if self._publisher is not None:
+            self._publisher.cancel()
+            try:
+                await self._publisher
+            except asyncio.CancelledError:
+                pass
+        if self._task is not None:
+            # Not cancelled: a flush in progress holds a batch already taken off the buffer
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+        self._task = self._publisher = None
+        await self.flush()
+
+    async def _publish(self) -> None:
+        while True:
+            await self._outbox_ready.wait()
+            self._outbox_ready.clear()
+            await self.broadcast()
+
+    async def _run(self) -> None:
+        """Flush on size trigger or time trigger until stopped"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing log batch: {e}")
+            self.prune_buckets()
+
+    async def flush(self) -> int:
+        """Write all buffered log lines in batches of `batch_size`. Returns rows written."""
+        written = 0
+        async with self._flush_lock:
+            while self._buffer:
+                batch: List[dict] = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+
+                started = time.perf_counter()
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await crud_log_entry.create_log_entries_bulk(db, batch)
+                except Exception as e:
+                    self.failed_flushes += 1
+                    print(f"Error persisting log batch of {len(batch)}: {e}")
+                    # Retry on the next flush, keeping the buffer within its bound
+                    room = self.max_queue_size - len(self._buffer)
+                    if room < len(batch):
+                        self.dropped_queue_full += len(batch) - room
+                        batch = batch[len(batch) - room:] if room > 0 else []
+                    self._buffer.extendleft(reversed(batch))
+                    break
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.written += len(batch)
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                written += len(batch)
+        return written
+
+    def stats(self) -> dict:
+        """Queue depth, drop and flush counters"""
+        noisiest = sorted(self.dropped_by_server.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_max_size": self.max_queue_size,
+            "rate_per_server": self.rate_per_server,
+            "burst": self.burst,
+            "received": self.received,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "invalid": self.invalid,
+            "dropped_rate_limited": self.dropped_rate_limited,
+            "dropped_queue_full": self.dropped_queue_full,
+            "dropped_by_server": dict(noisiest),
+            "rate_limited_servers": len(self._buckets),
+            "broadcast_queue_depth": self._outbox_lines,
+            "broadcasts": self.broadcasts,
+            "dropped_broadcasts": self.dropped_broadcasts,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+
+# Global log writer instance
+log_writer = LogWriter(
+    batch_size=settings.LOG_BATCH_SIZE,
+    flush_interval=settings.LOG_FLUSH_INTERVAL_SECONDS,
+    max_queue_size=settings.LOG_QUEUE_MAX_SIZE,
+    rate_per_server=settings.LOG_INGEST_RATE_PER_SERVER,
+    burst=settings.LOG_INGEST_BURST,
+    max_message_length=settings.LOG_MAX_MESSAGE_LENGTH,
+)
@@ -0,0 +1,120 @@
+"""Daily partition maintenance and retention for the metrics table"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal, try_advisory_xact_lock
+from app.crud import metric as crud_metric
+from app.crud import inventory_snapshot as crud_snapshot
+
+# Advisory lock key so only one worker maintains partitions at a time
+RETENTION_LOCK_KEY = 0x6D65_7472_0100
+
+
+class MetricRetentionJob:
+    """
+    Keep daily metrics partitions created ahead of time and remove expired ones.
+
+    Runs once at startup (so today's and upcoming partitions exist before
+    samples arrive) and then every `interval` seconds. Expired data is
+    removed by dropping or detaching whole partitions, never row by row.
+    Container/process snapshots follow the same retention.
+    """
+
+    def __init__(self, interval: float, retention_days: int, premake_days: int, detach_only: bool):
+        self.interval = interval
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+        self.detach_only = detach_only
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.runs = 0
+        self.failed_runs = 0
+        self.skipped_locked = 0
+        self.partitions_created = 0
+        self.partitions_removed = 0
+        self.snapshots_removed = 0
+        self.last_removed: List[str] = []
+        self.last_run_ms = 0.0
+
+    def start(self) -> None:
+        """Start the periodic maintenance task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic maintenance task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failed_runs += 1
+                print(f"Error maintaining metrics partitions: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> None:
+        """Create upcoming partitions and remove expired ones"""
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            if not await try_advisory_xact_lock(db, RETENTION_LOCK_KEY):
+                self.skipped_locked += 1
+                return
+            # Start from yesterday so late samples around midnight still have a partition
+            yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+            created = await crud_metric.create_metric_partitions(db, yesterday, self.premake_days + 2)
+
+        async with AsyncSessionLocal() as db:
+            if not await try_advisory_xact_lock(db, RETENTION_LOCK_KEY):
+                self.skipped_locked += 1
+                return
+            removed = await crud_metric.drop_old_metric_partitions(
+                db, self.retention_days, detach_only=self.detach_only
+            )
+
+        async with AsyncSessionLocal() as db:
+            if not await try_advisory_xact_lock(db, RETENTION_LOCK_KEY):
+                self.skipped_locked += 1
+                return
+            self.snapshots_removed += await crud_snapshot.delete_old_snapshots(db, self.retention_days)
+
+        self.runs += 1
+        self.partitions_created += len(created)
+        self.partitions_removed += len(removed)
+        if removed:
+            self.last_removed = removed
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        """Run and partition counters"""
+        return {
+            "retention_days": self.retention_days,
+            "mode": "detach" if self.detach_only else "drop",
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "skipped_locked": self.skipped_locked,
+            "partitions_created": self.partitions_created,
+            "partitions_removed": self.partitions_removed,
+            "snapshots_removed": self.snapshots_removed,
+            "last_removed": self.last_removed,
+            "last_run_ms": round(self.last_run_ms, 3),
+        }
+
+
+# Global metric retention job instance
+metric_retention_job = MetricRetentionJob(
+    interval=settings.METRICS_RETENTION_INTERVAL_SECONDS,
+    retention_days=settings.METRICS_RETENTION_DAYS,
+    premake_days=settings.METRICS_PARTITION_PREMAKE_DAYS,
+    detach_only=settings.METRICS_RETENTION_MODE == "detach",
+)
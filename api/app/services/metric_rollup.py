@@ -0,0 +1,193 @@
+"""Background maintenance of metric rollups and rollup-aware history queries"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal, try_advisory_xact_lock
+from app.crud import metric as crud_metric
+from app.crud import metric_rollup as crud_rollup
+from app.crud.metric_rollup import ROLLUP_RESOLUTIONS
+
+# Advisory lock keys (one per resolution) so only one worker rolls up at a time
+ROLLUP_LOCK_BASE = 0x6D65_7472_0000
+# Raw rows folded per transaction while catching up
+ROLLUP_MAX_WINDOW = timedelta(hours=6)
+# Catch-up windows processed per resolution in one run
+ROLLUP_MAX_WINDOWS_PER_RUN = 10
+# How often expired rollup buckets are deleted
+RETENTION_INTERVAL_SECONDS = 3600.0
+
+RETENTION_DAYS = {
+    "1m": settings.METRICS_ROLLUP_RETENTION_DAYS_1M,
+    "5m": settings.METRICS_ROLLUP_RETENTION_DAYS_5M,
+    "1h": settings.METRICS_ROLLUP_RETENTION_DAYS_1H,
+}
+
+
+class MetricRollupJob:
+    """
+    Periodically fold new raw metrics into the 1m/5m/1h rollup tables.
+
+    Each resolution tracks a watermark on metrics.created_at, so a run only
+    reads rows inserted since the previous run. Runs on different workers
+    are serialised with Postgres advisory locks.
+    """
+
+    def __init__(self, interval: float, lag_seconds: float, lateness_seconds: float):
+        self.interval = interval
+        self.lag_seconds = lag_seconds
+        self.lateness_seconds = lateness_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._last_retention = 0.0
+
+        # Counters
+        self.runs = 0
+        self.failed_runs = 0
+        self.skipped_locked = 0
+        self.rows_expired = 0
+        self.last_run_ms = 0.0
+        self.watermarks: Dict[str, Optional[datetime]] = {name: None for name in ROLLUP_RESOLUTIONS}
+
+    def start(self) -> None:
+        """Start the periodic rollup task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic rollup task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failed_runs += 1
+                print(f"Error rolling up metrics: {e}")
+
+    async def run_once(self) -> None:
+        """Bring every resolution up to date and apply retention when due"""
+        started = time.perf_counter()
+        for index, resolution in enumerate(ROLLUP_RESOLUTIONS):
+            for _ in range(ROLLUP_MAX_WINDOWS_PER_RUN):
+                async with AsyncSessionLocal() as db:
+                    if not await try_advisory_xact_lock(db, ROLLUP_LOCK_BASE + index):
+                        self.skipped_locked += 1
+                        break
+                    watermark, caught_up = await crud_rollup.roll_up(
+                        db, resolution, self.lag_seconds, ROLLUP_MAX_WINDOW, self.lateness_seconds
+                    )
+                self.watermarks[resolution] = watermark
+                if caught_up:
+                    break
+
+        if time.monotonic() - self._last_retention >= RETENTION_INTERVAL_SECONDS:
+            self._last_retention = time.monotonic()
+            for resolution, days in RETENTION_DAYS.items():
+                async with AsyncSessionLocal() as db:
+                    self.rows_expired += await crud_rollup.delete_expired_rollups(db, resolution, days)
+
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        """Run counters and current watermarks"""
+        return {
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "skipped_locked": self.skipped_locked,
+            "rows_expired": self.rows_expired,
+            "last_run_ms": round(self.last_run_ms, 3),
+            "watermarks": {
+                name: watermark.isoformat() if watermark else None
+                for name, watermark in self.watermarks.items()
+            },
+        }
+
+
+def align_step(step_seconds: int) -> int:
+    """Round a computed step up to a multiple of the largest rollup width it spans"""
+    for _, bucket_seconds in reversed(list(ROLLUP_RESOLUTIONS.values())):
+        if step_seconds >= bucket_seconds:
+            return -(-step_seconds // bucket_seconds) * bucket_seconds
+    return step_seconds
+
+
+def choose_resolution(
+    step_seconds: int,
+    start_time: datetime,
+    watermarks: Dict[str, datetime],
+    now: Optional[datetime] = None,
+) -> Optional[str]:
+    """
+    Coarsest rollup whose bucket width divides the step, whose retention still
+    covers start_time and which has been populated. None means use raw rows.
+    """
+    now = now or datetime.now(timezone.utc)
+    for resolution in reversed(list(ROLLUP_RESOLUTIONS)):
+        _, bucket_seconds = ROLLUP_RESOLUTIONS[resolution]
+        if step_seconds % bucket_seconds:
+            continue
+        if start_time < now - timedelta(days=RETENTION_DAYS[resolution]):
+            continue
+        if watermarks.get(resolution) is None:
+            continue
+        return resolution
+    return None
+
+
+def _floor_to_step(value: datetime, step_seconds: int) -> datetime:
+    """Align a timestamp down to an epoch-aligned step boundary"""
+    epoch = int(value.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % step_seconds, timezone.utc)
+
+
+async def get_history_buckets(
+    db: AsyncSession,
+    server_id: uuid.UUID,
+    start_time: datetime,
+    end_time: datetime,
+    step_seconds: int,
+    fields: Sequence[str],
+) -> Tuple[str, List[dict]]:
+    """
+    Bucketed history from the coarsest suitable rollup, with buckets the
+    rollup may not fully cover yet filled in from raw rows. Returns (source, buckets).
+    """
+    complete_before = await crud_rollup.get_complete_before(db)
+    resolution = choose_resolution(step_seconds, start_time, complete_before)
+    if resolution is None:
+        return "raw", await crud_metric.get_metric_buckets(
+            db, server_id, start_time, end_time, step_seconds, fields
+        )
+
+    # Buckets that ended before complete_before are taken from the rollup
+    split = min(_floor_to_step(complete_before[resolution], step_seconds), end_time)
+    buckets = []
+    if split > start_time:
+        buckets += await crud_rollup.get_rollup_buckets(
+            db, resolution, server_id, start_time, split, step_seconds, fields
+        )
+    if split < end_time:
+        buckets += await crud_metric.get_metric_buckets(
+            db, server_id, max(split, start_time), end_time, step_seconds, fields
+        )
+    return f"rollup_{resolution}", buckets
+
+
+# Global metric rollup job instance
+metric_rollup_job = MetricRollupJob(
+    interval=settings.METRICS_ROLLUP_INTERVAL_SECONDS,
+    lag_seconds=settings.METRICS_ROLLUP_LAG_SECONDS,
+    lateness_seconds=settings.METRICS_ROLLUP_LATENESS_SECONDS,
+)
@@ -0,0 +1,189 @@
+"""Write-behind batching for metric samples received from agents"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Deque, List, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import metric as crud_metric
+from app.crud import inventory_snapshot as crud_snapshot
+from app.services.snapshot_store import snapshot_store
+
+
+class MetricWriter:
+    """
+    Buffer decoded metric samples in memory and persist them in multi-row batches.
+
+    Samples are flushed when the buffer reaches `batch_size` or every
+    `flush_interval` seconds, whichever comes first. The buffer is bounded:
+    when it is full the oldest sample is dropped and counted.
+
+    Container/process lists go through the snapshot store and are buffered
+    separately as keyframe/delta rows, written right after each metrics batch.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+
+        self._buffer: Deque[dict] = deque()
+        self._snapshots: Deque[dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.snapshots_written = 0
+        self.snapshots_dropped = 0
+        self.failed_flushes = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of samples waiting to be written"""
+        return len(self._buffer)
+
+    def enqueue(self, server_id: str, metrics: dict) -> None:
+        """Add a metrics sample to the write buffer (never blocks)"""
+        row = crud_metric.build_metric_values(uuid.UUID(server_id), metrics)
+        if len(self._buffer) >= self.max_queue_size:
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(row)
+        self.enqueued += 1
+
+        for snapshot in snapshot_store.record(row["server_id"], row["timestamp"], metrics):
+            if len(self._snapshots) >= self.max_queue_size:
+                self._drop_snapshot(self._snapshots.popleft())
+            self._snapshots.append(snapshot)
+
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _drop_snapshot(self, snapshot: dict) -> None:
+        """Account for a lost snapshot row; later deltas would not apply, so restart with a keyframe"""
+        self.snapshots_dropped += 1
+        snapshot_store.forget(snapshot["server_id"])
+
+    def start(self) -> None:
+        """Start the background flush task"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flush task and write out everything still buffered"""
+        if self._task is not None:
+            # Not cancelled: a flush in progress holds a batch already taken off the buffer
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        """Flush on size trigger or time trigger until stopped"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing metrics batch: {e}")
+
+    async def flush(self) -> int:
+        """Write all buffered samples in batches of `batch_size`. Returns rows written."""
+        written = 0
+        async with self._flush_lock:
+            while self._buffer:
+                batch: List[dict] = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+
+                started = time.perf_counter()
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await crud_metric.create_metrics_bulk(db, batch)
+                except Exception as e:
+                    self.failed_flushes += 1
+                    print(f"Error persisting metrics batch of {len(batch)}: {e}")
+                    # Put the batch back (oldest first) so the next flush retries it,
+                    # without letting the buffer grow past its bound
+                    room = self.max_queue_size - len(self._buffer)
+                    if room < len(batch):
+                        self.dropped += len(batch) - room
+                        batch = batch[len(batch) - room:] if room > 0 else []
+                    self._buffer.extendleft(reversed(batch))
+                    break
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.written += len(batch)
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self.total_flush_ms += elapsed_ms
+                written += len(batch)
+
+            await self._flush_snapshots()
+        return written
+
+    async def _flush_snapshots(self) -> None:
+        """Write buffered snapshot rows in batches of `batch_size`"""
+        while self._snapshots:
+            batch: List[dict] = []
+            while self._snapshots and len(batch) < self.batch_size:
+                batch.append(self._snapshots.popleft())
+            try:
+                async with AsyncSessionLocal() as db:
+                    await crud_snapshot.create_snapshots_bulk(db, batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Error persisting snapshot batch of {len(batch)}: {e}")
+                room = self.max_queue_size - len(self._snapshots)
+                if room < len(batch):
+                    for snapshot in batch[:len(batch) - room]:
+                        self._drop_snapshot(snapshot)
+                    batch = batch[len(batch) - room:] if room > 0 else []
+                self._snapshots.extendleft(reversed(batch))
+                break
+            self.snapshots_written += len(batch)
+
+    def stats(self) -> dict:
+        """Queue depth and flush latency counters"""
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_max_size": self.max_queue_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "snapshot_queue_depth": len(self._snapshots),
+            "snapshots_written": self.snapshots_written,
+            "snapshots_dropped": self.snapshots_dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+# Global metric writer instance
+metric_writer = MetricWriter(
+    batch_size=settings.METRICS_BATCH_SIZE,
+    flush_interval=settings.METRICS_FLUSH_INTERVAL_SECONDS,
+    max_queue_size=settings.METRICS_QUEUE_MAX_SIZE,
+)
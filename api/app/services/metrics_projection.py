@@ -0,0 +1,108 @@
+"""Field projections and delta encoding of metrics frames pushed to dashboards"""
+import re
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+# Dotted path of a metrics field, e.g. "cpu.usage_percent" or "containers"
+FIELD_PATH = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+MAX_FIELDS = 64
+
+Flat = Dict[str, Any]
+
+
+class Projection(NamedTuple):
+    """What a subscriber wants from each metrics frame"""
+    # Dotted paths to include (None = everything)
+    fields: Optional[Tuple[str, ...]]
+    # Send only fields that changed after the first frame
+    delta: bool
+    # Numeric changes up to this size are not sent in deltas
+    epsilon: float
+    # Minimum seconds between frames (0 = every sample); newer samples replace held ones
+    min_interval: float = 0.0
+
+
+def parse_fields(fields: Iterable[str]) -> Tuple[str, ...]:
+    """Validate requested field paths. Raises ValueError."""
+    paths = tuple(sorted(set(fields)))
+    if len(paths) > MAX_FIELDS:
+        raise ValueError(f"At most {MAX_FIELDS} fields")
+    invalid = [p for p in paths if not isinstance(p, str) or not FIELD_PATH.match(p)]
+    if invalid:
+        raise ValueError(f"Invalid fields: {', '.join(map(str, invalid))}")
+    return paths
+
+
+def flatten(data: dict, prefix: str = "") -> Flat:
+    """Nested dicts as {dotted path: leaf}; lists and scalars are leaves"""
+    flat: Flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def unflatten(flat: Flat) -> dict:
+    """Inverse of flatten"""
+    data: dict = {}
+    for path, value in flat.items():
+        *parents, leaf = path.split(".")
+        node = data
+        for key in parents:
+            node = node.setdefault(key, {})
+        node[leaf] = value
+    return data
+
+
+def project(metrics: dict, fields: Optional[Tuple[str, ...]]) -> Flat:
+    """Flattened subset of a metrics payload; missing paths are skipped"""
+    if fields is None:
+        return flatten(metrics)
+    flat: Flat = {}
+    for path in fields:
+        value: Any = metrics
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            if isinstance(value, dict):
+                flat.update(flatten(value, f"{path}."))
+            else:
+                flat[path] = value
+    return flat
+
+
+def _changed(old: Any, new: Any, epsilon: float) -> bool:
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)) \
+            and not isinstance(old, bool) and not isinstance(new, bool):
+        return abs(new - old) > epsilon
+    return old != new
+
+
+class DeltaEncoder:
+    """
+    Track the values last sent for one (server, projection) and compute what
+    changed. A field's baseline only moves when a change is sent, so slow
+    drift is still reported once it exceeds epsilon.
+    """
+
+    __slots__ = ("epsilon", "state")
+
+    def __init__(self, epsilon: float):
+        self.epsilon = epsilon
+        self.state: Flat = {}
+
+    def update(self, flat: Flat) -> Flat:
+        """Fields of `flat` that changed beyond epsilon (removed fields map to None)"""
+        changes = {
+            path: value for path, value in flat.items()
+            if path not in self.state or _changed(self.state[path], value, self.epsilon)
+        }
+        for path in self.state.keys() - flat.keys():
+            if self.state[path] is not None:
+                changes[path] = None
+        self.state.update(changes)
+        return changes
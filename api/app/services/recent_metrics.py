@@ -0,0 +1,188 @@
+"""In-memory ring buffers of recent numeric samples per server"""
+import math
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+from app.core.config import settings
+from app.models.metric import SERIES_FIELDS
+
+# Series field -> (payload section, key), e.g. cpu_usage_percent -> ("cpu", "usage_percent")
+FIELD_PATHS = {field: tuple(field.split("_", 1)) for field in SERIES_FIELDS}
+
+NAN = float("nan")
+
+
+def _to_epoch(value) -> Optional[float]:
+    """Agent timestamp (datetime or ISO string) as Unix seconds; naive means UTC"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class RecentSeries:
+    """
+    Fixed-capacity ring of samples for one server.
+
+    Timestamps and every series field live in preallocated `array('d')`
+    columns, so memory is (1 + fields) * 8 bytes * capacity regardless of
+    traffic. Missing values are stored as NaN.
+    """
+
+    __slots__ = ("capacity", "timestamps", "columns", "head", "size", "covers_from")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.columns = {field: array("d", bytes(8 * capacity)) for field in SERIES_FIELDS}
+        # Next write position and number of valid samples
+        self.head = 0
+        self.size = 0
+        # Samples are complete from this time on (first sample, or the newest evicted one)
+        self.covers_from: Optional[float] = None
+
+    def append(self, timestamp: float, metrics: dict) -> bool:
+        """Append a sample; out-of-order samples are ignored. Returns whether it was stored."""
+        if self.size and timestamp < self.timestamps[(self.head - 1) % self.capacity]:
+            return False
+        if self.covers_from is None:
+            self.covers_from = timestamp
+        elif self.size == self.capacity:
+            # Overwriting the oldest sample: only later times are still complete
+            self.covers_from = math.nextafter(self.timestamps[self.head], math.inf)
+
+        self.timestamps[self.head] = timestamp
+        for field, (section, key) in FIELD_PATHS.items():
+            value = (metrics.get(section) or {}).get(key)
+            self.columns[field][self.head] = float(value) if isinstance(value, (int, float)) else NAN
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return True
+
+    def _ordered(self, column: array) -> array:
+        """A column in time order (at most two slice copies)"""
+        if self.size < self.capacity:
+            return column[:self.size]
+        return column[self.head:] + column[:self.head]
+
+    def buckets(self, start: float, end: float, step_seconds: int, fields: Sequence[str]) -> List[dict]:
+        """Samples in [start, end) aggregated into epoch-aligned buckets (same shape as crud)"""
+        timestamps = self._ordered(self.timestamps)
+        lo = bisect_left(timestamps, start)
+        hi = bisect_left(timestamps, end)
+        if lo >= hi:
+            return []
+        timestamps = timestamps[lo:hi]
+        columns = {field: self._ordered(self.columns[field])[lo:hi] for field in fields}
+
+        # Bucket boundaries: indices where the epoch-aligned bucket changes
+        keys = [int(ts // step_seconds) for ts in timestamps]
+        bounds = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]] + [len(keys)]
+
+        result = []
+        for a, b in zip(bounds, bounds[1:]):
+            point = {
+                "timestamp": datetime.fromtimestamp(keys[a] * step_seconds, timezone.utc).isoformat(),
+                "count": b - a,
+            }
+            for field in fields:
+                values = [v for v in columns[field][a:b] if not math.isnan(v)]
+                point[field] = {
+                    "avg": math.fsum(values) / len(values) if values else None,
+                    "min": min(values) if values else None,
+                    "max": max(values) if values else None,
+                    "last": values[-1] if values else None,
+                }
+            result.append(point)
+        return result
+
+
+class RecentMetrics:
+    """
+    Recent samples of the servers whose agents are connected to this worker.
+
+    Each server gets a RecentSeries of `capacity` samples (the agent's
+    default 5 s interval makes 900 samples 75 minutes). History requests whose
+    whole range is covered are answered from memory instead of Postgres.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._series: Dict[str, RecentSeries] = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.out_of_order = 0
+
+    def append(self, server_id: str, metrics: dict) -> None:
+        """Record a metrics sample (agent payload shape)"""
+        timestamp = _to_epoch(metrics.get("timestamp"))
+        if timestamp is None:
+            return
+        series = self._series.get(server_id)
+        if series is None:
+            series = self._series[server_id] = RecentSeries(self.capacity)
+        if not series.append(timestamp, metrics):
+            self.out_of_order += 1
+
+    def has(self, server_id: str) -> bool:
+        """Whether a buffer exists for the server"""
+        return server_id in self._series
+
+    def restore(self, server_id: str, covers_from: datetime, samples: Sequence[tuple]) -> None:
+        """
+        Replace a server's buffer with stored samples: (timestamp, {field: value})
+        in time order, complete from `covers_from` on.
+        """
+        series = self._series[server_id] = RecentSeries(self.capacity)
+        series.covers_from = covers_from.timestamp()
+        for timestamp, values in samples:
+            nested: Dict[str, dict] = {}
+            for field, value in values.items():
+                section, key = FIELD_PATHS[field]
+                nested.setdefault(section, {})[key] = value
+            series.append(timestamp.timestamp(), nested)
+
+    def forget(self, server_id: str) -> None:
+        """Drop a server's buffer (its agent disconnected, so later samples may have gaps)"""
+        self._series.pop(server_id, None)
+
+    def get_buckets(
+        self,
+        server_id: str,
+        start_time: datetime,
+        end_time: datetime,
+        step_seconds: int,
+        fields: Sequence[str],
+    ) -> Optional[List[dict]]:
+        """Buckets for the range if this worker holds every sample in it, else None"""
+        series = self._series.get(server_id)
+        start = start_time.timestamp()
+        if series is None or series.covers_from is None or start < series.covers_from:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return series.buckets(start, end_time.timestamp(), step_seconds, fields)
+
+    def stats(self) -> dict:
+        """Buffer sizes and hit counters"""
+        return {
+            "servers": len(self._series),
+            "capacity": self.capacity,
+            "bytes_per_server": (1 + len(SERIES_FIELDS)) * 8 * self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "out_of_order": self.out_of_order,
+        }
+
+
+# Global recent metrics instance
+recent_metrics = RecentMetrics(capacity=settings.RECENT_METRICS_SAMPLES)
@@ -0,0 +1,46 @@
+"""Cached server ownership checks for request handlers"""
+from typing import List
+import uuid
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.crud import server as crud_server
+from app.services.bus import bus
+
+# (user id, server id) -> whether the user owns the server
+server_owner_cache = TTLCache(ttl_seconds=settings.SERVER_OWNER_CACHE_TTL_SECONDS)
+bus.on_invalidate(
+    "server_owner",
+    lambda server_id: server_owner_cache.delete_where(lambda key, _: key[1] == server_id),
+)
+
+
+async def user_owns_server(db: AsyncSession, server_id: uuid.UUID, user_id: uuid.UUID) -> bool:
+    """Ownership check for request handlers, cached for SERVER_OWNER_CACHE_TTL_SECONDS"""
+    key = (str(user_id), str(server_id))
+    owned = server_owner_cache.get(key)
+    if owned is None:
+        owned = server_id in await crud_server.filter_owned_server_ids(db, user_id, [server_id])
+        server_owner_cache.set(key, owned)
+    return owned
+
+
+async def get_owned_server_ids(
+    db: AsyncSession, user_id: uuid.UUID, server_ids: List[uuid.UUID]
+) -> List[uuid.UUID]:
+    """Which of `server_ids` belong to the user; cache misses are resolved in one query"""
+    owned: List[uuid.UUID] = []
+    unknown: List[uuid.UUID] = []
+    for server_id in server_ids:
+        cached = server_owner_cache.get((str(user_id), str(server_id)))
+        if cached is None:
+            unknown.append(server_id)
+        elif cached:
+            owned.append(server_id)
+    if not unknown:
+        return owned
+    
+    found = await crud_server.filter_owned_server_ids(db, user_id, unknown)
+    for server_id in unknown:
+        server_owner_cache.set((str(user_id), str(server_id)), server_id in found)
+    return owned + [server_id for server_id in unknown if server_id in found]
@@ -0,0 +1,148 @@
+"""Keyframe + delta encoding of container and process snapshots"""
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.models.inventory_snapshot import SnapshotKind
+from app.crud.inventory_snapshot import ITEM_KEYS, State, apply_delta, index_items
+
+# Fields that change on nearly every sample. Numeric ones are compared with a
+# tolerance; string ones (e.g. "Up 3 hours") are only refreshed on keyframes.
+VOLATILE_NUMERIC_FIELDS = {
+    SnapshotKind.PROCESSES.value: ("cpu", "memory"),
+}
+VOLATILE_TEXT_FIELDS = {
+    SnapshotKind.CONTAINERS.value: ("status",),
+}
+
+
+def item_changed(kind: str, old: dict, new: dict, tolerance: float) -> bool:
+    """Whether `new` differs from `old` beyond volatile-field noise"""
+    numeric = VOLATILE_NUMERIC_FIELDS.get(kind, ())
+    text = VOLATILE_TEXT_FIELDS.get(kind, ())
+    for field in old.keys() | new.keys():
+        a, b = old.get(field), new.get(field)
+        if a == b or field in text:
+            continue
+        if field in numeric and isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if abs(a - b) <= tolerance:
+                continue
+        return True
+    return False
+
+
+def diff_states(kind: str, old: State, new: State, tolerance: float) -> Optional[dict]:
+    """Delta turning `old` into `new`, or None if nothing meaningful changed"""
+    upsert = [item for key, item in new.items() if key not in old or item_changed(kind, old[key], item, tolerance)]
+    remove = [key for key in old if key not in new]
+    if not upsert and not remove:
+        return None
+    return {"upsert": upsert, "remove": remove}
+
+
+class _Stream:
+    """Encoder state for one server and kind"""
+
+    __slots__ = ("state", "keyframe_at", "deltas")
+
+    def __init__(self):
+        # State as last written (what a reader would rebuild)
+        self.state: Optional[State] = None
+        self.keyframe_at: Optional[datetime] = None
+        self.deltas = 0
+
+
+class SnapshotStore:
+    """
+    Decide what to persist for each container/process snapshot.
+
+    A full keyframe is written for the first sample of a server, every
+    `keyframe_interval` seconds and after `max_deltas` deltas; otherwise only
+    a delta is written, and nothing at all when the set did not change.
+    """
+
+    def __init__(self, keyframe_interval: float, max_deltas: int, tolerance: float):
+        self.keyframe_interval = keyframe_interval
+        self.max_deltas = max_deltas
+        self.tolerance = tolerance
+        # (server_id, kind) -> _Stream
+        self._streams: Dict[Tuple[str, str], _Stream] = {}
+
+        # Counters
+        self.samples = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.unchanged = 0
+
+    def record(self, server_id: uuid.UUID, timestamp: datetime, metrics: dict) -> List[dict]:
+        """Encode the containers/processes of a metrics sample. Returns rows to insert."""
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        rows = []
+        for kind in ITEM_KEYS:
+            items = metrics.get(kind)
+            if items is None:
+                continue
+            self.samples += 1
+            row = self._encode(server_id, kind, timestamp, index_items(kind, items or []))
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def _encode(self, server_id: uuid.UUID, kind: str, timestamp: datetime, new: State) -> Optional[dict]:
+        stream = self._streams.setdefault((str(server_id), kind), _Stream())
+
+        keyframe_due = (
+            stream.state is None
+            or stream.deltas >= self.max_deltas
+            or (timestamp - stream.keyframe_at).total_seconds() >= self.keyframe_interval
+        )
+        if keyframe_due:
+            stream.state = new
+            stream.keyframe_at = timestamp
+            stream.deltas = 0
+            self.keyframes += 1
+            return self._row(server_id, kind, timestamp, True, list(new.values()))
+
+        delta = diff_states(kind, stream.state, new, self.tolerance)
+        if delta is None:
+            self.unchanged += 1
+            return None
+        stream.state = apply_delta(kind, stream.state, delta)
+        stream.deltas += 1
+        self.deltas += 1
+        return self._row(server_id, kind, timestamp, False, delta)
+
+    @staticmethod
+    def _row(server_id: uuid.UUID, kind: str, timestamp: datetime, is_keyframe: bool, data) -> dict:
+        return {
+            "id": uuid.uuid4(),
+            "server_id": server_id,
+            "kind": kind,
+            "timestamp": timestamp,
+            "is_keyframe": is_keyframe,
+            "data": data,
+        }
+
+    def forget(self, server_id) -> None:
+        """Drop encoder state for a server so its next sample writes a keyframe"""
+        for kind in ITEM_KEYS:
+            self._streams.pop((str(server_id), kind), None)
+
+    def stats(self) -> dict:
+        """Encoding counters"""
+        return {
+            "streams": len(self._streams),
+            "samples": self.samples,
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "unchanged": self.unchanged,
+        }
+
+
+# Global snapshot store instance
+snapshot_store = SnapshotStore(
+    keyframe_interval=settings.SNAPSHOT_KEYFRAME_INTERVAL_SECONDS,
+    max_deltas=settings.SNAPSHOT_MAX_DELTAS_PER_KEYFRAME,
+    tolerance=settings.SNAPSHOT_PROCESS_TOLERANCE,
+)
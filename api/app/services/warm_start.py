@@ -0,0 +1,96 @@
+"""Reload in-memory metrics state from the database when the API starts"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+from app.crud import metric as crud_metric
+from app.crud import inventory_snapshot as crud_snapshot
+from app.models.metric import SERIES_FIELDS
+from app.services.bus import bus
+from app.services.recent_metrics import recent_metrics
+
+
+class WarmStart:
+    """
+    Fill the latest-metrics cache (and the recent-history buffers) before
+    agents reconnect, so the first requests after a restart are answered
+    from memory.
+
+    Only done with a single worker: with a distributed bus an agent may
+    reconnect to another worker, and warm entries here would go stale.
+    """
+
+    def __init__(self, max_age: timedelta, history: bool, history_window: timedelta):
+        self.max_age = max_age
+        self.history = history
+        self.history_window = history_window
+
+        # Results of the last run
+        self.servers_loaded = 0
+        self.samples_loaded = 0
+        self.duration_ms = 0.0
+        self.skipped_reason: Optional[str] = None
+
+    async def run(self, metrics_cache: Dict[str, dict]) -> None:
+        """Load the latest sample of every recently active server into `metrics_cache`"""
+        if bus.distributed:
+            self.skipped_reason = "distributed bus"
+            return
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+
+        async with AsyncSessionLocal() as db:
+            states = await crud_snapshot.get_latest_states(db, now - self.max_age)
+            async for metric in crud_metric.stream_latest_metrics(db, now - self.max_age):
+                server_id = str(metric.server_id)
+                # A live sample may already have arrived
+                if server_id in metrics_cache:
+                    continue
+                payload = crud_metric.metric_to_payload(metric)
+                if metric.extra_data is None:
+                    for kind in crud_snapshot.ITEM_KEYS:
+                        payload[kind] = states.get((metric.server_id, kind), [])
+                metrics_cache[server_id] = payload
+                self.servers_loaded += 1
+
+        if self.history:
+            await self._load_history(now - self.history_window)
+        self.duration_ms = (time.perf_counter() - started) * 1000
+
+    async def _load_history(self, since: datetime) -> None:
+        """Backfill the recent-history ring buffers with one streamed query"""
+        current: Optional[str] = None
+        samples: List[tuple] = []
+        async with AsyncSessionLocal() as db:
+            async for server_id, timestamp, *values in crud_metric.stream_recent_series(db, since):
+                server_id = str(server_id)
+                if server_id != current:
+                    self._restore(current, since, samples)
+                    current, samples = server_id, []
+                samples.append((timestamp, dict(zip(SERIES_FIELDS, values))))
+                self.samples_loaded += 1
+        self._restore(current, since, samples)
+
+    @staticmethod
+    def _restore(server_id: Optional[str], since: datetime, samples: List[tuple]) -> None:
+        # Skip servers whose agent already reconnected and started a live buffer
+        if server_id is not None and not recent_metrics.has(server_id):
+            recent_metrics.restore(server_id, since, samples)
+
+    def stats(self) -> dict:
+        """Results of the startup load"""
+        return {
+            "servers_loaded": self.servers_loaded,
+            "samples_loaded": self.samples_loaded,
+            "duration_ms": round(self.duration_ms, 3),
+            "skipped_reason": self.skipped_reason,
+        }
+
+
+# Global warm start instance
+warm_start = WarmStart(
+    max_age=timedelta(hours=settings.METRICS_WARM_START_MAX_AGE_HOURS),
+    history=settings.METRICS_WARM_START_HISTORY,
+    history_window=timedelta(minutes=settings.METRICS_WARM_START_HISTORY_MINUTES),
+)
@@ -1,75 +1,450 @@
-from typing import Dict, Set
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from collections import deque
 from fastapi import WebSocket
+import asyncio
 import json
+import time
 from datetime import datetime
 import uuid
+from app.core.config import settings
+from app.services.bus import bus, stream_channel
+from app.core.timer_wheel import TimerWheel
+from app.services.metrics_projection import DeltaEncoder, Projection, project, unflatten
 
+# Close code sent to clients evicted for falling behind ("try again later")
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+
+class ClientConnection:
+    """
+    One dashboard WebSocket with its own outbound queue and writer task.
+
+    Broadcasts only enqueue, so a slow client never delays the others. Only
+    the newest pending metrics frame per server is kept (older ones are
+    stale); other frames queue in order. A client whose queue overflows, or
+    whose send does not complete within `send_timeout`, is disconnected.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int, send_timeout: float, on_evict):
+        self.websocket = websocket
+        # server_id -> Subscription (maintained by ConnectionManager)
+        self.subscriptions: Dict[str, "Subscription"] = {}
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self._on_evict = on_evict
+
+        # conflation key -> newest pending frame (dicts keep insertion order)
+        self._pending: Dict[str, str] = {}
+        self._queue: Deque[str] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Counters
+        self.sent = 0
+        self.conflated = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames waiting to be sent"""
+        return len(self._queue) + len(self._pending)
+
+    def start(self) -> None:
+        """Start the writer task"""
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        """Stop the writer task (pending frames are discarded)"""
+        self.closed = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def send(self, text: str, conflate_key: Optional[str] = None) -> bool:
+        """
+        Queue a frame (never blocks). A frame with a `conflate_key` replaces a
+        pending frame with the same key. Returns False if the client was evicted.
+        """
+        if self.closed:
+            return False
+        if conflate_key is not None:
+            if self._pending.pop(conflate_key, None) is not None:
+                self.conflated += 1
+            self._pending[conflate_key] = text
+        elif len(self._queue) >= self.max_queue:
+            self._evict("send queue full")
+            return False
+        else:
+            self._queue.append(text)
+        self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        while not self.closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while not self.closed:
+                if self._pending:
+                    text = self._pending.pop(next(iter(self._pending)))
+                elif self._queue:
+                    text = self._queue.popleft()
+                else:
+                    break
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(text), timeout=self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict("send timed out")
+                    return
+                except Exception:
+                    # The connection is gone; the endpoint will see the disconnect
+                    self._on_evict(self, None)
+                    return
+                self.sent += 1
+
+    def _evict(self, reason: str) -> None:
+        self._on_evict(self, reason)
+        asyncio.create_task(self._close(reason))
+
+    async def _close(self, reason: str) -> None:
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE, reason=f"Client too slow: {reason}"),
+                timeout=self.send_timeout,
+            )
+        except Exception:
+            pass
+
+
+# Dashboard topics and the stream event types they carry
+TOPICS = {"metrics": "metrics", "log": "logs", "log_batch": "logs"}
+ALL_TOPICS = frozenset(TOPICS.values())
+
+
+class Subscription:
+    """Topics and metrics projection of one client for one server"""
+
+    __slots__ = ("topics", "projection", "needs_full")
+
+    def __init__(self, topics: Set[str], projection: Optional[Projection]):
+        self.topics = topics
+        self.projection = projection
+        # Delta subscribers get one full frame before their first delta
+        self.needs_full = True
+
+
+class _Throttle:
+    """Rate-limit state of one (server, projection) group"""
+
+    __slots__ = ("last_sent", "held", "scheduled")
 
-class ConnectionManager:
-    """Manage WebSocket connections"""
-    
     def __init__(self):
-        # server_id -> Set[WebSocket]
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, server_id: str):
-        """Register a WebSocket connection (WebSocket should already be accepted)"""
+        self.last_sent = float("-inf")
+        # Newest (metrics, timestamp) not yet sent
+        self.held: Optional[tuple] = None
+        self.scheduled = False
+
+
+class ConnectionManager:
+    """
+    Manage WebSocket connections.
+
+    Events are published on the message bus so dashboards connected to any
+    worker receive them; each worker subscribes to a server's stream channel
+    while at least one local client subscribes to that server. A client can
+    subscribe to any number of (server, topic) pairs. Each event is
+    serialised once and handed to every subscribed client's queue.
+
+    Subscribers that set a maximum update rate are grouped by projection;
+    within each interval only the newest sample is kept, and held samples
+    are released by one shared timer wheel.
+    """
+
+    def __init__(
+        self,
+        max_queue: int,
+        send_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+        autorun_timers: bool = True,
+    ):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        # Time source for rate limits (tests inject a fake one)
+        self._clock = clock
+        # server_id -> {ClientConnection: Subscription}
+        self.active_connections: Dict[str, Dict[ClientConnection, Subscription]] = {}
+        self._clients: Dict[WebSocket, ClientConnection] = {}
+        # (server_id, projection) -> encoder shared by that projection's delta subscribers
+        self._encoders: Dict[Tuple[str, Projection], DeltaEncoder] = {}
+        # (server_id, projection) -> throttle of rate-limited groups
+        self._throttles: Dict[Tuple[str, Projection], _Throttle] = {}
+        self._wheel = TimerWheel(tick=0.05, slots=256, callback=self._release_held, autorun=autorun_timers)
+
+        # Counters
+        self.broadcasts = 0
+        self.frames_queued = 0
+        self.bytes_queued = 0
+        self.encodings = 0
+        self.conflated = 0
+        self.evicted = 0
+        self.broadcast_ms = 0.0
+
+    def open(self, websocket: WebSocket) -> ClientConnection:
+        """Start the writer for an accepted WebSocket (no subscriptions yet)"""
+        client = ClientConnection(websocket, self.max_queue, self.send_timeout, self._on_evict)
+        self._clients[websocket] = client
+        client.start()
+        return client
+
+    def close(self, client: ClientConnection) -> None:
+        """Drop every subscription of a client and stop its writer"""
+        for server_id in list(client.subscriptions):
+            self.unsubscribe(client, server_id)
+        self._clients.pop(client.websocket, None)
+        client.stop()
+
+    def subscribe(
+        self,
+        client: ClientConnection,
+        server_id: str,
+        topics: Iterable[str] = ALL_TOPICS,
+        projection: Optional[Projection] = None,
+        replace_projection: bool = True,
+    ) -> None:
+        """
+        Deliver a server's events for `topics` to a client. A projection
+        replaces the client's previous one for that server unless
+        `replace_projection` is False (e.g. a subscribe that only adds topics).
+        """
         if server_id not in self.active_connections:
-            self.active_connections[server_id] = set()
-        self.active_connections[server_id].add(websocket)
-    
-    def disconnect(self, websocket: WebSocket, server_id: str):
+            self.active_connections[server_id] = {}
+            bus.subscribe(stream_channel(server_id), self._on_stream_event)
+        subscription = self.active_connections[server_id].get(client)
+        if subscription is None:
+            subscription = Subscription(set(), projection)
+            self.active_connections[server_id][client] = subscription
+            client.subscriptions[server_id] = subscription
+        elif replace_projection and projection != subscription.projection:
+            subscription.projection = projection
+            subscription.needs_full = True
+            self._prune_encoders(server_id)
+        subscription.topics.update(topics)
+
+    def unsubscribe(self, client: ClientConnection, server_id: str, topics: Iterable[str] = ALL_TOPICS) -> None:
+        """Stop delivering a server's events for `topics` to a client"""
+        clients = self.active_connections.get(server_id)
+        if not clients or client not in clients:
+            return
+        clients[client].topics.difference_update(topics)
+        if not clients[client].topics:
+            del clients[client]
+            client.subscriptions.pop(server_id, None)
+            self._prune_encoders(server_id)
+        if not clients:
+            del self.active_connections[server_id]
+            bus.unsubscribe(stream_channel(server_id), self._on_stream_event)
+
+    def _prune_encoders(self, server_id: str) -> None:
+        """Drop delta encoders and throttles no subscriber of the server uses any more"""
+        used = {sub.projection for sub in self.active_connections.get(server_id, {}).values()}
+        for key in [k for k in self._encoders if k[0] == server_id and k[1] not in used]:
+            del self._encoders[key]
+        for key in [k for k in self._throttles if k[0] == server_id and k[1] not in used]:
+            del self._throttles[key]
+
+    async def connect(self, websocket: WebSocket, server_id: str) -> ClientConnection:
+        """Register a WebSocket for every topic of one server (WebSocket should already be accepted)"""
+        client = self.open(websocket)
+        self.subscribe(client, server_id)
+        return client
+
+    def disconnect(self, websocket: WebSocket, server_id: Optional[str] = None):
         """Remove a WebSocket connection"""
-        if server_id in self.active_connections:
-            self.active_connections[server_id].discard(websocket)
-            if not self.active_connections[server_id]:
-                del self.active_connections[server_id]
-    
+        client = self._clients.get(websocket)
+        if client is not None:
+            self.close(client)
+
+    def _on_evict(self, client: ClientConnection, reason: Optional[str]) -> None:
+        """A client fell behind (reason set) or its connection failed"""
+        if reason is not None:
+            self.evicted += 1
+            print(f"Disconnecting slow dashboard client ({len(client.subscriptions)} servers): {reason}")
+        self.close(client)
+
     async def send_metrics(self, server_id: str, metrics: dict):
         """Send metrics to all connected clients for a server"""
-        if server_id not in self.active_connections:
-            return
-        
-        message = json.dumps({
+        await bus.publish(stream_channel(server_id), {
+            "server_id": server_id,
             "type": "metrics",
             "data": metrics,
-            "timestamp": datetime.utcnow().isoformat(),
         })
-        
-        disconnected = set()
-        for connection in self.active_connections[server_id]:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                disconnected.add(connection)
-        
-        # Remove disconnected connections
-        for connection in disconnected:
-            self.disconnect(connection, server_id)
-    
+
     async def send_log(self, server_id: str, log_entry: dict):
         """Send a log entry to all connected clients for a server"""
-        if server_id not in self.active_connections:
-            return
-        
-        message = json.dumps({
+        await bus.publish(stream_channel(server_id), {
+            "server_id": server_id,
             "type": "log",
             "data": log_entry,
-            "timestamp": datetime.utcnow().isoformat(),
         })
-        
-        disconnected = set()
-        for connection in self.active_connections[server_id]:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                disconnected.add(connection)
-        
-        # Remove disconnected connections
-        for connection in disconnected:
-            self.disconnect(connection, server_id)
 
+    async def send_logs(self, server_id: str, log_entries: List[dict]):
+        """Send several log entries of one server in a single bus message (clients get one frame per entry)"""
+        await bus.publish(stream_channel(server_id), {
+            "server_id": server_id,
+            "type": "log_batch",
+            "data": log_entries,
+        })
 
-# Global WebSocket manager instance
-ws_manager = ConnectionManager()
+    def _encode(self, event_type: str, server_id: str, data, timestamp: str) -> str:
+        self.encodings += 1
+        # server_id lets multiplexed clients tell servers apart
+        return json.dumps({
+            "type": event_type,
+            "server_id": server_id,
+            "data": data,
+            "timestamp": timestamp,
+        })
+
+    def _queue(self, client: ClientConnection, message: str, conflate_key: Optional[str]) -> None:
+        if client.send(message, conflate_key=conflate_key):
+            self.frames_queued += 1
+            self.bytes_queued += len(message)
 
+    async def _on_stream_event(self, event: dict):
+        """Deliver a stream event from the bus to this worker's clients"""
+        server_id = event["server_id"]
+        if server_id not in self.active_connections:
+            return
+
+        started = time.perf_counter()
+        timestamp = datetime.utcnow().isoformat()
+        topic = TOPICS.get(event["type"])
+        subscribers = [
+            (client, sub) for client, sub in self.active_connections[server_id].items()
+            if topic is None or topic in sub.topics
+        ]
+
+        if event["type"] == "log_batch":
+            for entry in event["data"]:
+                message = self._encode("log", server_id, entry, timestamp)
+                for client, _ in subscribers:
+                    self._queue(client, message, None)
+        elif event["type"] != "metrics":
+            message = self._encode(event["type"], server_id, event["data"], timestamp)
+            for client, _ in subscribers:
+                self._queue(client, message, None)
+        else:
+            # Group by projection so each distinct frame is built and encoded once
+            groups: Dict[Optional[Projection], List[Tuple[ClientConnection, Subscription]]] = {}
+            for client, sub in subscribers:
+                groups.setdefault(sub.projection, []).append((client, sub))
+            now = self._clock()
+            for projection, members in groups.items():
+                if projection is not None and projection.min_interval > 0:
+                    throttle = self._throttles.get((server_id, projection))
+                    if throttle is None:
+                        throttle = self._throttles[(server_id, projection)] = _Throttle()
+                    if throttle.scheduled or now - throttle.last_sent < projection.min_interval:
+                        # Within the window: keep only the newest sample
+                        if throttle.held is not None:
+                            self.conflated += 1
+                        throttle.held = (event["data"], timestamp)
+                        if not throttle.scheduled:
+                            throttle.scheduled = True
+                            self._wheel.schedule(
+                                (server_id, projection),
+                                throttle.last_sent + projection.min_interval - now,
+                            )
+                        continue
+                    throttle.last_sent = now
+                self._send_metrics_group(server_id, event["data"], timestamp, projection, members)
+
+        self.broadcasts += 1
+        self.broadcast_ms += (time.perf_counter() - started) * 1000
+
+    def _release_held(self, key: Tuple[str, Projection]) -> None:
+        """Timer wheel callback: send a group's held sample once its interval has passed"""
+        throttle = self._throttles.get(key)
+        if throttle is None:
+            return
+        throttle.scheduled = False
+        if throttle.held is None:
+            return
+        server_id, projection = key
+        metrics, timestamp = throttle.held
+        throttle.held = None
+        throttle.last_sent = self._clock()
+        members = [
+            (client, sub) for client, sub in self.active_connections.get(server_id, {}).items()
+            if sub.projection == projection and "metrics" in sub.topics
+        ]
+        if members:
+            self._send_metrics_group(server_id, metrics, timestamp, projection, members)
+
+    def _send_metrics_group(
+        self,
+        server_id: str,
+        metrics: dict,
+        timestamp: str,
+        projection: Optional[Projection],
+        members: List[Tuple[ClientConnection, Subscription]],
+    ) -> None:
+        if projection is None:
+            message = self._encode("metrics", server_id, metrics, timestamp)
+            for client, _ in members:
+                # Metrics frames supersede each other (per server)
+                self._queue(client, message, server_id)
+            return
+
+        flat = project(metrics, projection.fields)
+        if not projection.delta:
+            message = self._encode("metrics", server_id, unflatten(flat), timestamp)
+            for client, _ in members:
+                self._queue(client, message, server_id)
+            return
+
+        # Deltas must arrive in order, so they are never conflated
+        encoder = self._encoders.get((server_id, projection))
+        if encoder is None:
+            encoder = self._encoders[(server_id, projection)] = DeltaEncoder(projection.epsilon)
+        changes = encoder.update(flat)
+        full_message = delta_message = None
+        for client, sub in members:
+            if sub.needs_full:
+                if full_message is None:
+                    full_message = self._encode("metrics", server_id, unflatten(flat), timestamp)
+                self._queue(client, full_message, None)
+                sub.needs_full = False
+            elif changes:
+                if delta_message is None:
+                    delta_message = self._encode("metrics_delta", server_id, unflatten(changes), timestamp)
+                self._queue(client, delta_message, None)
+
+    async def stop(self) -> None:
+        """Stop the rate-limit timer wheel (held samples are dropped)"""
+        await self._wheel.stop()
+
+    def stats(self) -> dict:
+        """Client counts, queue depths and broadcast cost"""
+        clients = list(self._clients.values())
+        return {
+            "servers": len(self.active_connections),
+            "clients": len(clients),
+            "subscriptions": sum(len(c.subscriptions) for c in clients),
+            "max_queue_depth": max((c.queue_depth for c in clients), default=0),
+            "conflated": self.conflated + sum(c.conflated for c in clients),
+            "rate_limited_groups": len(self._throttles),
+            "timers": self._wheel.stats(),
+            "broadcasts": self.broadcasts,
+            "frames_queued": self.frames_queued,
+            "bytes_queued": self.bytes_queued,
+            "encodings": self.encodings,
+            "delta_encoders": len(self._encoders),
+            "evicted": self.evicted,
+            "avg_broadcast_ms": round(self.broadcast_ms / self.broadcasts, 4) if self.broadcasts else 0.0,
+        }
+
+
+# Global WebSocket manager instance
+ws_manager = ConnectionManager(
+    max_queue=settings.WS_CLIENT_QUEUE_SIZE,
+    send_timeout=settings.WS_CLIENT_SEND_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,132 @@
+"""
+Fleet dashboard latency: GET /servers/overview vs the N+1 pattern the server
+list page used (GET /servers and /alerts, then /metrics/{id}/latest per server).
+
+Needs a migrated database (DATABASE_URL). Creates a throwaway user with
+`--servers` servers, a few unresolved alerts each and a cached latest sample
+per server, calls the app in-process over ASGI and deletes the user again.
+
+Run from the api directory:
+
+    python -m benchmarks.servers_overview --servers 1000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from sqlalchemy import insert, delete
+
+from app.main import app
+from app.core.security import create_access_token
+from app.db.base import AsyncSessionLocal, engine
+from app.models.user import User
+from app.models.server import Server, ServerStatus
+from app.models.alert import Alert, AlertType, AlertSeverity
+from app.api.v1.metrics import metrics_cache
+
+
+async def _seed(servers: int) -> tuple:
+    user_id = uuid.uuid4()
+    server_ids = [uuid.uuid4() for _ in range(servers)]
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{
+            "id": user_id,
+            "email": f"bench-{user_id.hex}@example.com",
+            "username": f"bench-{user_id.hex}",
+            "hashed_password": "x",
+        }])
+        await db.execute(insert(Server), [
+            {"id": sid, "name": f"server-{i:05d}", "user_id": user_id, "status": ServerStatus.ONLINE}
+            for i, sid in enumerate(server_ids)
+        ])
+        alerts = []
+        for sid in server_ids:
+            for _ in range(random.randint(0, 4)):
+                alerts.append({
+                    "id": uuid.uuid4(),
+                    "server_id": sid,
+                    "type": AlertType.CPU,
+                    "severity": random.choice(list(AlertSeverity)),
+                    "message": "cpu high",
+                    "resolved": random.random() < 0.5,
+                })
+        if alerts:
+            await db.execute(insert(Alert), alerts)
+        await db.commit()
+
+    now = datetime.now(timezone.utc).isoformat()
+    for sid in server_ids:
+        metrics_cache[str(sid)] = {
+            "server_id": str(sid),
+            "timestamp": now,
+            "cpu": {"usage_percent": random.uniform(0, 100)},
+            "memory": {"usage_percent": random.uniform(0, 100)},
+            "disk": {"usage_percent": random.uniform(0, 100)},
+            "network": {"bytes_sent": 0, "bytes_recv": 0},
+            "containers": [],
+            "processes": [],
+        }
+    return user_id, server_ids
+
+
+async def _cleanup(user_id: uuid.UUID, server_ids: list) -> None:
+    for sid in server_ids:
+        metrics_cache.pop(str(sid), None)
+    async with AsyncSessionLocal() as db:
+        # Servers and alerts go with the user (ON DELETE CASCADE)
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+
+
+async def _time(label: str, runs: int, call) -> None:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:<32} median {statistics.median(samples):9.1f} ms   p95 {p95:9.1f} ms")
+
+
+async def main(servers: int, runs: int, n_plus_one_runs: int) -> None:
+    # SQL echo would dominate the timings
+    engine.echo = False
+    user_id, server_ids = await _seed(servers)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(user_id)})}"}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            async def overview():
+                response = await client.get("/api/v1/servers/overview")
+                response.raise_for_status()
+                assert response.json()["total"] == servers
+
+            async def n_plus_one():
+                response = await client.get("/api/v1/servers", params={"limit": servers})
+                response.raise_for_status()
+                await client.get("/api/v1/alerts", params={"resolved": False, "limit": servers * 5})
+                for server in response.json():
+                    await client.get(f"/api/v1/metrics/{server['id']}/latest")
+
+            await overview()  # warm up connections
+            print(f"{servers} servers for one user")
+            await _time("GET /servers/overview", runs, overview)
+            await _time("GET /servers + /alerts + N latest", n_plus_one_runs, n_plus_one)
+    finally:
+        await _cleanup(user_id, server_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--n-plus-one-runs", type=int, default=3)
+    args = parser.parse_args()
+    random.seed(1)
+    asyncio.run(main(args.servers, args.runs, args.n_plus_one_runs))
@@ -0,0 +1,119 @@
+"""
+Storage size of container/process snapshots: copied into every metrics row
+(before) vs keyframe + delta rows in inventory_snapshots (after).
+
+Simulates a fleet of agents reporting every few seconds, with process CPU and
+memory jittering, container status strings ticking and occasional container
+restarts and short-lived processes. Sizes are the JSON-encoded payloads,
+which is what ends up in the JSON columns.
+
+Run from the api directory:
+
+    python -m benchmarks.snapshot_storage --servers 50 --hours 6
+"""
+import argparse
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.services.snapshot_store import SnapshotStore
+
+
+def _container(index: int) -> dict:
+    return {
+        "id": uuid.uuid4().hex[:12],
+        "name": f"service-{index}",
+        "image": f"registry.local/service-{index}:1.{index}",
+        "status": "Up 1 minute",
+        "state": "running",
+        "created": datetime.now(timezone.utc).isoformat(),
+        "ports": [{"private": 8000 + index, "public": 18000 + index, "type": "tcp"}],
+    }
+
+
+def _process(pid: int) -> dict:
+    return {
+        "pid": pid,
+        "name": random.choice(["python", "postgres", "nginx", "node", "java", "redis-server"]),
+        "cpu": round(random.uniform(0, 20), 1),
+        "memory": round(random.uniform(0, 10), 1),
+        "user": random.choice(["root", "www-data", "postgres"]),
+    }
+
+
+class FakeAgent:
+    """Evolving container/process lists of one server"""
+
+    def __init__(self, containers: int, processes: int):
+        self.containers = [_container(i) for i in range(containers)]
+        self.processes = [_process(pid) for pid in random.sample(range(100, 60000), processes)]
+        self.uptime_minutes = 1
+
+    def sample(self) -> dict:
+        self.uptime_minutes += 1
+        for container in self.containers:
+            container["status"] = f"Up {self.uptime_minutes} minutes"
+        if random.random() < 0.01:
+            # Container restart: new id, same service
+            index = random.randrange(len(self.containers))
+            self.containers[index] = _container(index)
+        for process in self.processes:
+            process["cpu"] = max(0.0, round(process["cpu"] + random.uniform(-0.8, 0.8), 1))
+            process["memory"] = max(0.0, round(process["memory"] + random.uniform(-0.2, 0.2), 1))
+        if random.random() < 0.05:
+            # Short-lived process replaced by another
+            self.processes[random.randrange(len(self.processes))] = _process(random.randrange(100, 60000))
+        return {
+            "containers": [dict(c) for c in self.containers],
+            "processes": [dict(p) for p in self.processes],
+        }
+
+
+def _size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=6.0)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between samples")
+    parser.add_argument("--containers", type=int, default=12)
+    parser.add_argument("--processes", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    store = SnapshotStore(
+        keyframe_interval=settings.SNAPSHOT_KEYFRAME_INTERVAL_SECONDS,
+        max_deltas=settings.SNAPSHOT_MAX_DELTAS_PER_KEYFRAME,
+        tolerance=settings.SNAPSHOT_PROCESS_TOLERANCE,
+    )
+    agents = {uuid.uuid4(): FakeAgent(args.containers, args.processes) for _ in range(args.servers)}
+    samples = int(args.hours * 3600 / args.interval)
+    start = datetime.now(timezone.utc)
+
+    before_bytes = 0
+    after_bytes = 0
+    after_rows = 0
+    for i in range(samples):
+        timestamp = start + timedelta(seconds=i * args.interval)
+        for server_id, agent in agents.items():
+            sample = agent.sample()
+            before_bytes += _size({"containers": sample["containers"], "processes": sample["processes"]})
+            for row in store.record(server_id, timestamp, sample):
+                after_rows += 1
+                after_bytes += _size(row["data"])
+
+    total = samples * len(agents)
+    print(f"samples:          {total:,} ({len(agents)} servers x {samples})")
+    print(f"before (extra_data per metrics row): {before_bytes / 1e6:10.1f} MB  {before_bytes / total:8.0f} B/sample")
+    print(f"after  (inventory_snapshots):        {after_bytes / 1e6:10.1f} MB  {after_bytes / total:8.0f} B/sample")
+    print(f"snapshot rows:    {after_rows:,}  {store.stats()}")
+    print(f"reduction:        {before_bytes / max(after_bytes, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
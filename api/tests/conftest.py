@@ -1,3 +1,5 @@
+import asyncio
+import json
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
@@ -7,3 +9,143 @@ from app.main import app
 def client():
     """TestClient fixture for FastAPI tests."""
     return TestClient(app)
+
+
+class FakeWebSocket:
+    """Records frames sent to a client; with `stuck`, sends never complete"""
+
+    def __init__(self, stuck=False):
+        self.stuck = stuck
+        self.frames = []
+        self.closed_with = None
+
+    async def send_text(self, text):
+        await self.send_json(json.loads(text))
+
+    async def send_json(self, data):
+        if self.stuck:
+            await asyncio.sleep(3600)
+        self.frames.append(data)
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+
+class FakeScalars:
+    def __init__(self, values):
+        self.values = values
+
+    def all(self):
+        return self.values
+
+    def first(self):
+        return self.values[0] if self.values else None
+
+
+class FakeResult:
+    """Query result over a list of row tuples"""
+
+    def __init__(self, rows=(), rowcount=None):
+        self.rows = list(rows)
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+
+    def all(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def scalars(self):
+        return FakeScalars([row[0] for row in self.rows])
+
+    def scalar_one(self):
+        return self.rows[0][0]
+
+    def scalar_one_or_none(self):
+        return self.rows[0][0] if self.rows else None
+
+
+class FakeStream:
+    """Streamed result (AsyncSession.stream) over a FakeResult"""
+
+    def __init__(self, result):
+        self.result = result
+
+    async def __aiter__(self):
+        for row in self.result.rows:
+            yield row
+
+    async def scalars(self):
+        for row in self.result.rows:
+            yield row[0]
+
+
+class FakeSession:
+    """
+    AsyncSession stand-in. Records every statement and answers it with
+    `respond(statement, params)` (an empty result by default), streamed
+    queries included. Statements of a savepoint that raised are dropped,
+    as a rollback would.
+    """
+
+    def __init__(self):
+        self.respond = None
+        self.statements = []
+        self.commits = 0
+        self.rolled_back = 0
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        return self.respond(statement, params) if self.respond else FakeResult()
+
+    async def stream(self, statement, params=None):
+        return FakeStream(await self.execute(statement, params))
+
+    async def commit(self):
+        self.commits += 1
+
+    def begin_nested(self):
+        return _FakeSavepoint(self)
+
+
+class _FakeSavepoint:
+    def __init__(self, session):
+        self.session = session
+        self.mark = 0
+
+    async def __aenter__(self):
+        self.mark = len(self.session.statements)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            del self.session.statements[self.mark:]
+            self.session.rolled_back += 1
+        return False
+
+
+@pytest.fixture
+def fake_websocket():
+    """FakeWebSocket class; call it to create sockets"""
+    return FakeWebSocket
+
+
+@pytest.fixture
+def fake_result():
+    """FakeResult class; call it with row tuples"""
+    return FakeResult
+
+
+@pytest.fixture
+def fake_session():
+    """A FakeSession; set `respond` to answer queries"""
+    return FakeSession()
@@ -67,3 +67,89 @@ def test_resolve_alert_unauthorized(client: TestClient):
     
     assert response.status_code == 401
 
+
+
+async def test_alert_registry_loads_once_and_writes_on_transitions(monkeypatch):
+    """Test thresholds are loaded once per server and alerts open/resolve only on state change."""
+    from types import SimpleNamespace
+    from app.crud import alert as crud_alert
+    from app.models.alert import AlertType, ComparisonType
+    from app.services.alert_service import AlertRegistry
+    
+    calls = {"thresholds": 0, "create": 0, "resolve": 0}
+    
+    async def fake_get_alert_thresholds(db, server_id=None, user_id=None):
+        calls["thresholds"] += 1
+        return [SimpleNamespace(
+            metric_type=AlertType.CPU, comparison=ComparisonType.GT, threshold_value=80.0, enabled=True
+        )]
+    
+    async def fake_get_open_alerts(db, server_id):
+        return []
+    
+    async def fake_create_alert(db, alert_in):
+        calls["create"] += 1
+        return SimpleNamespace(id=uuid.uuid4())
+    
+    async def fake_resolve_alert(db, alert_id):
+        calls["resolve"] += 1
+    
+    monkeypatch.setattr(crud_alert, "get_alert_thresholds", fake_get_alert_thresholds)
+    monkeypatch.setattr(crud_alert, "get_open_alerts", fake_get_open_alerts)
+    monkeypatch.setattr(crud_alert, "create_alert", fake_create_alert)
+    monkeypatch.setattr(crud_alert, "resolve_alert", fake_resolve_alert)
+    
+    registry = AlertRegistry()
+    server_id = uuid.uuid4()
+    for cpu in (50.0, 90.0, 95.0, 40.0, 30.0):
+        await registry.evaluate(None, server_id, {"cpu": {"usage_percent": cpu}})
+    
+    assert calls == {"thresholds": 1, "create": 1, "resolve": 1}
+    
+    registry.invalidate(server_id)
+    await registry.evaluate(None, server_id, {"cpu": {"usage_percent": 30.0}})
+    assert calls["thresholds"] == 2
+    assert registry._slots == {}
+
+
+async def test_alert_registry_does_not_cache_a_load_invalidated_midway(monkeypatch):
+    """Test an invalidation arriving while thresholds are being loaded makes the next sample reload them"""
+    import asyncio
+    from types import SimpleNamespace
+    from app.crud import alert as crud_alert
+    from app.models.alert import AlertType, ComparisonType
+    from app.services.alert_service import AlertRegistry
+    
+    loading, release = asyncio.Event(), asyncio.Event()
+    loads = []
+    
+    async def fake_get_alert_thresholds(db, server_id=None, user_id=None):
+        loads.append(server_id)
+        if len(loads) == 1:
+            loading.set()
+            await release.wait()
+        return [SimpleNamespace(
+            metric_type=AlertType.CPU, comparison=ComparisonType.GT, threshold_value=80.0, enabled=True
+        )]
+    
+    async def fake_get_open_alerts(db, server_id):
+        return []
+    
+    monkeypatch.setattr(crud_alert, "get_alert_thresholds", fake_get_alert_thresholds)
+    monkeypatch.setattr(crud_alert, "get_open_alerts", fake_get_open_alerts)
+    
+    registry = AlertRegistry()
+    server_id = uuid.uuid4()
+    sample = {"cpu": {"usage_percent": 10.0}}
+    evaluating = asyncio.create_task(registry.evaluate(None, server_id, sample))
+    await loading.wait()
+    registry.invalidate(server_id)
+    release.set()
+    await evaluating
+    assert registry.stats()["cached_servers"] == 0
+    
+    await registry.evaluate(None, server_id, sample)
+    await registry.evaluate(None, server_id, sample)
+    assert len(loads) == 2
+    assert registry.stats()["cached_servers"] == 1
+    assert registry._slots == {}
@@ -29,3 +29,58 @@ def test_revoke_api_key_unauthorized(client: TestClient):
     
     assert response.status_code == 401
 
+
+
+def test_api_key_prefix_and_digest():
+    """Test that generated keys carry a parseable prefix and a keyed digest"""
+    from app.crud.api_key import generate_api_key, parse_key_prefix, hash_api_key, verify_api_key
+
+    key_prefix, plain_key = generate_api_key()
+    assert parse_key_prefix(plain_key) == key_prefix
+    assert parse_key_prefix("chatops_legacykeywithoutprefix") is None
+
+    key_hash = hash_api_key(plain_key)
+    assert key_hash == hash_api_key(plain_key)
+    assert verify_api_key(plain_key, key_hash)
+    assert not verify_api_key(plain_key + "x", key_hash)
+
+
+async def test_legacy_key_scan_is_gated(monkeypatch, fake_session, fake_result):
+    """Test that only legacy-format keys reach the bcrypt scan, and a rejected key only once"""
+    import secrets
+    import app.services.auth_service as auth_service
+
+    class FakeLegacyKey:
+        key_hash = "$2b$12$notarealbcrypthash"
+
+    legacy_keys = [FakeLegacyKey()]
+    # The digest lookup finds nothing, the scan returns the unmigrated keys
+    fake_session.respond = lambda statement, params: fake_result(
+        [(key,) for key in legacy_keys] if fake_session.queries % 2 == 0 else []
+    )
+    checked = []
+
+    async def fake_verify(plain_key, hashed_key, pool=None):
+        checked.append(plain_key)
+        return False
+
+    monkeypatch.setattr(auth_service, "verify_password_async", fake_verify)
+    monkeypatch.setattr(auth_service, "_legacy_keys_remaining", True)
+    auth_service.rejected_legacy_keys.clear()
+
+    assert await auth_service.verify_and_get_api_key(fake_session, "not a key") is None
+    assert fake_session.queries == 0
+
+    legacy_key = secrets.token_urlsafe(32)
+    assert await auth_service.verify_and_get_api_key(fake_session, legacy_key) is None
+    assert await auth_service.verify_and_get_api_key(fake_session, legacy_key) is None
+    assert checked == [legacy_key]
+    assert fake_session.queries == 2
+
+    # Once a scan finds no bcrypt hash left, legacy keys stop at the indexed digest lookup
+    legacy_keys.clear()
+    fake_session.statements.clear()
+    assert await auth_service.verify_and_get_api_key(fake_session, secrets.token_urlsafe(32)) is None
+    assert await auth_service.verify_and_get_api_key(fake_session, secrets.token_urlsafe(32)) is None
+    assert fake_session.queries == 3
+    assert auth_service._legacy_keys_remaining is False
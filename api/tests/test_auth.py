@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 
 
@@ -112,3 +113,26 @@ def test_register_invalid_email(client: TestClient):
     response = client.post("/api/v1/auth/register", json=user_data)
     
     assert response.status_code == 422
+
+
+async def test_hash_pool_rejects_when_saturated():
+    """Test that the hash pool sheds load once max_pending jobs are in flight"""
+    import asyncio
+    import threading
+    from app.core.hash_pool import HashPool, HashPoolBusy
+
+    pool = HashPool("test", max_workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        blocked = asyncio.create_task(pool.run(release.wait, 5))
+        await asyncio.sleep(0)
+        with pytest.raises(HashPoolBusy):
+            await pool.run(len, "x")
+        release.set()
+        assert await blocked is True
+        assert await pool.run(len, "abc") == 3
+        assert pool.stats()["rejected"] == 1
+        assert pool.stats()["completed"] == 2
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,75 @@
+async def test_message_bus_delivers_and_invalidates():
+    """Test local delivery, unsubscribe and cache invalidation on the in-process bus"""
+    from app.services.bus import MessageBus
+
+    bus = MessageBus()
+    received = []
+
+    async def handler(message):
+        received.append(message)
+
+    bus.subscribe("chan", handler)
+    await bus.publish("chan", {"n": 1})
+    bus.unsubscribe("chan", handler)
+    await bus.publish("chan", {"n": 2})
+    assert received == [{"n": 1}]
+    assert not bus.has_subscribers("chan")
+
+    invalidated = []
+    bus.on_invalidate("cache", invalidated.append)
+    await bus.invalidate("cache", "key-1")
+    assert invalidated == ["key-1"]
+
+
+def test_postgres_bus_reassembles_chunked_notifications():
+    """Test that a message split across NOTIFY payloads is reassembled"""
+    import asyncio
+    import json
+    from app.services.bus import PostgresBus
+
+    async def run():
+        bus = PostgresBus("postgresql://unused")
+        body = json.dumps({"data": "x" * 20000})
+        size = 7000
+        chunks = [body[i:i + size] for i in range(0, len(body), size)]
+        for index, chunk in enumerate(chunks):
+            bus._on_notify(None, 0, "chan", f"other:1:{index}:{len(chunks)}:{chunk}")
+        # Own notifications are ignored
+        bus._on_notify(None, 0, "chan", f"{bus.worker_id}:2:0:1:{{}}")
+        return bus._inbox.get_nowait(), bus._inbox.qsize()
+
+    (channel, message), remaining = asyncio.run(run())
+    assert channel == "chan"
+    assert message == {"data": "x" * 20000}
+    assert remaining == 0
+
+
+async def test_postgres_bus_skips_stream_notifications_without_remote_interest():
+    """Test that stream events are only queued for NOTIFY when another worker subscribed to them"""
+    from app.services.bus import INTEREST_CHANNEL, PostgresBus, stream_channel
+
+    bus = PostgresBus("postgresql://unused")
+    local = []
+
+    async def handler(message):
+        local.append(message)
+
+    bus._handlers[stream_channel("s1")].append(handler)
+    await bus.publish(stream_channel("s1"), {"n": 1})
+    assert local == [{"n": 1}]
+    assert bus._outbox.empty()
+    assert bus.skipped_no_interest == 1
+
+    # Another worker announces a subscriber for s1 only
+    await bus._on_interest({"kind": "interest", "worker": "other", "channels": [stream_channel("s1")]})
+    await bus.publish(stream_channel("s1"), {"n": 2})
+    await bus.publish(stream_channel("s2"), {"n": 3})
+    channel, payload = bus._outbox.get_nowait()
+    assert channel == stream_channel("s1")
+    assert payload.startswith(f"{bus.worker_id}:")
+    assert bus._outbox.empty()
+
+    # Other channels always go out; a query asks this worker to announce its interest
+    await bus.publish(INTEREST_CHANNEL, {"kind": "query", "worker": "other"})
+    assert bus._outbox.get_nowait()[0] == INTEREST_CHANNEL
+    assert bus._interest_changed.is_set()
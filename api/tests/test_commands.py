@@ -11,3 +11,400 @@ def test_execute_command_unauthorized(client: TestClient):
     
     assert response.status_code == 401
 
+
+
+async def test_agent_rpc_limits_times_out_and_fails_on_disconnect(fake_websocket):
+    """Test per-agent in-flight limit, cancel on timeout, late replies and failing pending calls on disconnect."""
+    import asyncio
+    from app.services.agent_manager import AgentManager
+    
+    manager = AgentManager(max_in_flight=1, default_timeout=5.0, timeouts={"slow": 0.05})
+    websocket = fake_websocket()
+    server_id = str(uuid.uuid4())
+    manager.register_agent(server_id, websocket)
+    
+    # Only one command is sent until the first reply arrives
+    first = asyncio.create_task(manager.send_command(server_id, {"type": "execute_command"}))
+    second = asyncio.create_task(manager.send_command(server_id, {"type": "execute_command"}))
+    await asyncio.sleep(0.01)
+    assert len(websocket.frames) == 1
+    assert manager.stats()["queued"] == 1
+    manager.put_response(websocket.frames[0]["request_id"], {"type": "command_result"})
+    assert await first == {"type": "command_result"}
+    await asyncio.sleep(0.01)
+    assert len(websocket.frames) == 2
+    
+    # The agent disconnects: the in-flight command fails right away
+    manager.unregister_agent(server_id, websocket)
+    assert await asyncio.wait_for(second, timeout=1.0) == {"error": "Agent disconnected"}
+    
+    # A timed-out command is cancelled on the agent and its late reply is counted
+    manager.register_agent(server_id, websocket)
+    response = await manager.send_command(server_id, {"type": "slow"})
+    assert response["error"].startswith("Timeout")
+    await asyncio.sleep(0.01)
+    assert websocket.frames[-1] == {"type": "cancel", "request_id": websocket.frames[-2]["request_id"]}
+    manager.put_response(websocket.frames[-2]["request_id"], {"type": "late"})
+    
+    stats = manager.stats()
+    assert stats["late_replies"] == 1
+    assert stats["cancels_sent"] == 1
+    assert stats["commands"]["execute_command"]["ok"] == 1
+    assert stats["commands"]["execute_command"]["disconnected"] == 1
+    assert stats["commands"]["slow"]["timeouts"] == 1
+    assert stats["commands"]["slow"]["latency"]["count"] == 1
+
+
+async def test_command_stream_relays_chunks_after_stored_output():
+    """Test a follower gets the stored output first, then live chunks in order without duplicates."""
+    import asyncio
+    from types import SimpleNamespace
+    from app.models.command_history import CommandStatus
+    from app.services.command_streams import CommandStreams
+    
+    streams = CommandStreams(flush_interval=60.0, max_output_bytes=8, timeout=60.0, follower_queue_size=10)
+    server_id, command_id = str(uuid.uuid4()), uuid.uuid4()
+    streams.open(server_id, str(command_id), "request-1")
+    
+    # Chunk 1 is already stored when the follower connects
+    row = SimpleNamespace(
+        id=command_id, status=CommandStatus.RUNNING, stdout="hello ", stderr=None,
+        stdout_size=None, stderr_size=None, output_seq=1,
+    )
+    follower = streams.follow(row)
+    assert await follower.__anext__() == {
+        "type": "command_output", "command_id": str(command_id), "seq": 1,
+        "stream": "stdout", "data": "hello ", "catch_up": True,
+    }
+    
+    next_frame = asyncio.create_task(follower.__anext__())
+    await asyncio.sleep(0)
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 2, "stream": "stderr", "data": "oops"})
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 2, "stream": "stderr", "data": "oops"})
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 3, "stream": "stdout", "data": "world"})
+    frame = await next_frame
+    assert (frame["seq"], frame["stream"], frame["data"]) == (2, "stderr", "oops")
+    frame = await follower.__anext__()
+    assert (frame["seq"], frame["data"]) == (3, "world")
+    await follower.aclose()
+    
+    stats = streams.stats()
+    assert stats["running"] == 1
+    assert stats["chunks"] == 2
+    assert stats["duplicates"] == 1
+    # 4 + 5 bytes exceed the 8 byte cap: the second chunk is relayed but not stored
+    assert stats["truncated"] == 1
+    assert stats["followers"] == 0
+
+
+async def test_command_jobs_run_in_background_and_record_timeouts(monkeypatch, fake_session):
+    """Test jobs go PENDING -> RUNNING -> TIMEOUT/COMPLETED, wake watchers, and are rejected when the queue is full."""
+    import asyncio
+    from app.models.command_history import CommandStatus
+    from app.services import command_jobs as command_jobs_module
+    from app.services.command_jobs import CommandJobs
+    
+    updates = []
+    
+    async def fake_update(db, command_id, **fields):
+        updates.append((command_id, fields["status"], fields.get("error_message")))
+    
+    release = asyncio.Event()
+    
+    async def fake_send_command(server_id, command, timeout=None):
+        if command["command"] == "sleep":
+            return {"error": f"Timeout waiting for agent response after {timeout:g}s", "timeout": True}
+        await release.wait()
+        return {"type": "command_result", "data": {"output": "ok", "exit_code": 0}}
+    
+    monkeypatch.setattr(command_jobs_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(command_jobs_module.crud_command_history, "update_command_history", fake_update)
+    monkeypatch.setattr(command_jobs_module.agent_manager, "send_command", fake_send_command)
+    
+    jobs = CommandJobs(max_running=1, max_jobs=2)
+    server_id = uuid.uuid4()
+    slow_id, timeout_id = uuid.uuid4(), uuid.uuid4()
+    assert jobs.submit(slow_id, server_id, "apt-get update")
+    assert jobs.submit(timeout_id, server_id, "sleep", timeout=2)
+    assert not jobs.submit(uuid.uuid4(), server_id, "uptime")
+    
+    # The second job waits for the only slot
+    await asyncio.sleep(0.01)
+    assert jobs.stats()["running"] == 1
+    assert jobs.stats()["pending"] == 1
+    
+    async with jobs.watch(timeout_id) as finished:
+        release.set()
+        await asyncio.wait_for(finished.wait(), timeout=1.0)
+    await asyncio.sleep(0.01)
+    
+    assert updates == [
+        (slow_id, CommandStatus.RUNNING, None),
+        (slow_id, CommandStatus.COMPLETED, None),
+        (timeout_id, CommandStatus.RUNNING, None),
+        (timeout_id, CommandStatus.TIMEOUT, "Timeout waiting for agent response after 2s"),
+    ]
+    stats = jobs.stats()
+    assert stats["rejected"] == 1
+    assert stats["finished"] == {"completed": 1, "timeout": 1}
+    assert stats["pending"] == 0
+
+
+async def test_command_fanout_streams_results_in_rolling_batches(monkeypatch, fake_session):
+    """Test fan-out bounds concurrency, stops after a failed batch and stores results with one insert per batch."""
+    import asyncio
+    from app.models.command_history import CommandStatus
+    from app.services import command_fanout as command_fanout_module
+    from app.services.command_fanout import CommandFanout
+    
+    inserts = []
+    in_flight = peak = 0
+    server_ids = [uuid.uuid4() for _ in range(5)]
+    
+    async def fake_bulk_insert(db, rows):
+        inserts.append(rows)
+    
+    async def fake_send_command(server_id, command, timeout=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # The first server answers last; the fourth one fails
+        await asyncio.sleep(0.02 if server_id == str(server_ids[0]) else 0.001)
+        in_flight -= 1
+        exit_code = 1 if server_id == str(server_ids[3]) else 0
+        return {"type": "command_result", "data": {"output": "ok", "exit_code": exit_code}}
+    
+    monkeypatch.setattr(command_fanout_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(command_fanout_module.crud_command_history, "create_command_history_bulk", fake_bulk_insert)
+    monkeypatch.setattr(command_fanout_module.agent_manager, "send_command", fake_send_command)
+    
+    fanout = CommandFanout(default_parallelism=10, max_parallelism=2)
+    frames = [
+        frame async for frame in fanout.run(
+            uuid.uuid4(), server_ids, "uptime", parallelism=5, batch_size=2, stop_on_failure=True,
+        )
+    ]
+    
+    results = [(frame["server_id"], frame["status"]) for frame in frames if frame["type"] == "result"]
+    assert results == [
+        (str(server_ids[1]), "completed"),
+        (str(server_ids[0]), "completed"),
+        (str(server_ids[2]), "completed"),
+        (str(server_ids[3]), "failed"),
+        (str(server_ids[4]), "skipped"),
+    ]
+    summary = frames[-1]
+    assert (summary["servers"], summary["completed"], summary["failed"], summary["skipped"]) == (5, 3, 1, 1)
+    assert peak == 2
+    
+    assert [{row["server_id"] for row in rows} for rows in inserts] == [set(server_ids[:2]), set(server_ids[2:4])]
+    assert {row["status"] for row in inserts[1]} == {CommandStatus.COMPLETED, CommandStatus.FAILED}
+    assert fanout.stats()["commands"] == 4
+
+
+async def test_command_fanout_keeps_failed_writes_and_full_outputs(monkeypatch, fake_session):
+    """Test results whose INSERT failed are written later, and storing a preview leaves the streamed output whole."""
+    from app.core.config import settings
+    from app.crud import command_history as crud_command_history
+    from app.services import command_fanout as command_fanout_module
+    from app.services.command_fanout import CommandFanout
+    
+    output = "x" * (settings.COMMAND_OUTPUT_INLINE_BYTES + 10)
+    stored = []
+    attempts = 0
+    create_command_history_bulk = crud_command_history.create_command_history_bulk
+    
+    async def flaky_bulk_insert(db, rows):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise ConnectionError("database unavailable")
+        await create_command_history_bulk(db, rows)
+        stored.extend(row["id"] for row in rows)
+    
+    async def fake_send_command(server_id, command, timeout=None):
+        return {"type": "command_result", "data": {"output": output, "exit_code": 0}}
+    
+    monkeypatch.setattr(command_fanout_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(command_fanout_module.crud_command_history, "create_command_history_bulk", flaky_bulk_insert)
+    monkeypatch.setattr(command_fanout_module.agent_manager, "send_command", fake_send_command)
+    # Write after every result, so rows are stored while later ones still wait to be streamed
+    monkeypatch.setattr(command_fanout_module, "WRITE_BATCH_SIZE", 1)
+    
+    fanout = CommandFanout(default_parallelism=10, max_parallelism=10)
+    server_ids = [uuid.uuid4() for _ in range(4)]
+    frames = [frame async for frame in fanout.run(uuid.uuid4(), server_ids, "cat big", batch_size=2)]
+    
+    # The first INSERT failed; its rows went out with the next one
+    results = [frame for frame in frames if frame["type"] == "result"]
+    assert len(stored) == 4 and set(stored) == {uuid.UUID(frame["command_id"]) for frame in results}
+    assert fanout.stats()["failed_writes"] == 1
+    assert fanout.stats()["commands"] == 4
+    # Rows are inserted with a preview, but the frames stream the full output
+    assert all(frame["stdout"] == output for frame in results)
+    inserted = [
+        statement.compile().params for statement, _ in fake_session.statements
+        if str(statement).startswith("INSERT INTO command_history")
+    ]
+    assert len(inserted) == 2
+    assert all(output not in params.values() for params in inserted)
+
+
+async def test_command_follower_waits_for_gaps_to_be_stored(monkeypatch):
+    """Test a follower only relays a chunk after the missing ones are stored, and gives up instead of skipping them."""
+    from types import SimpleNamespace
+    from app.models.command_history import CommandStatus
+    from app.services import command_streams as command_streams_module
+    from app.services.command_streams import CommandStreams, FollowerOverflow, GAP_RELOADS
+    
+    streams = CommandStreams(flush_interval=0.001, max_output_bytes=1024, timeout=60.0, follower_queue_size=10)
+    server_id, command_id = str(uuid.uuid4()), uuid.uuid4()
+    streams.open(server_id, str(command_id), "request-1")
+    
+    def stored(output_seq, stdout):
+        return SimpleNamespace(
+            id=command_id, status=CommandStatus.RUNNING, stdout=stdout, stderr=None,
+            stdout_size=None, stderr_size=None, output_seq=output_seq,
+        )
+    
+    # Chunk 2 is only stored on the third reload
+    reloads = []
+    
+    async def fake_reload(command_id):
+        reloads.append(command_id)
+        return stored(2, "ab") if len(reloads) >= 3 else stored(1, "a")
+    
+    monkeypatch.setattr(command_streams_module, "_reload", fake_reload)
+    follower = streams.follow(stored(1, "a"))
+    assert (await follower.__anext__())["data"] == "a"
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 3, "stream": "stdout", "data": "c"})
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 4, "stream": "stdout", "data": "d"})
+    frames = [await follower.__anext__() for _ in range(3)]
+    assert [(frame["data"], frame.get("catch_up", False)) for frame in frames] == [("b", True), ("c", False), ("d", False)]
+    assert len(reloads) == 3
+    await follower.aclose()
+    
+    # Never stored: the follower is closed rather than sent output with a hole in it
+    reloads.clear()
+    
+    async def never_stored(command_id):
+        reloads.append(command_id)
+        return stored(1, "a")
+    
+    monkeypatch.setattr(command_streams_module, "_reload", never_stored)
+    follower = streams.follow(stored(1, "a"))
+    await follower.__anext__()
+    await streams.on_output(server_id, {"command_id": str(command_id), "seq": 5, "stream": "stdout", "data": "e"})
+    try:
+        await follower.__anext__()
+        assert False, "expected FollowerOverflow"
+    except FollowerOverflow:
+        pass
+    assert len(reloads) == GAP_RELOADS
+
+
+async def test_large_output_is_chunked_and_read_by_range(fake_session, fake_result):
+    """Test outputs over the inline limit keep a preview and are read back from the chunks covering a range."""
+    from types import SimpleNamespace
+    from app.crud.command_history import split_output, read_command_output
+    
+    command_id = uuid.uuid4()
+    text = "".join(f"line {i:04d} é\n" for i in range(100))
+    raw = text.encode()
+    
+    preview, size, chunks = split_output(command_id, "stdout", text, inline_bytes=50, chunk_bytes=64)
+    assert size == len(raw)
+    assert raw.startswith(preview.encode()) and len(preview.encode()) <= 50
+    assert [chunk["start"] for chunk in chunks] == list(range(0, len(raw), 64))
+    assert split_output(command_id, "stdout", "short", inline_bytes=50, chunk_bytes=64) == ("short", None, [])
+    
+    # Answer with the chunks overlapping bytes 100-229, as the range query would
+    fake_session.respond = lambda statement, params: fake_result(
+        [(c["start"], c["data"]) for c in chunks if c["start"] < 230 and c["start"] + c["size"] > 100]
+    )
+    row = SimpleNamespace(id=command_id, stdout=preview, stdout_size=size)
+    data, total = await read_command_output(fake_session, row, "stdout", offset=100, length=130)
+    assert (data, total) == (raw[100:230], len(raw))
+    
+    # Inline outputs are sliced without touching the chunk table
+    row = SimpleNamespace(id=command_id, stderr="abcdef", stderr_size=None)
+    assert await read_command_output(None, row, "stderr", offset=2, length=3) == (b"cde", 6)
+
+
+async def test_command_stream_finish_waits_for_running_flush(monkeypatch, fake_session):
+    """Test that a finishing command is compacted only after an in-progress flush of it has written its output."""
+    import asyncio
+    import app.services.command_streams as command_streams_module
+    from app.models.command_history import CommandStatus
+    from app.services.command_streams import CommandStreams
+    
+    calls = []
+    release = asyncio.Event()
+    
+    async def fake_append(db, command_id, seq, stdout="", stderr=""):
+        calls.append(("append", seq))
+        await release.wait()
+    
+    async def fake_compact(db, command_id):
+        calls.append(("compact",))
+    
+    async def fake_update(db, command_id, **fields):
+        calls.append(("update", fields["status"]))
+    
+    monkeypatch.setattr(command_streams_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(command_streams_module.crud_command_history, "append_command_output", fake_append)
+    monkeypatch.setattr(command_streams_module.crud_command_history, "compact_command_output", fake_compact)
+    monkeypatch.setattr(command_streams_module.crud_command_history, "update_command_history", fake_update)
+    
+    streams = CommandStreams(flush_interval=60.0, max_output_bytes=1024, timeout=60.0, follower_queue_size=10)
+    server_id, command_id = str(uuid.uuid4()), str(uuid.uuid4())
+    streams.open(server_id, command_id, "request-1")
+    await streams.on_output(server_id, {"command_id": command_id, "seq": 1, "stream": "stdout", "data": "a"})
+    
+    flush = asyncio.create_task(streams.flush())
+    await asyncio.sleep(0)
+    await streams.on_output(server_id, {"command_id": command_id, "seq": 2, "stream": "stdout", "data": "b"})
+    finish = asyncio.create_task(streams.on_exit(server_id, {"command_id": command_id, "exit_code": 0}))
+    await asyncio.sleep(0.01)
+    assert calls == [("append", 1)]
+    
+    release.set()
+    await asyncio.gather(flush, finish)
+    assert calls == [("append", 1), ("append", 2), ("compact",), ("update", CommandStatus.COMPLETED)]
+
+
+async def test_slow_command_follower_is_closed_with_1013(monkeypatch, fake_websocket):
+    """Test that a follower's buffer is bounded and a stuck client is closed instead of buffering output."""
+    import asyncio
+    from types import SimpleNamespace
+    import app.api.v1.ws as ws_module
+    from app.models.command_history import CommandStatus
+    from app.services.command_streams import CommandStreams, FollowerOverflow
+    
+    streams = CommandStreams(flush_interval=60.0, max_output_bytes=1024, timeout=60.0, follower_queue_size=2)
+    server_id, command_id = str(uuid.uuid4()), uuid.uuid4()
+    streams.open(server_id, str(command_id), "request-1")
+    row = SimpleNamespace(
+        id=command_id, status=CommandStatus.RUNNING, stdout="a", stderr=None,
+        stdout_size=None, stderr_size=None, output_seq=1,
+    )
+    
+    # A consumer that stops reading overflows its bounded buffer
+    follower = streams.follow(row)
+    await follower.__anext__()
+    for seq in range(2, 7):
+        await streams.on_output(server_id, {"command_id": str(command_id), "seq": seq, "stream": "stdout", "data": "x"})
+    try:
+        await follower.__anext__()
+        assert False, "expected FollowerOverflow"
+    except FollowerOverflow:
+        pass
+    assert streams.stats()["followers"] == 0
+    
+    # A client whose send never completes is closed once the send timeout passes
+    monkeypatch.setattr(ws_module, "command_streams", streams)
+    monkeypatch.setattr(ws_module.settings, "WS_CLIENT_SEND_TIMEOUT_SECONDS", 0.01)
+    websocket = fake_websocket(stuck=True)
+    await asyncio.wait_for(ws_module._forward_command_output(websocket, row), timeout=1.0)
+    assert websocket.closed_with == 1013
+    assert streams.stats()["followers"] == 0
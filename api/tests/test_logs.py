@@ -1,3 +1,4 @@
+import asyncio
 from fastapi.testclient import TestClient
 import uuid
 
@@ -10,3 +11,102 @@ def test_get_server_logs_unauthorized(client: TestClient):
     
     assert response.status_code == 401
 
+
+
+def test_log_writer_rate_caps_and_counts_drops():
+    """Test agent log lines are rate-capped per server and the buffer rejects overflow."""
+    from app.services.log_writer import LogWriter
+    
+    writer = LogWriter(
+        batch_size=100, flush_interval=1.0, max_queue_size=6,
+        rate_per_server=0.0, burst=4, max_message_length=10,
+    )
+    noisy, quiet = str(uuid.uuid4()), str(uuid.uuid4())
+    
+    accepted, dropped = writer.ingest(noisy, [{"message": f"line {i}", "level": "ERROR"} for i in range(6)])
+    assert (len(accepted), dropped) == (4, 2)
+    assert accepted[0]["level"].value == "error"
+    
+    # Bad lines are skipped, long ones truncated; the other server has its own bucket
+    accepted, dropped = writer.ingest(quiet, [{"message": "x" * 50}, {"level": "info"}, "junk", {"message": "ok"}])
+    assert (len(accepted), dropped) == (2, 0)
+    assert accepted[0]["message"] == "x" * 10
+    
+    # Within the rate cap, but the buffer is full
+    accepted, dropped = writer.ingest(quiet, [{"message": "a"}, {"message": "b"}])
+    assert (len(accepted), dropped) == (0, 2)
+    
+    stats = writer.stats()
+    assert stats["queue_depth"] == 6
+    assert stats["invalid"] == 2
+    assert stats["dropped_rate_limited"] == 2
+    assert stats["dropped_queue_full"] == 2
+    assert stats["dropped_by_server"] == {noisy: 2, quiet: 2}
+
+
+async def test_log_writer_broadcasts_one_message_per_frame_and_keeps_buckets():
+    """Test accepted lines are published once per agent frame, off ingest, and rate-limit state survives until full again."""
+    from app.services.bus import bus, stream_channel
+    from app.services.log_writer import LogWriter
+    
+    writer = LogWriter(
+        batch_size=100, flush_interval=1.0, max_queue_size=100,
+        rate_per_server=1.0, burst=3, max_message_length=100,
+    )
+    server_id = str(uuid.uuid4())
+    events = []
+    
+    async def on_event(event):
+        events.append(event)
+    
+    bus.subscribe(stream_channel(server_id), on_event)
+    try:
+        writer.ingest(server_id, [{"message": "a"}, {"message": "b"}])
+        writer.ingest(server_id, [{"message": "c"}, {"message": "d"}])
+        # Nothing is published from ingest itself
+        assert events == []
+        assert await writer.broadcast() == 3
+    finally:
+        bus.unsubscribe(stream_channel(server_id), on_event)
+    
+    assert [event["type"] for event in events] == ["log_batch", "log_batch"]
+    assert [[line["message"] for line in event["data"]] for event in events] == [["a", "b"], ["c"]]
+    
+    # A reconnecting agent does not get a fresh burst: the bucket is only dropped once refilled
+    assert writer.prune_buckets() == 0
+    assert writer.ingest(server_id, [{"message": "e"}])[1] == 1
+    writer._buckets[server_id].updated -= 10
+    assert writer.prune_buckets() == 1
+
+
+async def test_log_writer_stop_waits_for_a_flush_in_progress(monkeypatch, fake_session):
+    """Test shutdown during a flush still writes the batch already taken off the buffer"""
+    from app.services import log_writer as log_writer_module
+    from app.services.log_writer import LogWriter
+    
+    written, started, release = [], asyncio.Event(), asyncio.Event()
+    
+    async def create_log_entries_bulk(db, rows):
+        started.set()
+        await release.wait()
+        written.extend(rows)
+        return len(rows)
+    
+    monkeypatch.setattr(log_writer_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(log_writer_module.crud_log_entry, "create_log_entries_bulk", create_log_entries_bulk)
+    writer = LogWriter(
+        batch_size=2, flush_interval=3600, max_queue_size=10,
+        rate_per_server=100.0, burst=10, max_message_length=100,
+    )
+    writer.start()
+    writer.ingest(str(uuid.uuid4()), [{"message": f"line {i}"} for i in range(3)])
+    await started.wait()
+    
+    stopping = asyncio.create_task(writer.stop())
+    for _ in range(5):
+        await asyncio.sleep(0)
+    # stop() waits for the write instead of cancelling it
+    assert not stopping.done()
+    release.set()
+    await stopping
+    assert [row["message"] for row in written] == ["line 0", "line 1", "line 2"]
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi.testclient import TestClient
 import uuid
 
@@ -10,3 +11,407 @@ def test_get_metrics_history_unauthorized(client: TestClient):
     
     assert response.status_code == 401
 
+
+
+def test_metric_writer_buffer_is_bounded():
+    """Test the write-behind buffer drops the oldest samples when full."""
+    from app.services.metric_writer import MetricWriter
+    
+    writer = MetricWriter(batch_size=10, flush_interval=1.0, max_queue_size=3)
+    server_id = str(uuid.uuid4())
+    for i in range(5):
+        writer.enqueue(server_id, {"timestamp": f"2025-01-01T00:00:0{i}Z", "cpu": {"usage_percent": i}})
+    
+    stats = writer.stats()
+    assert stats["queue_depth"] == 3
+    assert stats["enqueued"] == 5
+    assert stats["dropped"] == 2
+
+
+async def test_metric_writer_stop_waits_for_a_flush_in_progress(monkeypatch, fake_session):
+    """Test shutdown during a flush still writes the batch already taken off the buffer"""
+    from app.services import metric_writer as metric_writer_module
+    from app.services.metric_writer import MetricWriter
+    
+    written, started, release = [], asyncio.Event(), asyncio.Event()
+    
+    async def create_metrics_bulk(db, rows):
+        started.set()
+        await release.wait()
+        written.extend(rows)
+        return len(rows)
+    
+    monkeypatch.setattr(metric_writer_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(metric_writer_module.crud_metric, "create_metrics_bulk", create_metrics_bulk)
+    writer = MetricWriter(batch_size=2, flush_interval=3600, max_queue_size=10)
+    writer.start()
+    server_id = str(uuid.uuid4())
+    for i in range(3):
+        writer.enqueue(server_id, {"timestamp": f"2025-01-01T00:00:0{i}Z", "cpu": {"usage_percent": i}})
+    await started.wait()
+    assert writer.queue_depth == 1
+    
+    stopping = asyncio.create_task(writer.stop())
+    for _ in range(5):
+        await asyncio.sleep(0)
+    # stop() waits for the write instead of cancelling it
+    assert not stopping.done()
+    release.set()
+    await stopping
+    assert len(written) == 3
+    assert writer.stats()["written"] == 3
+
+
+async def test_agent_mailbox_overflow_policies():
+    """Test drop-oldest and conflate-latest overflow handling"""
+    from app.services.agent_mailbox import AgentMailbox, DROP_OLDEST, CONFLATE_LATEST
+
+    async def handler(server_id, sample):
+        pass
+
+    mailbox = AgentMailbox("srv", handler, max_size=3, overflow=DROP_OLDEST)
+    for i in range(5):
+        mailbox.put(i)
+    assert [sample for _, sample in mailbox._queue] == [2, 3, 4]
+    assert mailbox.stats()["dropped"] == 2
+
+    mailbox = AgentMailbox("srv", handler, max_size=3, overflow=CONFLATE_LATEST)
+    for i in range(4):
+        mailbox.put(i)
+    assert [sample for _, sample in mailbox._queue] == [3]
+    assert mailbox.stats()["conflated"] == 3
+
+    processed = []
+
+    async def record(server_id, sample):
+        processed.append(sample)
+
+    mailbox = AgentMailbox("srv", record, max_size=10, overflow=DROP_OLDEST)
+    mailbox.start()
+    mailbox.put("a")
+    mailbox.put("b")
+    for _ in range(5):
+        await asyncio.sleep(0)
+    await mailbox.close()
+    assert processed == ["a", "b"]
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    """Test LTTB bounds the output size and keeps the endpoints and spikes"""
+    from app.services.downsampling import lttb
+    
+    points = [(float(i), 0.0) for i in range(1000)]
+    points[500] = (500.0, 100.0)
+    
+    sampled = lttb(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] == points[0]
+    assert sampled[-1] == points[-1]
+    assert (500.0, 100.0) in sampled
+    assert lttb(points[:10], 50) == points[:10]
+
+
+def test_history_picks_coarsest_suitable_rollup():
+    """Test rollup selection by step divisibility, retention and population"""
+    from datetime import datetime, timedelta, timezone
+    from app.services.metric_rollup import align_step, choose_resolution
+    
+    now = datetime.now(timezone.utc)
+    populated = {"1m": now, "5m": now, "1h": now}
+    
+    assert align_step(1210) == 1500
+    assert align_step(7200 + 1) == 10800
+    assert align_step(30) == 30
+    
+    assert choose_resolution(7200, now - timedelta(days=1), populated, now) == "1h"
+    assert choose_resolution(600, now - timedelta(days=1), populated, now) == "5m"
+    assert choose_resolution(120, now - timedelta(days=1), populated, now) == "1m"
+    assert choose_resolution(30, now - timedelta(days=1), populated, now) is None
+    # 1m rollups are only kept for a week
+    assert choose_resolution(120, now - timedelta(days=10), populated, now) is None
+    # Not populated yet
+    assert choose_resolution(7200, now - timedelta(days=1), {"5m": now}, now) == "5m"
+
+
+async def test_history_splits_rollup_and_raw_at_complete_before(monkeypatch):
+    """Test history reads the rollup only up to the sample-time split, not the created_at watermark"""
+    from datetime import datetime, timedelta, timezone
+    import app.services.metric_rollup as metric_rollup
+    
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    complete_before = now - timedelta(minutes=17)
+    calls = []
+    
+    async def fake_complete_before(db):
+        return {"1m": complete_before}
+    
+    async def fake_rollup(db, resolution, server_id, start, end, step, fields):
+        calls.append(("rollup", resolution, start, end))
+        return []
+    
+    async def fake_raw(db, server_id, start, end, step, fields):
+        calls.append(("raw", start, end))
+        return []
+    
+    monkeypatch.setattr(metric_rollup.crud_rollup, "get_complete_before", fake_complete_before)
+    monkeypatch.setattr(metric_rollup.crud_rollup, "get_rollup_buckets", fake_rollup)
+    monkeypatch.setattr(metric_rollup.crud_metric, "get_metric_buckets", fake_raw)
+    
+    start = now - timedelta(hours=2)
+    source, _ = await metric_rollup.get_history_buckets(None, uuid.uuid4(), start, now, 300, ["cpu_usage_percent"])
+    split = metric_rollup._floor_to_step(complete_before, 300)
+    assert source == "rollup_1m"
+    assert calls == [("rollup", "1m", start, split), ("raw", split, now)]
+
+
+def test_metric_partition_names_are_daily():
+    """Test daily partition naming used for creation and retention"""
+    from datetime import date
+    from app.crud.metric import partition_name
+    
+    assert partition_name(date(2025, 1, 9)) == "metrics_p20250109"
+
+
+def _partition_responder(fake_result, partitions, fail_on=None, rowcount=0, count=0):
+    """Answer the partition listing query and fail statements containing `fail_on`"""
+    def respond(statement, params):
+        sql = str(statement)
+        if "pg_inherits" in sql:
+            return fake_result([(name,) for name in partitions])
+        if fail_on and fail_on in sql:
+            raise RuntimeError("simulated failure")
+        return fake_result([(count,)], rowcount=rowcount)
+    return respond
+
+
+def _maintenance_statements(db):
+    """(sql, params) issued besides the partition listing"""
+    return [(str(statement), params) for statement, params in db.statements if "pg_inherits" not in str(statement)]
+
+
+async def test_create_metric_partitions_moves_default_rows_before_attaching(fake_session, fake_result):
+    """Test partitions are created standalone, filled from metrics_default, then attached, one day at a time"""
+    from datetime import date
+    from app.crud.metric import create_metric_partitions
+    
+    db = fake_session
+    db.respond = _partition_responder(
+        fake_result, ["metrics_p20250110", "metrics_default"], fail_on="ATTACH PARTITION metrics_p20250111",
+    )
+    created = await create_metric_partitions(db, date(2025, 1, 9), 4)
+    
+    # The 10th exists; the 11th failed on its own and is left for the next run
+    assert created == ["metrics_p20250109", "metrics_p20250112"]
+    assert db.rolled_back == 1
+    assert db.commits == 1
+    
+    day = [sql for sql, _ in _maintenance_statements(db) if "metrics_p20250109" in sql]
+    assert day[0] == "CREATE TABLE metrics_p20250109 (LIKE metrics INCLUDING DEFAULTS)"
+    assert "CHECK (timestamp >= '2025-01-09 00:00:00+00' AND timestamp < '2025-01-10 00:00:00+00')" in day[1]
+    # Rows already in the default partition for that day move over with explicit columns
+    assert day[2].startswith("WITH moved AS (DELETE FROM metrics_default WHERE timestamp >= '2025-01-09 00:00:00+00'")
+    assert "INSERT INTO metrics_p20250109 (id, server_id, timestamp," in day[2]
+    assert day[3] == (
+        "ALTER TABLE metrics ATTACH PARTITION metrics_p20250109 "
+        "FOR VALUES FROM ('2025-01-09 00:00:00+00') TO ('2025-01-10 00:00:00+00')"
+    )
+    assert day[4] == "ALTER TABLE metrics_p20250109 DROP CONSTRAINT metrics_p20250109_bounds"
+    assert not any("metrics_p20250111" in sql for sql, _ in _maintenance_statements(db))
+
+
+async def test_drop_old_metric_partitions_respects_cutoff_and_detach_only(monkeypatch, fake_session, fake_result):
+    """Test only partitions entirely older than the cutoff are removed, and detach_only keeps their tables"""
+    from datetime import datetime, timezone
+    import app.crud.metric as crud_metric
+    
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2025, 2, 1, 0, 0, tzinfo=timezone.utc)
+    
+    monkeypatch.setattr(crud_metric, "datetime", FrozenDatetime)
+    partitions = ["metrics_p20250101", "metrics_p20250102", "metrics_p20250103", "metrics_default"]
+    
+    # Cutoff is exactly 2025-01-02 00:00: the 1st ends at the cutoff, the 2nd still has live rows
+    db = fake_session
+    db.respond = _partition_responder(fake_result, partitions)
+    removed = await crud_metric.drop_old_metric_partitions(db, older_than_days=30)
+    assert removed == ["metrics_p20250101"]
+    statements = _maintenance_statements(db)
+    assert statements[0][1] == {"names": ["metrics_p20250101"]}
+    assert [sql for sql, _ in statements[1:3]] == [
+        "ALTER TABLE metrics DETACH PARTITION metrics_p20250101", "DROP TABLE metrics_p20250101",
+    ]
+    assert statements[3] == (
+        "DELETE FROM metrics_default WHERE timestamp < :cutoff", {"cutoff": datetime(2025, 1, 2, tzinfo=timezone.utc)},
+    )
+    
+    db.statements.clear()
+    removed = await crud_metric.drop_old_metric_partitions(db, older_than_days=29, detach_only=True)
+    assert removed == ["metrics_p20250101", "metrics_p20250102"]
+    assert not any(sql.startswith("DROP TABLE") for sql, _ in _maintenance_statements(db))
+    
+    # delete_old_metrics deletes the partial day row by row and takes the dropped days' rows from
+    # the table statistics instead of counting them
+    db.statements.clear()
+    db.respond = _partition_responder(fake_result, partitions, rowcount=7, count=100)
+    monkeypatch.setattr(crud_metric, "datetime", type("Later", (FrozenDatetime,), {
+        "now": classmethod(lambda cls, tz=None: datetime(2025, 2, 1, 12, 0, tzinfo=timezone.utc)),
+    }))
+    assert await crud_metric.delete_old_metrics(db, older_than_days=30) == 7 + 100 + 7
+    statements = _maintenance_statements(db)
+    assert statements[0] == ("DELETE FROM metrics WHERE timestamp >= :day_start AND timestamp < :cutoff", {
+        "day_start": datetime(2025, 1, 2, tzinfo=timezone.utc),
+        "cutoff": datetime(2025, 1, 2, 12, 0, tzinfo=timezone.utc),
+    })
+    assert "reltuples" in statements[1][0]
+    assert "DETACH PARTITION metrics_p20250101" in statements[2][0]
+    assert not any("count(*)" in sql for sql, _ in statements)
+    assert not any("metrics_p20250102" in sql for sql, _ in statements)
+
+
+def test_snapshot_store_writes_keyframes_and_deltas():
+    """Test container/process snapshots are stored as keyframes plus deltas"""
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from app.crud.inventory_snapshot import rebuild_state
+    from app.services.snapshot_store import SnapshotStore
+    
+    store = SnapshotStore(keyframe_interval=600, max_deltas=100, tolerance=1.0)
+    server_id = uuid.uuid4()
+    t0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    processes = [{"pid": 1, "name": "init", "cpu": 0.5}, {"pid": 2, "name": "nginx", "cpu": 3.0}]
+    
+    first = store.record(server_id, t0, {"processes": processes})
+    assert [row["is_keyframe"] for row in first] == [True]
+    
+    # CPU jitter within tolerance is not stored
+    jitter = [{"pid": 1, "name": "init", "cpu": 0.9}, {"pid": 2, "name": "nginx", "cpu": 3.5}]
+    assert store.record(server_id, t0 + timedelta(seconds=5), {"processes": jitter}) == []
+    
+    changed = [{"pid": 1, "name": "init", "cpu": 0.9}, {"pid": 3, "name": "sshd", "cpu": 0.0}]
+    second = store.record(server_id, t0 + timedelta(seconds=10), {"processes": changed})
+    assert second[0]["data"] == {"upsert": [{"pid": 3, "name": "sshd", "cpu": 0.0}], "remove": ["2"]}
+    
+    rows = [(row["is_keyframe"], row["data"]) for row in first + second]
+    assert sorted(p["pid"] for p in rebuild_state("processes", rows)) == [1, 3]
+    
+    # Keyframe again once the interval has passed
+    third = store.record(server_id, t0 + timedelta(seconds=600), {"processes": changed})
+    assert third[0]["is_keyframe"] is True
+
+
+def test_recent_metrics_ring_buffer():
+    """Test the in-memory ring buffer wraps and answers covered ranges only"""
+    from datetime import datetime, timedelta, timezone
+    from app.services.recent_metrics import RecentMetrics
+    
+    recent = RecentMetrics(capacity=10)
+    t0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(15):
+        recent.append("s1", {"timestamp": (t0 + timedelta(seconds=i)).isoformat(), "cpu": {"usage_percent": float(i)}})
+    
+    # Samples 0-4 were overwritten
+    assert recent.get_buckets("s1", t0, t0 + timedelta(seconds=15), 5, ["cpu_usage_percent"]) is None
+    
+    buckets = recent.get_buckets("s1", t0 + timedelta(seconds=5), t0 + timedelta(seconds=15), 5, ["cpu_usage_percent", "disk_used_gb"])
+    assert [b["count"] for b in buckets] == [5, 5]
+    assert buckets[0]["cpu_usage_percent"] == {"avg": 7.0, "min": 5.0, "max": 9.0, "last": 9.0}
+    assert buckets[1]["timestamp"] == (t0 + timedelta(seconds=10)).isoformat()
+    assert buckets[1]["disk_used_gb"]["avg"] is None
+    assert recent.get_buckets("other", t0, t0 + timedelta(seconds=1), 5, ["cpu_usage_percent"]) is None
+
+
+def test_recent_metrics_restore_marks_coverage():
+    """Test a warm-started buffer answers ranges from its load window on"""
+    from datetime import datetime, timedelta, timezone
+    from app.services.recent_metrics import RecentMetrics
+    
+    recent = RecentMetrics(capacity=100)
+    since = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    samples = [(since + timedelta(seconds=30 + i * 5), {"cpu_usage_percent": 10.0}) for i in range(6)]
+    recent.restore("s1", since, samples)
+    
+    assert recent.has("s1")
+    buckets = recent.get_buckets("s1", since, since + timedelta(minutes=1), 60, ["cpu_usage_percent"])
+    assert buckets[0]["count"] == 6
+    assert buckets[0]["cpu_usage_percent"]["avg"] == 10.0
+    assert recent.get_buckets("s1", since - timedelta(seconds=1), since, 60, ["cpu_usage_percent"]) is None
+
+
+async def test_warm_start_fills_cache_from_latest_metrics_and_snapshots(monkeypatch, fake_session, fake_result):
+    """Test warm start loads the DISTINCT ON stream into the cache, keeps live entries and backfills history"""
+    from datetime import datetime, timedelta, timezone
+    from sqlalchemy.dialects import postgresql
+    from app.models.metric import Metric
+    from app.services import warm_start as warm_start_module
+    from app.services.recent_metrics import RecentMetrics
+    from app.services.warm_start import WarmStart
+    
+    fresh, live, legacy = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    now = datetime.now(timezone.utc)
+    latest = [
+        Metric(server_id=fresh, timestamp=now, cpu_usage_percent=12.5, extra_data=None),
+        Metric(server_id=live, timestamp=now, cpu_usage_percent=99.0, extra_data=None),
+        Metric(server_id=legacy, timestamp=now, cpu_usage_percent=1.0, extra_data={"containers": [{"id": "old"}]}),
+    ]
+    states = [(fresh, "containers", True, [{"id": "c1"}, {"id": "c2"}]), (fresh, "containers", False, {"remove": ["c2"]})]
+    series = [
+        (fresh, now - timedelta(seconds=20), 10.0, 50.0, None, None, None, None, None),
+        (fresh, now - timedelta(seconds=10), 20.0, 50.0, None, None, None, None, None),
+        (live, now - timedelta(seconds=10), 90.0, 50.0, None, None, None, None, None),
+    ]
+    sql = []
+    
+    def respond(statement, params):
+        sql.append(str(statement.compile(dialect=postgresql.dialect())))
+        if "DISTINCT ON (metrics.server_id)" in sql[-1]:
+            return fake_result([(metric,) for metric in latest])
+        if "inventory_snapshots" in sql[-1]:
+            return fake_result(states)
+        return fake_result(series)
+    
+    fake_session.respond = respond
+    recent = RecentMetrics(capacity=100)
+    recent.append(str(live), {"timestamp": now.isoformat(), "cpu": {"usage_percent": 99.0}})
+    monkeypatch.setattr(warm_start_module, "AsyncSessionLocal", lambda: fake_session)
+    monkeypatch.setattr(warm_start_module, "recent_metrics", recent)
+    
+    loader = WarmStart(max_age=timedelta(hours=1), history=True, history_window=timedelta(minutes=5))
+    cache = {str(live): {"server_id": str(live), "cpu": {"usage_percent": 50.0}}}
+    await loader.run(cache)
+    
+    assert len(sql) == 3
+    # Rows without extra_data take containers/processes from the snapshots; live entries are kept
+    assert cache[str(fresh)]["cpu"]["usage_percent"] == 12.5
+    assert cache[str(fresh)]["containers"] == [{"id": "c1"}]
+    assert cache[str(fresh)]["processes"] == []
+    assert cache[str(legacy)]["containers"] == [{"id": "old"}]
+    assert cache[str(live)]["cpu"]["usage_percent"] == 50.0
+    
+    # History is restored per server, except for the one already buffering live samples
+    buckets = recent.get_buckets(str(fresh), now - timedelta(minutes=4), now, 300, ["cpu_usage_percent"])
+    assert sum(bucket["count"] for bucket in buckets) == 2
+    buckets = recent.get_buckets(str(live), now, now + timedelta(seconds=1), 300, ["cpu_usage_percent"])
+    assert buckets[0]["cpu_usage_percent"]["last"] == 99.0
+    assert recent.get_buckets(str(live), now - timedelta(minutes=4), now, 300, ["cpu_usage_percent"]) is None
+    
+    stats = loader.stats()
+    assert (stats["servers_loaded"], stats["samples_loaded"], stats["skipped_reason"]) == (2, 3, None)
+
+
+async def test_warm_start_skips_with_distributed_bus(monkeypatch, fake_session):
+    """Test warm start leaves the cache empty when agents may reconnect to another worker"""
+    from datetime import timedelta
+    from app.services import warm_start as warm_start_module
+    from app.services.warm_start import WarmStart
+    
+    monkeypatch.setattr(warm_start_module.bus, "distributed", True)
+    monkeypatch.setattr(warm_start_module, "AsyncSessionLocal", lambda: fake_session)
+    loader = WarmStart(max_age=timedelta(hours=1), history=True, history_window=timedelta(minutes=5))
+    cache = {}
+    await loader.run(cache)
+    
+    assert cache == {}
+    assert fake_session.queries == 0
+    assert loader.stats()["skipped_reason"] == "distributed bus"
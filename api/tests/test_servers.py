@@ -53,3 +53,165 @@ def test_delete_server_unauthorized(client: TestClient):
     response = client.delete(f"/api/v1/servers/{fake_id}")
     
     assert response.status_code == 401
+
+
+def test_heartbeat_tracker_merges_fresher_last_seen():
+    """Test in-memory last_seen wins over an older database value and vice versa."""
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from app.services.heartbeat import HeartbeatTracker
+    
+    tracker = HeartbeatTracker(flush_interval=60)
+    server_id = uuid.uuid4()
+    now = datetime.now(timezone.utc)
+    
+    assert tracker.merge_last_seen(server_id, now) == now
+    
+    tracker.touch(server_id, now)
+    assert tracker.merge_last_seen(server_id, now - timedelta(minutes=5)) == now
+    assert tracker.merge_last_seen(server_id, now + timedelta(minutes=5)) == now + timedelta(minutes=5)
+    assert tracker.stats()["pending"] == 1
+
+
+def test_get_servers_overview_unauthorized(client: TestClient):
+    """Test the fleet overview requires authentication (and is not parsed as a server id)"""
+    response = client.get("/api/v1/servers/overview")
+    assert response.status_code == 401
+
+
+async def test_server_ownership_is_cached_until_invalidated(fake_session, fake_result):
+    """Test ownership checks hit the database once per (user, server) until a server change invalidates them."""
+    import uuid
+    from app.services import server_service
+    from app.services.bus import bus
+    
+    user_id, owned_id, other_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    
+    def respond(query, params):
+        # Only `owned_id` belongs to the user
+        values = []
+        for value in query.compile().params.values():
+            values.extend(value if isinstance(value, list) else [value])
+        return fake_result([(owned_id,)] if owned_id in values else [])
+    
+    db = fake_session
+    db.respond = respond
+    assert await server_service.user_owns_server(db, owned_id, user_id)
+    assert await server_service.user_owns_server(db, owned_id, user_id)
+    assert db.queries == 1
+    
+    # Only the server not seen before is queried
+    owned = await server_service.get_owned_server_ids(db, user_id, [owned_id, other_id])
+    assert owned == [owned_id]
+    assert db.queries == 2
+    assert not await server_service.user_owns_server(db, other_id, user_id)
+    assert db.queries == 2
+    
+    await bus.invalidate("server_owner", str(owned_id))
+    assert await server_service.user_owns_server(db, owned_id, user_id)
+    assert db.queries == 3
+
+
+async def test_servers_overview_groups_alert_counts_and_reads_cached_metrics(monkeypatch, fake_session, fake_result):
+    """Test the overview counts open alerts in one grouped query and only queries metrics missing from the cache"""
+    import uuid
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+    from sqlalchemy.dialects import postgresql
+    from app.api.v1 import servers as servers_module
+    from app.models.metric import Metric
+    from app.models.server import Server, ServerStatus, HealthStatus
+    
+    user = SimpleNamespace(id=uuid.uuid4())
+    cached, stored, silent = (
+        Server(id=uuid.uuid4(), name=name, host="10.0.0.1", status=ServerStatus.ONLINE, health_status=HealthStatus.HEALTHY)
+        for name in ("a-cached", "b-stored", "c-silent")
+    )
+    now = datetime.now(timezone.utc)
+    sql = []
+    
+    def respond(statement, params):
+        sql.append(str(statement.compile(dialect=postgresql.dialect())))
+        if len(sql) == 1:
+            # (server, info, warning, critical)
+            return fake_result([(cached, 0, 2, 1), (stored, 0, 0, 0), (silent, 3, 0, 0)])
+        return fake_result([(Metric(server_id=stored.id, timestamp=now, cpu_usage_percent=40.0),)])
+    
+    fake_session.respond = respond
+    monkeypatch.setitem(servers_module.metrics_cache, str(cached.id), {
+        "timestamp": now.isoformat(), "cpu": {"usage_percent": 75.0}, "containers": [{"id": "c1"}],
+    })
+    body = await servers_module.get_servers_overview(db=fake_session, current_user=user)
+    
+    # One grouped query for servers and counts, one for the metrics of the servers not cached
+    assert len(sql) == 2
+    assert "count(alerts.id) FILTER (WHERE alerts.severity = " in sql[0]
+    assert "alerts.resolved IS false" in sql[0] and "GROUP BY servers.id" in sql[0]
+    assert "DISTINCT ON (metrics.server_id)" in sql[1]
+    missing = [value for value in fake_session.statements[1][0].compile(dialect=postgresql.dialect()).params.values() if isinstance(value, list)]
+    assert missing == [[stored.id, silent.id]]
+    
+    assert body["total"] == 3
+    overview = {server["name"]: server for server in body["servers"]}
+    assert overview["a-cached"]["open_alerts"] == {"info": 0, "warning": 2, "critical": 1}
+    assert overview["c-silent"]["open_alerts"] == {"info": 3, "warning": 0, "critical": 0}
+    assert overview["a-cached"]["metrics"]["cpu"] == {"usage_percent": 75.0}
+    assert "containers" not in overview["a-cached"]["metrics"]
+    assert overview["b-stored"]["metrics"]["cpu"]["usage_percent"] == 40.0
+    assert overview["c-silent"]["metrics"] is None
+    assert overview["a-cached"]["status"] == "online"
+
+
+async def test_bulk_update_last_seen_keeps_newest_and_tracker_flushes_on_stop(monkeypatch, fake_session, fake_result):
+    """Test last_seen is written with GREATEST from aligned arrays, and pending beats survive failures and are flushed on stop"""
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from app.crud import server as crud_server
+    from app.services import heartbeat as heartbeat_module
+    from app.services.heartbeat import HeartbeatTracker
+    
+    now = datetime.now(timezone.utc)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    db = fake_session
+    db.respond = lambda statement, params: fake_result(rowcount=len(params["server_ids"]))
+    
+    assert await crud_server.bulk_update_last_seen(db, {}) == 0
+    assert db.queries == 0
+    assert await crud_server.bulk_update_last_seen(db, {first: now, second: now - timedelta(seconds=5)}) == 2
+    statement, params = db.statements[0]
+    # An older beat never moves last_seen back
+    assert "GREATEST(servers.last_seen, beats.last_seen)" in str(statement)
+    assert dict(zip(params["server_ids"], params["timestamps"])) == {first: now, second: now - timedelta(seconds=5)}
+    assert db.commits == 1
+    
+    failing = [True]
+    
+    def respond(statement, params):
+        if failing[0]:
+            raise ConnectionError("database unavailable")
+        return fake_result(rowcount=len(params["server_ids"]))
+    
+    db.respond = respond
+    db.statements.clear()
+    monkeypatch.setattr(heartbeat_module, "AsyncSessionLocal", lambda: db)
+    tracker = HeartbeatTracker(flush_interval=3600)
+    tracker.start()
+    tracker.touch(first, now - timedelta(seconds=10))
+    tracker.touch(first, now - timedelta(seconds=2))
+    
+    # A failed flush keeps the beat; a newer one arriving meanwhile replaces it
+    try:
+        await tracker.flush()
+    except ConnectionError:
+        pass
+    assert tracker.stats()["pending"] == 1
+    tracker.touch(first, now)
+    tracker.touch(second, now)
+    assert tracker.stats()["pending"] == 2
+    
+    failing[0] = False
+    await tracker.stop()
+    params = db.statements[-1][1]
+    assert dict(zip(params["server_ids"], params["timestamps"])) == {first: now, second: now}
+    stats = tracker.stats()
+    assert (stats["pending"], stats["flushes"], stats["failed_flushes"], stats["rows_updated"]) == (0, 1, 1, 2)
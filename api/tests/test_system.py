@@ -0,0 +1,8 @@
+from fastapi.testclient import TestClient
+
+
+def test_get_system_stats_unauthorized(client: TestClient):
+    """Test getting pipeline stats without authentication returns 401."""
+    response = client.get("/api/v1/system/stats")
+    
+    assert response.status_code == 401
@@ -0,0 +1,39 @@
+def test_timer_wheel_fires_due_timers_on_advance():
+    """Test timers fire on the first tick at or after their delay, never early, including after a full turn"""
+    from app.core.timer_wheel import TimerWheel
+
+    fired = []
+    wheel = TimerWheel(tick=0.05, slots=4, callback=fired.append, autorun=False)
+    wheel.schedule("a", 0.05)
+    wheel.schedule("b", 0.12)
+    # Longer than one turn of the wheel: stays in its slot until its due tick
+    wheel.schedule("c", 0.3)
+    wheel.schedule("d", 0)
+
+    assert wheel.advance() == 2
+    assert sorted(fired) == ["a", "d"]
+    assert wheel.advance(2) == 1
+    assert fired[-1] == "b"
+    assert wheel.advance(2) == 0
+    assert wheel.advance() == 1
+    assert fired[-1] == "c"
+    assert wheel.stats() == {"pending": 0, "scheduled": 4, "fired": 4, "errors": 0}
+
+
+def test_timer_wheel_counts_callback_errors():
+    """Test a failing callback does not stop other timers in the same tick"""
+    from app.core.timer_wheel import TimerWheel
+
+    fired = []
+
+    def callback(key):
+        if key == "bad":
+            raise RuntimeError("boom")
+        fired.append(key)
+
+    wheel = TimerWheel(tick=1.0, slots=8, callback=callback, autorun=False)
+    wheel.schedule("bad", 1.0)
+    wheel.schedule("good", 1.0)
+    assert wheel.advance() == 2
+    assert fired == ["good"]
+    assert wheel.stats()["errors"] == 1
@@ -0,0 +1,30 @@
+def test_stream_subscription_messages_are_validated():
+    """Test malformed subscribe messages are rejected instead of crashing the connection"""
+    import uuid
+    from app.api.v1.ws import _parse_subscription, _parse_projection
+    from app.services.ws_manager import ALL_TOPICS
+
+    server_id = uuid.uuid4()
+    server_ids, topics, invalid = _parse_subscription({"servers": [str(server_id), "nope"]})
+    assert server_ids == [server_id]
+    assert topics == set(ALL_TOPICS)
+    assert invalid == ["nope"]
+
+    for msg, error in [
+        ({"servers": str(server_id)}, "servers must be a list"),
+        ({"servers": [], "topics": "metrics"}, "topics must be a list of strings"),
+        ({"servers": [], "topics": [["metrics"]]}, "topics must be a list of strings"),
+        ({"servers": [], "topics": ["metrics", "secrets"]}, "Unknown topics: secrets"),
+    ]:
+        try:
+            _parse_subscription(msg)
+            assert False, msg
+        except ValueError as e:
+            assert str(e) == error
+
+    # Unhashable field values surface as TypeError/ValueError, which the endpoint reports
+    try:
+        _parse_projection({"fields": [["cpu"]]})
+        assert False
+    except (TypeError, ValueError):
+        pass
@@ -0,0 +1,145 @@
+async def test_dashboard_fanout_isolates_slow_clients(fake_websocket):
+    """Test that a stuck client is evicted without delaying others and metrics are conflated"""
+    import asyncio
+    from app.services.ws_manager import ConnectionManager
+
+    manager = ConnectionManager(max_queue=3, send_timeout=5.0)
+    fast, slow = fake_websocket(), fake_websocket(stuck=True)
+    await manager.connect(fast, "s1")
+    await manager.connect(slow, "s1")
+
+    for i in range(5):
+        await manager._on_stream_event({"server_id": "s1", "type": "metrics", "data": {"n": i}})
+    await asyncio.sleep(0)
+    # Five log frames overflow the stuck client's queue of three
+    for i in range(5):
+        await manager._on_stream_event({"server_id": "s1", "type": "log", "data": {"n": i}})
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+
+    assert [f["data"]["n"] for f in fast.frames if f["type"] == "log"] == [0, 1, 2, 3, 4]
+    # Only the newest pending metrics frame is sent
+    assert [f["data"]["n"] for f in fast.frames if f["type"] == "metrics"] == [4]
+    assert slow.closed_with == 1013
+    assert [c.websocket for c in manager.active_connections["s1"]] == [fast]
+    assert manager.stats()["evicted"] == 1
+
+    manager.disconnect(fast, "s1")
+    assert "s1" not in manager.active_connections
+
+
+async def test_multiplexed_client_receives_subscribed_topics_only(fake_websocket):
+    """Test one client subscribed to several servers gets only the topics it asked for"""
+    import asyncio
+    from app.services.ws_manager import ConnectionManager
+
+    manager = ConnectionManager(max_queue=10, send_timeout=5.0)
+    websocket = fake_websocket()
+    client = manager.open(websocket)
+    manager.subscribe(client, "s1", {"metrics"})
+    manager.subscribe(client, "s2", {"metrics", "logs"})
+
+    await manager._on_stream_event({"server_id": "s1", "type": "log", "data": {}})
+    await manager._on_stream_event({"server_id": "s2", "type": "log", "data": {}})
+    await manager._on_stream_event({"server_id": "s1", "type": "metrics", "data": {}})
+    await manager._on_stream_event({"server_id": "s2", "type": "metrics", "data": {}})
+    await asyncio.sleep(0.01)
+
+    assert sorted((f["server_id"], f["type"]) for f in websocket.frames) == [
+        ("s1", "metrics"), ("s2", "log"), ("s2", "metrics"),
+    ]
+
+    manager.unsubscribe(client, "s2", {"metrics", "logs"})
+    assert set(manager.active_connections) == {"s1"}
+    manager.close(client)
+    assert manager.active_connections == {}
+
+
+async def test_projected_delta_metrics_frames(fake_websocket):
+    """Test projected subscribers get one full frame, then only changes beyond epsilon"""
+    import asyncio
+    from app.services.ws_manager import ConnectionManager
+    from app.services.metrics_projection import Projection
+
+    manager = ConnectionManager(max_queue=10, send_timeout=5.0)
+    websocket = fake_websocket()
+    client = manager.open(websocket)
+    projection = Projection(("cpu.usage_percent", "memory"), delta=True, epsilon=0.5)
+    manager.subscribe(client, "s1", {"metrics"}, projection)
+
+    def sample(cpu, memory):
+        return {"cpu": {"usage_percent": cpu, "cores": 8}, "memory": {"usage_percent": memory}, "processes": [1, 2]}
+
+    for cpu, memory in [(10.0, 50.0), (10.2, 50.0), (11.0, 50.0), (11.0, 50.0)]:
+        await manager._on_stream_event({"server_id": "s1", "type": "metrics", "data": sample(cpu, memory)})
+        await asyncio.sleep(0.001)
+
+    assert [(f["type"], f["data"]) for f in websocket.frames] == [
+        ("metrics", {"cpu": {"usage_percent": 10.0}, "memory": {"usage_percent": 50.0}}),
+        ("metrics_delta", {"cpu": {"usage_percent": 11.0}}),
+    ]
+    manager.close(client)
+    assert manager.stats()["delta_encoders"] == 0
+
+
+async def test_subscribe_without_projection_keeps_existing_projection(fake_websocket):
+    """Test a later subscribe that only adds topics does not reset the metrics projection"""
+    from app.services.ws_manager import ConnectionManager
+    from app.services.metrics_projection import Projection
+
+    manager = ConnectionManager(max_queue=10, send_timeout=5.0)
+    client = manager.open(fake_websocket())
+    projection = Projection(("cpu.usage_percent",), delta=True, epsilon=0.5)
+    manager.subscribe(client, "s1", {"metrics"}, projection)
+    manager.subscribe(client, "s1", {"logs"}, None, replace_projection=False)
+    assert client.subscriptions["s1"].projection == projection
+    assert client.subscriptions["s1"].topics == {"metrics", "logs"}
+
+    manager.subscribe(client, "s1", {"metrics"}, None)
+    assert client.subscriptions["s1"].projection is None
+    manager.close(client)
+
+
+async def _drain():
+    """Let client writer tasks send what is queued (no wall-clock waiting)"""
+    import asyncio
+
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def test_rate_limited_subscribers_get_newest_sample_per_interval(fake_websocket):
+    """Test a max_rate subscription conflates a burst to the newest sample"""
+    from app.services.ws_manager import ConnectionManager
+    from app.services.metrics_projection import Projection
+
+    now = [100.0]
+    manager = ConnectionManager(max_queue=10, send_timeout=5.0, clock=lambda: now[0], autorun_timers=False)
+    limited, unlimited = fake_websocket(), fake_websocket()
+    client = manager.open(limited)
+    manager.subscribe(client, "s1", {"metrics"}, Projection(None, False, 0.0, min_interval=0.2))
+    await manager.connect(unlimited, "s1")
+
+    for i in range(5):
+        await manager._on_stream_event({"server_id": "s1", "type": "metrics", "data": {"n": i}})
+        await _drain()
+        now[0] += 0.01
+
+    # The first sample goes out at once; the rest are held until the window ends (4 ticks of 50 ms)
+    assert [f["data"]["n"] for f in limited.frames] == [0]
+    assert [f["data"]["n"] for f in unlimited.frames] == [0, 1, 2, 3, 4]
+    assert manager._wheel.advance(3) == 0
+    now[0] = 100.2
+    assert manager._wheel.advance(1) == 1
+    await _drain()
+    assert [f["data"]["n"] for f in limited.frames] == [0, 4]
+
+    # The next sample falls in the window that started with the release
+    await manager._on_stream_event({"server_id": "s1", "type": "metrics", "data": {"n": 5}})
+    await _drain()
+    assert [f["data"]["n"] for f in limited.frames] == [0, 4]
+    # Rounded up to whole ticks, so it may take one more than 0.2 / 0.05
+    assert manager._wheel.advance(5) == 1
+    await _drain()
+    assert [f["data"]["n"] for f in limited.frames] == [0, 4, 5]
+    await manager.stop()